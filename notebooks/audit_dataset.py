@@ -1,7 +1,7 @@
 import pandas as pd
 import re
 
-DIAMOND_FILE = r"c:\projetos\projeto-censo\data\diamond\censo_2022_diamond_features_final.parquet"
+DIAMOND_FILE = r"c:\projetos\projeto-censo\data\diamond\censo_2022_diamond_features_final"
 
 df = pd.read_parquet(DIAMOND_FILE)
 cols = df.columns.tolist()
@@ -1,23 +1,23 @@
-import pandas as pd
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from census_dictionary import load_dictionary_table
 
 dict_path = r'C:\projetos\projeto-censo\data\raw\dicionario_de_dados_agregados_por_setores_censitarios_20250417.xlsx'
 
 try:
-    # Read all sheets to find the one with Parentesco
-    xls = pd.ExcelFile(dict_path)
-    print("Sheets:", xls.sheet_names)
+    # Compiled dictionary (cached per xlsx version)
+    table = load_dictionary_table(dict_path)
+    print("Sheets:", table['sheet'].unique().tolist())
     
-    for sheet in xls.sheet_names:
-        if 'parentesco' in sheet.lower() or 'agregados' in sheet.lower():
-            df = pd.read_excel(dict_path, sheet_name=sheet)
-            # Look for V01042
-            row = df[df.iloc[:, 0].astype(str).str.contains('V01042', na=False)]
-            if not row.empty:
-                print(f"--- Sheet: {sheet} ---")
-                # Print V01042 and next few rows
-                start_idx = row.index[0]
-                print(df.iloc[start_idx:start_idx+10, :2].to_string())
-                break
+    hits = table[table['code'] == 'V01042']
+    if not hits.empty:
+        sheet = hits['sheet'].iloc[0]
+        print(f"--- Sheet: {sheet} ---")
+        # Print V01042 and next few rows
+        df = table[table['sheet'] == sheet].reset_index(drop=True)
+        start_idx = df.index[df['code'] == 'V01042'][0]
+        print(df.loc[start_idx:start_idx+9, ['code', 'description']].to_string())
 except Exception as e:
     print(f"Error: {e}")
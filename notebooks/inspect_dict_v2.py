@@ -1,21 +1,22 @@
-import pandas as pd
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from census_dictionary import load_dictionary_table
 
 dict_path = r'C:\projetos\projeto-censo\data\raw\dicionario_de_dados_agregados_por_setores_censitarios_20250417.xlsx'
 
 try:
-    xls = pd.ExcelFile(dict_path)
+    table = load_dictionary_table(dict_path)
     target_sheet = 'Dicionário não PCT'
-    if target_sheet in xls.sheet_names:
-        df = pd.read_excel(dict_path, sheet_name=target_sheet)
-        
-        # Search for V01042 in any column
-        mask = df.apply(lambda x: x.astype(str).str.contains('V01042', na=False))
-        if mask.any().any():
-            row_idx = mask.any(axis=1).idxmax()
+    df = table[table['sheet'] == target_sheet].reset_index(drop=True)
+    if not df.empty:
+        hits = df.index[df['code'] == 'V01042']
+        if len(hits):
+            row_idx = hits[0]
             print(f"Found V01042 at index {row_idx}")
-            # Print surrounding rows (columns 0 and 1 usually have code and desc)
-            print(df.iloc[row_idx:row_idx+20, :2].to_string())
+            # Print surrounding rows (code and description)
+            print(df.loc[row_idx:row_idx+19, ['code', 'description']].to_string())
         else:
             print("V01042 not found.")
 
@@ -2,10 +2,14 @@ import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from sector_key import normalize_sector_key
 
 # Config
 DATA_DIR = r'C:\projetos\projeto-censo\data'
-DIAMOND_PATH = os.path.join(DATA_DIR, 'diamond', 'censo_2022_spatial_features.parquet')
+DIAMOND_PATH = os.path.join(DATA_DIR, 'diamond', 'censo_2022_spatial_features')
 SPATIAL_PATH = os.path.join(DATA_DIR, 'spatial', 'malha_setores_2022.parquet')
 PLOT_DIR = r'C:\projetos\projeto-censo\plots'
 MUNI_NAME = 'São José dos Campos'
@@ -27,11 +31,8 @@ def main():
     print(f"Filtrando por {MUNI_NAME}...")
     gdf_muni = gdf_spatial[gdf_spatial['name_muni'] == MUNI_NAME].copy()
     
-    # Garantir chave de join
-    if pd.api.types.is_float_dtype(gdf_muni['code_tract']):
-        gdf_muni['code_tract'] = gdf_muni['code_tract'].astype(int).astype(str)
-    else:
-        gdf_muni['code_tract'] = gdf_muni['code_tract'].astype(str)
+    # Garantir chave de join (int64, mesma do Diamond)
+    gdf_muni['code_tract'] = normalize_sector_key(gdf_muni['code_tract'])
         
     print(f"Setores encontrados: {len(gdf_muni)}")
     
@@ -1,44 +1,53 @@
-import pandas as pd
-import geopandas as gpd
 import plotly.express as px
 import os
+import sys
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from sector_dataset import read_sectors, lookup_municipio, dataset_columns
+
 # Config
 DATA_DIR = r'C:\projetos\projeto-censo\data'
-DIAMOND_PATH = os.path.join(DATA_DIR, 'diamond', 'censo_2022_spatial_features.parquet')
-SPATIAL_PATH = os.path.join(DATA_DIR, 'spatial', 'malha_setores_2022.parquet')
+# Datasets particionados por UF: só a UF do município é aberta, e dentro dela
+# só os row groups com os setores do município
+DIAMOND_PATH = os.path.join(DATA_DIR, 'diamond', 'censo_2022_spatial_features')
+SPATIAL_PATH = os.path.join(DATA_DIR, 'spatial', 'malha_setores_2022_final')
 PLOT_DIR = r'C:\projetos\projeto-censo\plots'
 MUNI_NAME = 'São José dos Campos'
 
 os.makedirs(PLOT_DIR, exist_ok=True)
 
+FEATURES_TO_PLOT = [
+    ('spatial_smooth_income_k5', 'Renda Média (Suavizada K=5)', 'Viridis'),
+    ('spatial_lag_income_ratio', 'Ratio Renda (Eu / Vizinhos)', 'RdBu'),
+    ('expert_spatial_cluster_income', 'Clusters de Renda (LISA)', 'Jet'),
+    ('spatial_smooth_mortality_k5', 'Mortalidade Jovem (Suavizada K=5)', 'Reds')
+]
+
 def main():
     print(f"--- Inspecionando Resultados (Plotly) para: {MUNI_NAME} ---")
     
-    # 1. Carregar Features (Diamond)
-    print("Carregando Features Diamond...")
-    df_diamond = pd.read_parquet(DIAMOND_PATH)
-    
-    # 2. Carregar Malha (Apenas colunas necessárias para filtro e geometria)
-    print("Carregando Malha Espacial...")
-    gdf_spatial = gpd.read_parquet(SPATIAL_PATH)
-    
-    # 3. Filtrar Município
-    print(f"Filtrando por {MUNI_NAME}...")
-    gdf_muni = gdf_spatial[gdf_spatial['name_muni'] == MUNI_NAME].copy()
-    
-    # Garantir chave de join
-    if pd.api.types.is_float_dtype(gdf_muni['code_tract']):
-        gdf_muni['code_tract'] = gdf_muni['code_tract'].astype(int).astype(str)
-    else:
-        gdf_muni['code_tract'] = gdf_muni['code_tract'].astype(str)
-        
+    # 1. Código do município (lê só id_municipio/nm_municipio da malha)
+    municipios = lookup_municipio(SPATIAL_PATH, MUNI_NAME)
+    if not municipios:
+        print(f"Município {MUNI_NAME} não encontrado na malha.")
+        return
+    print(f"Código(s) IBGE: {municipios}")
+
+    # 2. Carregar Malha (só o município, só geometria + bairro)
+    print("Carregando Malha Espacial do município...")
+    gdf_muni = read_sectors(SPATIAL_PATH, municipio=municipios, columns=['geometry', 'nm_bairro'])
     print(f"Setores encontrados: {len(gdf_muni)}")
+
+    # 3. Carregar Features (Diamond) do município, só as colunas plotadas
+    print("Carregando Features Diamond do município...")
+    available = set(dataset_columns(DIAMOND_PATH))
+    df_diamond = read_sectors(DIAMOND_PATH, municipio=municipios,
+                              columns=[c for c, _, _ in FEATURES_TO_PLOT if c in available], key='CD_SETOR')
     
     # 4. Join
     print("Realizando Join...")
-    gdf_final = gdf_muni.merge(df_diamond, left_on='code_tract', right_on='code_tract', how='inner')
+    gdf_final = gdf_muni.merge(df_diamond, left_on='id_setor', right_on='CD_SETOR', how='inner')
     print(f"Setores com features: {len(gdf_final)}")
     
     # Converter para GeoJSON (necessário para Plotly Choropleth)
@@ -47,14 +56,7 @@ def main():
     gdf_final['geometry'] = gdf_final['geometry'].simplify(tolerance=0.0001)
     
     # 5. Plots Interativos
-    features_to_plot = [
-        ('spatial_smooth_income_k5', 'Renda Média (Suavizada K=5)', 'Viridis'),
-        ('spatial_lag_income_ratio', 'Ratio Renda (Eu / Vizinhos)', 'RdBu'),
-        ('expert_spatial_cluster_income', 'Clusters de Renda (LISA)', 'Jet'),
-        ('spatial_smooth_mortality_k5', 'Mortalidade Jovem (Suavizada K=5)', 'Reds')
-    ]
-    
-    for col, title, cmap in features_to_plot:
+    for col, title, cmap in FEATURES_TO_PLOT:
         if col not in gdf_final.columns:
             print(f"⚠️ Coluna {col} não encontrada.")
             continue
@@ -74,7 +76,7 @@ def main():
             center={"lat": gdf_final.geometry.centroid.y.mean(), "lon": gdf_final.geometry.centroid.x.mean()},
             opacity=0.6,
             title=f"{MUNI_NAME} - {title}",
-            hover_data=['name_neighborhood', col]
+            hover_data=['nm_bairro', col]
         )
         
         output_file = os.path.join(PLOT_DIR, f"{MUNI_NAME}_{col}.html")
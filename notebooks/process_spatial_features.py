@@ -1,18 +1,32 @@
 import os
+import sys
 import pandas as pd
-import geopandas as gpd
 import numpy as np
-from libpysal.weights import KNN
 from esda.moran import Moran_Local
 import duckdb
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from sector_dataset import write_partitioned
+from sector_centroids import ensure_centroid_table, centroid_coords, GEOGRAPHIC_CRS
+from spatial_weights import WeightsCache
+from sector_key import normalize_sector_key
+
 # --- CONFIGURAÇÃO ---
 DATA_DIR = r'C:\projetos\projeto-censo\data'
 GOLD_PATH = os.path.join(DATA_DIR, 'gold', 'censo_2022_features_final.parquet')
 SPATIAL_PATH = os.path.join(DATA_DIR, 'spatial', 'malha_setores_2022.parquet')
+# Centróides pré-calculados da malha (src/sector_centroids.py)
+CENTROIDS_PATH = os.path.join(DATA_DIR, 'spatial', 'malha_setores_2022_centroids.parquet')
+# Cache dos grafos de vizinhança (src/spatial_weights.py), compartilhado com o heavy
+WEIGHTS_DIR = os.path.join(DATA_DIR, 'spatial', 'weights_cache')
+# Vizinhança: 'knn' (K=5 nos centróides) ou 'queen'/'rook' (setores que encostam
+# no polígono, src/spatial_contiguity.py). Define o sufixo das features (_k5 / _queen).
+WEIGHTS_KIND = 'knn'
+W_SUFFIX = 'k5' if WEIGHTS_KIND == 'knn' else WEIGHTS_KIND
 OUTPUT_DIR = os.path.join(DATA_DIR, 'diamond')
-OUTPUT_PATH = os.path.join(OUTPUT_DIR, 'censo_2022_spatial_features.parquet')
+# Dataset particionado por UF (id_uf=XX/), ordenado por CD_SETOR (ver src/sector_dataset.py)
+OUTPUT_PATH = os.path.join(OUTPUT_DIR, 'censo_2022_spatial_features')
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -25,22 +39,19 @@ def main():
     # 1. CARREGAR DADOS
     log("Carregando dados Gold (Tabular)...")
     df_gold = pd.read_parquet(GOLD_PATH)
+    df_gold['CD_SETOR'] = normalize_sector_key(df_gold['CD_SETOR'])
     log(f"Gold carregado: {df_gold.shape}")
 
-    log("Carregando Malha Espacial (Geometria)...")
-    gdf_spatial = gpd.read_parquet(SPATIAL_PATH)
-    # Garantir que code_tract é string para o join (Remover .0 se for float)
-    if pd.api.types.is_float_dtype(gdf_spatial['code_tract']):
-        gdf_spatial['code_tract'] = gdf_spatial['code_tract'].astype(np.int64).astype(str)
-    else:
-        gdf_spatial['code_tract'] = gdf_spatial['code_tract'].astype(str)
+    log("Carregando Malha Espacial (atributos, sem geometria)...")
+    cols_spatial = ['code_tract', 'name_neighborhood', 'name_muni', 'name_state']
+    gdf_spatial = pd.read_parquet(SPATIAL_PATH, columns=cols_spatial)
+    # Chave canônica int64 para o join (code_tract vem float da malha)
+    gdf_spatial['code_tract'] = normalize_sector_key(gdf_spatial['code_tract'])
         
     log(f"Malha carregada: {gdf_spatial.shape}")
 
     # 2. JOIN (Tabular + Espacial)
     log("Realizando Join Espacial...")
-    # Filtrar colunas da malha para economizar memória
-    cols_spatial = ['code_tract', 'geometry', 'name_neighborhood', 'name_muni', 'name_state']
     gdf = gdf_spatial[cols_spatial].merge(df_gold, left_on='code_tract', right_on='CD_SETOR', how='inner')
     
     # Limpar memória
@@ -70,29 +81,39 @@ def main():
         else:
             log(f"⚠️ Coluna {col} não encontrada! Pulando...")
 
-    # 4. CONSTRUIR MATRIZ DE PESOS (KNN)
-    # Vamos usar K=5 para "Micro-vizinhança"
-    log("Calculando Matriz de Pesos KNN (K=5)... isso pode demorar um pouco...")
-    # Usando os centróides para performance (muito mais rápido que polígonos)
-    centroids = gdf.geometry.centroid
-    w_k5 = KNN.from_dataframe(gdf, k=5, geom_col='geometry') # Libpysal usa centroids automaticamente se passar poligono, ou podemos passar centroids
-    w_k5.transform = 'r' # Row-standardized (média)
+    # 4. CONSTRUIR MATRIZ DE PESOS (KNN ou contiguidade)
+    # Grafo salvo em disco na primeira execução; as seguintes só o leem
+    weights = WeightsCache(WEIGHTS_DIR, SPATIAL_PATH)
+    if WEIGHTS_KIND == 'knn':
+        # Vamos usar K=5 para "Micro-vizinhança"
+        log("Calculando Matriz de Pesos KNN (K=5)... isso pode demorar um pouco...")
+        # Centróides em lat/lon da tabela pré-calculada: os mesmos pontos que o
+        # KNN.from_dataframe tiraria dos polígonos, sem ler nem processar a geometria
+        ensure_centroid_table(SPATIAL_PATH, CENTROIDS_PATH)
+        centroids = centroid_coords(CENTROIDS_PATH, gdf['code_tract'], GEOGRAPHIC_CRS)
+        graph = weights.knn(gdf['code_tract'], centroids, GEOGRAPHIC_CRS, k=5)
+    else:
+        log(f"Calculando Matriz de Contiguidade ({WEIGHTS_KIND})...")
+        graph = weights.contiguity(gdf['code_tract'], WEIGHTS_KIND)
+        log(f"  {len(graph.islands)} setores sem vizinhos (ilhas: lag = 0)")
+    w = graph.to_W()
+    w.transform = 'r' # Row-standardized (média)
     
-    log("Matriz KNN-5 calculada.")
+    log(f"Matriz de pesos ({W_SUFFIX}) calculada.")
 
     # 5. CAMADA 1: CONTEXTO (SMOOTHING)
     log("Gerando Features de Contexto (Smoothing)...")
     
-    for name, col in targets.items():
-        if col not in gdf.columns: continue
-        
-        # Lag Espacial (Média dos vizinhos)
-        # pysal.lag_spatial calcula a média dos vizinhos (se w for row-standardized)
-        import libpysal
-        
+    # Lag Espacial (Média dos vizinhos) de todos os alvos de uma vez: uma
+    # multiplicação esparsa (pesos row-standardized) sobre a matriz N x C,
+    # o mesmo que lag_spatial coluna a coluna
+    present = [(name, col) for name, col in targets.items() if col in gdf.columns]
+    lags = graph.lag(gdf[[col for _, col in present]].to_numpy(dtype=np.float64))
+    
+    for j, (name, col) in enumerate(present):
         # Feature: Smooth (Média Vizinhos)
-        smooth_col = f'spatial_smooth_{name}_k5'
-        gdf[smooth_col] = libpysal.weights.lag_spatial(w_k5, gdf[col])
+        smooth_col = f'spatial_smooth_{name}_{W_SUFFIX}'
+        gdf[smooth_col] = lags[:, j]
         log(f"  -> Criada: {smooth_col}")
 
     # 6. CAMADA 2: FRICÇÃO & SEGREGAÇÃO (LAGS)
@@ -101,7 +122,7 @@ def main():
     for name, col in targets.items():
         if col not in gdf.columns: continue
         
-        smooth_col = f'spatial_smooth_{name}_k5'
+        smooth_col = f'spatial_smooth_{name}_{W_SUFFIX}'
         
         # Feature: Ratio (Eu / Vizinhos)
         # Adiciona 0.001 para evitar divisão por zero
@@ -121,7 +142,7 @@ def main():
         
         log(f"  Calculando LISA para {name}...")
         # Moran Local
-        moran = Moran_Local(gdf[col], w_k5)
+        moran = Moran_Local(gdf[col], w)
         
         # Feature: Cluster Category (q)
         # 1=HH, 2=LH, 3=LL, 4=HL
@@ -149,7 +170,7 @@ def main():
     
     df_final = pd.DataFrame(gdf[cols_to_keep]) # Drop geometry conversion
     
-    df_final.to_parquet(OUTPUT_PATH)
+    write_partitioned(df_final, OUTPUT_PATH, key='CD_SETOR')
     log(f"🎉 SUCESSO! Arquivo salvo em: {OUTPUT_PATH}")
     log(f"Total de Features Espaciais: {len(cols_to_keep) - 2}")
 
@@ -1,14 +1,12 @@
 import os
+import sys
 import time
 import warnings
 import gc
 import numpy as np
 import pandas as pd
-import geopandas as gpd
-from scipy.spatial import cKDTree
+import pyarrow.parquet as pq
 from joblib import Parallel, delayed
-from libpysal.weights import KNN
-from esda.moran import Moran_Local
 
 # ==============================================================================
 # CONFIGURATION
@@ -19,9 +17,30 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
 DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
 
+# Engines compartilhados (src/)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'src'))
+from spatial_gravity import calculate_gravity
+from spatial_weights import WeightsCache, SpatialWeights
+from spatial_contiguity import CONTIGUITY_KINDS
+from spatial_stats import prefix_means
+from shared_arrays import SharedArrayStore
+from diamond_writer import DiamondDatasetWriter, tile_dir, read_tiles_index, write_tiles_index
+from diamond_tiles import build_tiles, tile_selected, add_graph_neighbors
+from sector_centroids import ensure_centroid_table, centroid_coords
+from sector_key import normalize_sector_key, key_array, SECTOR_KEY_VERSION
+from lineage import LineageManifest
+
 GOLD_PATH = os.path.join(DATA_DIR, 'gold', 'censo_2022_features_final.parquet')
 SPATIAL_PATH = os.path.join(DATA_DIR, 'spatial', 'malha_setores_2022.parquet')
-OUTPUT_FILE = os.path.join(DATA_DIR, 'diamond', 'censo_2022_diamond_features.parquet')
+# Centróides pré-calculados da malha (src/sector_centroids.py): a geometria não é lida
+CENTROIDS_PATH = os.path.join(DATA_DIR, 'spatial', 'malha_setores_2022_centroids.parquet')
+# Dataset Parquet (uma pasta por família de features + _manifest.json, sem geometria)
+OUTPUT_DIR = os.path.join(DATA_DIR, 'diamond', 'censo_2022_diamond_features')
+# Cache de grafos de vizinhança por malha/CRS/k/raio (src/spatial_weights.py):
+# mudar as features não refaz os vizinhos
+WEIGHTS_DIR = os.path.join(DATA_DIR, 'spatial', 'weights_cache')
+# Arrays memory-mapped compartilhados com os workers (removidos ao final)
+SHARED_DIR = os.path.join(DATA_DIR, 'diamond', '_shared')
 
 # CRS Configuration
 # EPSG:4674 is SIRGAS 2000 (Lat/Lon)
@@ -31,170 +50,252 @@ TARGET_CRS = "EPSG:5880"
 
 # Parallelization Settings
 # n_jobs=-1 uses all available cores. 
+# Features e vizinhos são compartilhados via memmap (não são copiados por worker),
+# então o custo de memória por worker é só o lote de colunas em processamento.
 # If memory is an issue, reduce this number (e.g., 4 or 8).
-N_JOBS = 4 
+N_JOBS = -1
 BACKEND = 'loky'
 
 # Feature Configuration
+# Os k vizinhos mais próximos são um prefixo dos max(KNN_KS): a árvore é
+# consultada uma vez e as estatísticas de todos os k saem do mesmo gather
+# (somas acumuladas ao longo dos vizinhos, src/spatial_stats.py). Uma lista
+# longa de k (ex.: para calibrar o k do modelo de crédito) custa pouco além
+# do maior k. LISA (uma tabela de permutações por k) só roda para os
+# DEFAULT_LISA_KS que estão em KNN_KS; LISA em todos os k é opt-in explícito:
+#   python notebooks/process_spatial_features_heavy.py --knn-ks=3-50
+#   python notebooks/process_spatial_features_heavy.py --knn-ks=3-50 --lisa-ks=all
 KNN_KS = [5, 10, 15]
+DEFAULT_LISA_KS = [5, 10, 15]
+LISA_KS = None          # None = DEFAULT_LISA_KS ∩ KNN_KS
+# k por tarefa: a saída de uma tarefa é (linhas x colunas do lote x k);
+# reduza se muitos k estourarem a memória dos workers
+KS_PER_TASK = 8
 
-# ==============================================================================
-# WORKER FUNCTION - GRAVITY
-# ==============================================================================
-def calculate_gravity_chunk(indices_chunk, coords, mass_values, beta):
+
+def parse_ks(text):
     """
-    Calculates gravity values for a chunk of indices.
+    '5,10,15' or '3-50' (or a mix, '3-10,15,20') -> sorted list of distinct k.
     """
-    import numpy as np
-    
-    results = np.zeros(len(indices_chunk))
-    
-    for i, (idx_original, neighbors) in enumerate(indices_chunk):
-        if not neighbors: continue
-        
-        center_pt = coords[idx_original]
-        neigh_pts = coords[neighbors]
-        
-        dists = np.linalg.norm(neigh_pts - center_pt, axis=1)
-        dists = np.maximum(dists, 1.0)
-        
-        masses = mass_values[neighbors]
-        results[i] = np.sum(masses / (dists ** beta))
-        
-    return results
+    ks = set()
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-', 1)
+            ks.update(range(int(first), int(last) + 1))
+        elif part:
+            ks.add(int(part))
+    return sorted(ks)
+
+
+for arg in sys.argv[1:]:
+    if arg.startswith('--knn-ks='):
+        KNN_KS = parse_ks(arg.split('=', 1)[1])
+    elif arg.startswith('--lisa-ks='):
+        value = arg.split('=', 1)[1]
+        LISA_KS = 'all' if value == 'all' else parse_ks(value)
+if LISA_KS is None:
+    LISA_KS = [k for k in DEFAULT_LISA_KS if k in KNN_KS]
+elif LISA_KS == 'all':
+    LISA_KS = list(KNN_KS)
+
+# Contiguidade (src/spatial_contiguity.py) como alternativa ao KNN: as mesmas
+# features (lag, hetero, ..., LISA) com os setores que encostam no polígono,
+# sufixo _queen / _rook. Melhor que o KNN de centróides para setores rurais
+# grandes e setores longos e finos. Vazio = só KNN.
+#   python notebooks/process_spatial_features_heavy.py --contiguity=queen
+CONTIGUITY_WEIGHTS = []
+for arg in sys.argv[1:]:
+    if arg.startswith('--contiguity='):
+        CONTIGUITY_WEIGHTS = arg.split('=', 1)[1].split(',')
+# Sementes da contiguidade fora da faixa dos k do KNN
+CONTIGUITY_SEED_BASE = 1000
+
+# LISA: colunas por tarefa (o engine vetoriza o lote inteiro) e semente fixa
+LISA_BATCH_SIZE = 16
+LISA_PERMUTATIONS = 99
+RANDOM_SEED = 42
+
+# Definição dos Raios (em Metros) e Beta de Decaimento
+GRAVITY_RADII = [1000, 2000, 5000] # 1km, 2km, 5km
+GRAVITY_BETA = 1.5
+# Colunas de Massa (Riqueza e Pessoas): nomes comuns do Censo. Ajuste se necessário.
+GRAVITY_MASS_COLUMNS = [
+    'massa_salarial_total', 
+    'total_de_pessoas_v0001',
+    'total_de_domicilios_particulares_dppo_dppv_dppuo_dpio_v0003'
+]
+
+# Linhagem: o Diamond só é recalculado se o gold, a malha ou os parâmetros
+# abaixo mudaram desde a última execução completa (--force ignora)
+FORCE = '--force' in sys.argv[1:]
+LINEAGE_PARAMS = {
+    'target_crs': TARGET_CRS,
+    'knn_ks': KNN_KS,
+    'lisa_ks': LISA_KS,
+    'lisa_permutations': LISA_PERMUTATIONS,
+    'lisa_batch_size': LISA_BATCH_SIZE,
+    'random_seed': RANDOM_SEED,
+    'gravity_radii': GRAVITY_RADII,
+    'gravity_beta': GRAVITY_BETA,
+    'sector_key': SECTOR_KEY_VERSION,
+    'contiguity': CONTIGUITY_WEIGHTS,
+}
+
+# ==============================================================================
+# EXECUÇÃO EM TILES (opcional)
+# ==============================================================================
+# None = execução global (país inteiro em memória, exige uma máquina grande).
+# 'uf' ou 'grid' = cada tile (UF ou célula de GRID_SIZE_M metros) roda em um
+# processo separado, só com os setores do tile + halo (ver src/diamond_tiles.py).
+# Os resultados são idênticos aos da execução global; a saída fica em
+# OUTPUT_DIR/tile=<nome>/ (read_diamond_dataset junta os tiles).
+#   python notebooks/process_spatial_features_heavy.py --tiles=uf
+#   python notebooks/process_spatial_features_heavy.py --tiles=uf --only=uf35   (refaz só SP)
+TILE_MODE = None
+GRID_SIZE_M = 200_000
+# Núcleo máximo por tile (tiles maiores viram quadrantes): limita a memória por worker
+TILE_MAX_ROWS = 60_000
+TILE_WORKERS = 2
+TILE_ONLY = None
+for arg in sys.argv[1:]:
+    if arg.startswith('--tiles='):
+        TILE_MODE = arg.split('=', 1)[1]
+    elif arg.startswith('--only='):
+        TILE_ONLY = arg.split('=', 1)[1].split(',')
 
 # ==============================================================================
 # WORKER FUNCTION - KNN
 # ==============================================================================
-def process_single_column(col_name, values, neighbors_indices, k):
+def column_batch_features(values, neighbors_indices, col_names, ks, seeds, rows=None, stats=None,
+                          references=None, row_ids=None, suffix=None):
+    """
+    KNN features (lag, hetero, inequality, isolation, rank) and LISA for a
+    batch of columns, for every k in `ks` at once. neighbors_indices has one
+    row per output row: the (rows, max k) KNN matrix sorted by distance (the
+    k nearest are its first k columns) or a contiguity SpatialWeights (then
+    ks=None and suffix='queen'/'rook' for the column names instead of k{k}).
+    `seeds` maps each k (or the suffix) that gets LISA to its seed; the
+    others get only the five statistics. `rows` are their positions in
+    `values` (default: all rows). In a tile, `stats` (mean, std), the LISA
+    `references` ({k: reference}) and the global `row_ids` come from the
+    full dataset.
+
+    Returns {k (or suffix): DataFrame}, empty when the batch is constant; an
+    error is logged and re-raised, so the caller records the k (or tile) as failed.
+    """
     # Imports locais são vitais para o joblib no Windows
     import numpy as np
     import pandas as pd
     import warnings
-    from libpysal.weights import W
-    from esda.moran import Moran_Local
+    from spatial_lisa import local_moran, column_stats
+    from spatial_stats import neighbor_stats, STAT_NAMES
 
-    # Fast fail para dados constantes
-    # Check for NaNs first
-    if np.isnan(values).any():
-        values = np.nan_to_num(values, nan=0.0, posinf=0.0, neginf=0.0)
-        
-    if values.std() == 0: return pd.DataFrame()
+    if stats is None:
+        stats = column_stats(values)
+    mean, std = stats
+    references = references or {}
+
+    # Fast fail para dados constantes (no dataset inteiro)
+    keep = std > 0
+    if not keep.any(): return {}
+    col_names = [c for c, ok in zip(col_names, keep) if ok]
+    values = values[:, keep]
+    if rows is None:
+        rows = np.arange(len(values))
 
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
         
         try:
-            # Reconstrói o W de forma leve (apenas com os índices recebidos)
-            # Ensure indices are integers
-            neighbors_dict = {i: neighbors_indices[i].tolist() for i in range(len(values))}
-            w = W(neighbors_dict, silence_warnings=True)
-            w.transform = 'r'
-            
-            # Cálculos vetorizados com NumPy (muito mais rápido que loops)
-            neighbor_values = values[neighbors_indices]
-            lag_mean = np.mean(neighbor_values, axis=1)
-            lag_std  = np.std(neighbor_values, axis=1) # Heterogeneidade (Base para Risco)
-            
-            # [NEW] Diversity / Inequality Index (Coefficient of Variation)
-            # Indica se a vizinhança é homogênea (0) ou diversa/desigual (alto)
-            # "Indice de Diversidade Local"
-            with np.errstate(divide='ignore', invalid='ignore'):
-                local_cv = lag_std / (lag_mean + 1e-6)
-                local_cv = np.nan_to_num(local_cv)
-            
-            # [NEW] Risk / Isolation Index (Absolute Difference)
-            # O quão "estranho" ou "arriscado" é este ponto comparado aos vizinhos?
-            # "Indice de Risco/Anomalia"
-            isolation = np.abs(values - lag_mean)
-            
-            # Rank Local via Z-Score (Importante para normalizar Renda)
-            with np.errstate(divide='ignore', invalid='ignore'):
-                rank = (values - lag_mean) / (lag_std + 1e-6)
-                rank = np.nan_to_num(rank)
-
-            # LISA / Moran
-            # permutations=99 provides a p-value resolution of 0.01
-            # n_jobs=1 ensures we don't spawn nested threads inside the worker
-            lm = Moran_Local(values, w, permutations=99, n_jobs=1)
-            
-            results = {
-                f"{col_name}_lag_k{k}": lag_mean,
-                f"{col_name}_hetero_k{k}": lag_std,
-                f"{col_name}_inequality_k{k}": local_cv, # Diversity Proxy
-                f"{col_name}_isolation_k{k}": isolation, # Risk/Anomaly Proxy
-                f"{col_name}_rank_k{k}": rank,
-                f"{col_name}_lisa_q_k{k}": lm.q,
-                f"{col_name}_lisa_sig_k{k}": (lm.p_sim < 0.05).astype(int)
-            }
-            return pd.DataFrame(results)
-            
+            # lag (média), hetero (desvio), inequality (CV = "Indice de Diversidade
+            # Local"), isolation (|valor - lag| = "Indice de Risco/Anomalia") e
+            # rank (z-score local) de todas as colunas do lote e de todos os k
+            # de uma vez: um único gather por vizinho até o maior k, com somas
+            # acumuladas ao longo dos vizinhos (src/spatial_stats.py)
+            if ks is None:
+                stats_by_key = {suffix: neighbor_stats(values, neighbors_indices, rows=rows)}
+            else:
+                stats_by_key = neighbor_stats(values, neighbors_indices, rows=rows, ks=ks)
+
+            frames = {}
+            for key, stats_by_name in stats_by_key.items():
+                key_suffix = suffix if ks is None else f"k{key}"
+                results = {}
+                for j, col_name in enumerate(col_names):
+                    for name in STAT_NAMES:
+                        results[f"{col_name}_{name}_{key_suffix}"] = stats_by_name[name][:, j]
+                features = list(STAT_NAMES)
+
+                # LISA / Moran (engine vetorizado, todas as colunas do lote de uma vez)
+                # permutations=99 provides a p-value resolution of 0.01
+                if key in seeds:
+                    neighbors = neighbors_indices if ks is None else neighbors_indices[:, :key]
+                    lisa_q, lisa_p = local_moran(values, neighbors, permutations=LISA_PERMUTATIONS, seed=seeds[key],
+                                                 stats=(mean[keep], std[keep]), reference=references.get(key),
+                                                 rows=rows, row_ids=row_ids)
+                    for j, col_name in enumerate(col_names):
+                        results[f"{col_name}_lisa_q_{key_suffix}"] = lisa_q[:, j]
+                        results[f"{col_name}_lisa_sig_{key_suffix}"] = (lisa_p[:, j] < 0.05).astype(int)
+                    features += ['lisa_q', 'lisa_sig']
+
+                # Mantém a ordem de colunas por feature (lag, hetero, ..., lisa)
+                frames[key] = pd.DataFrame({f"{col_name}_{feature}_{key_suffix}": results[f"{col_name}_{feature}_{key_suffix}"]
+                                            for col_name in col_names for feature in features})
+            return frames
         except Exception as e:
-            # print(f"Worker Error in {col_name} K={k}: {e}")
-            # Return empty DF on error to avoid crashing the whole batch
-            return pd.DataFrame()
+            # Propaga: o chamador marca o k (ou o tile) como falho em vez de
+            # gravar o resultado sem as colunas deste lote
+            print(f"Worker error in batch {col_names[0]}..{col_names[-1]} ({len(col_names)} columns), "
+                  f"{suffix or f'K={ks}'}: {e!r}")
+            raise
 
-# ==============================================================================
-# MAIN EXECUTION
-# ==============================================================================
-def main():
-    start_time = time.time()
-    print(f"[{time.strftime('%H:%M:%S')}] Starting Spatial Feature Engineering (Heavy Duty)...")
-    
-    # 1. Load Data
-    print(f"[{time.strftime('%H:%M:%S')}] Loading Gold Data from {GOLD_PATH}...")
-    if not os.path.exists(GOLD_PATH):
-        print(f"Error: Gold file not found at {GOLD_PATH}")
-        return
-    df_gold = pd.read_parquet(GOLD_PATH)
-    print(f"Gold loaded: {df_gold.shape}")
+def process_column_batch(col_ids, col_names, features_path, neighbors_path, ks, seeds):
+    # Imports locais são vitais para o joblib no Windows
+    import numpy as np
+    from shared_arrays import attach
 
-    print(f"[{time.strftime('%H:%M:%S')}] Loading Spatial Data from {SPATIAL_PATH}...")
-    if not os.path.exists(SPATIAL_PATH):
-        print(f"Error: Spatial file not found at {SPATIAL_PATH}")
-        return
-    gdf_spatial = gpd.read_parquet(SPATIAL_PATH)
-    print(f"Spatial loaded: {gdf_spatial.shape}")
+    # Attach zero-copy: lê só as colunas deste lote (NaN já tratados na publicação)
+    values = np.array(attach(features_path)[:, col_ids])
+    neighbors_indices = attach(neighbors_path)[:, :max(ks)]
+    return column_batch_features(values, neighbors_indices, col_names, ks, seeds)
 
-    # 2. Merge Data
-    print(f"[{time.strftime('%H:%M:%S')}] Merging Spatial and Tabular Data...")
-    # Ensure join keys match types
-    # Assuming 'code_tract' in spatial and 'CD_SETOR' in gold
-    if 'code_tract' in gdf_spatial.columns:
-        # FIX: Handle float keys (remove .0)
-        if pd.api.types.is_float_dtype(gdf_spatial['code_tract']):
-            gdf_spatial['code_tract'] = gdf_spatial['code_tract'].astype(np.int64).astype(str)
-        else:
-            gdf_spatial['code_tract'] = gdf_spatial['code_tract'].astype(str)
-            
-    if 'CD_SETOR' in df_gold.columns:
-        df_gold['CD_SETOR'] = df_gold['CD_SETOR'].astype(str)
-        
-    # Merge
-    # Keep only necessary spatial columns to save memory
-    spatial_cols = ['code_tract', 'geometry']
-    if 'name_muni' in gdf_spatial.columns: spatial_cols.append('name_muni')
-    
-    gdf = gdf_spatial[spatial_cols].merge(df_gold, left_on='code_tract', right_on='CD_SETOR', how='inner')
-    print(f"Merged Dataset: {gdf.shape}")
-    
-    # Clean up
-    del df_gold
-    del gdf_spatial
-    gc.collect()
+def process_contiguity_batch(col_ids, col_names, features_path, graph_path, kind, seed):
+    # Imports locais são vitais para o joblib no Windows
+    import numpy as np
+    from shared_arrays import attach
+    from spatial_weights import SpatialWeights
 
-    # 3. CRS Projection
-    print(f"[{time.strftime('%H:%M:%S')}] Verifying CRS...")
-    if gdf.crs != TARGET_CRS:
-        print(f"Projecting data from {gdf.crs} to {TARGET_CRS} (Meters)...")
-        gdf = gdf.to_crs(TARGET_CRS)
-    else:
-        print(f"CRS is already {TARGET_CRS}.")
+    # Grafo memory-mapped direto do cache de pesos
+    values = np.array(attach(features_path)[:, col_ids])
+    graph = SpatialWeights.load(graph_path)
+    return column_batch_features(values, graph, col_names, None, {kind: seed}, suffix=kind)
 
-    # 4. Prepare Data for Processing
-    # Select numeric columns only
-    numeric_cols = gdf.select_dtypes(include=[np.number]).columns.tolist()
+def ks_groups(ks):
+    """
+    KNN_KS in groups of at most KS_PER_TASK: one task (a single gather up to
+    the group's largest k) per (group, column batch).
+    """
+    return [ks[i:i + KS_PER_TASK] for i in range(0, len(ks), KS_PER_TASK)]
 
+def knn_seeds(ks, lisa_ks, b):
+    """
+    LISA seed of the ks of a KNN column batch that get LISA (the same seed
+    as a run with that k alone).
+    """
+    return {k: (RANDOM_SEED, k, b) for k in ks if k in lisa_ks}
+
+def contiguity_seed(kind, b):
+    """
+    LISA seed of a contiguity column batch (per neighbor count it gets the
+    count appended, see spatial_lisa.degree_seed).
+    """
+    return (RANDOM_SEED, CONTIGUITY_SEED_BASE + CONTIGUITY_KINDS.index(kind), b)
+
+def select_target_columns(numeric_cols):
+    """
+    Columns that get KNN/LISA features, in a stable order (batches and seeds
+    depend on it). Shared by the global and the tiled runs.
+    """
     # ---------------------------------------------------------
     # FILTER: Select only High-Value "Expert" features + Income
     # Voltando ao plano Diamond: ~258 features de alta inteligência.
@@ -214,7 +315,8 @@ def main():
     mass_cols = [c for c in mass_cols if c in numeric_cols]
     
     # Combine all targets
-    target_cols = list(set(expert_cols + calc_cols + mass_cols))
+    # sorted: ordem estável (lotes e sementes reprodutíveis entre execuções)
+    target_cols = sorted(set(expert_cols + calc_cols + mass_cols))
     
     # Fallback: If no expert/calc columns found (e.g. raw data), try to find them by content
     if len(target_cols) < 5:
@@ -227,174 +329,492 @@ def main():
     print(f"   - Expert: {len(expert_cols)}")
     print(f"   - Calculated: {len(calc_cols)}")
     print(f"   - Mass: {len(mass_cols)}")
+    return target_cols
+
+# ==============================================================================
+# MAIN EXECUTION
+# ==============================================================================
+def run_global():
+    """
+    Whole country in memory. Returns True when every K succeeded.
+    """
+    # 1. Load Data
+    print(f"[{time.strftime('%H:%M:%S')}] Loading Gold Data from {GOLD_PATH}...")
+    if not os.path.exists(GOLD_PATH):
+        print(f"Error: Gold file not found at {GOLD_PATH}")
+        return False
+    df_gold = pd.read_parquet(GOLD_PATH)
+    print(f"Gold loaded: {df_gold.shape}")
+
+    print(f"[{time.strftime('%H:%M:%S')}] Loading Spatial Data from {SPATIAL_PATH}...")
+    if not os.path.exists(SPATIAL_PATH):
+        print(f"Error: Spatial file not found at {SPATIAL_PATH}")
+        return False
+    # Só os atributos: as coordenadas vêm da tabela de centróides
+    spatial_names = pq.read_schema(SPATIAL_PATH).names
+    gdf_spatial = pd.read_parquet(SPATIAL_PATH, columns=[c for c in ['code_tract', 'name_muni'] if c in spatial_names])
+    print(f"Spatial loaded: {gdf_spatial.shape}")
+
+    # 2. Merge Data
+    print(f"[{time.strftime('%H:%M:%S')}] Merging Spatial and Tabular Data...")
+    # Chave canônica int64 dos dois lados (code_tract vem float da malha)
+    gdf_spatial['code_tract'] = normalize_sector_key(gdf_spatial['code_tract'])
+    df_gold['CD_SETOR'] = normalize_sector_key(df_gold['CD_SETOR'])
+        
+    # Merge
+    # Keep only necessary spatial columns to save memory
+    spatial_cols = ['code_tract']
+    if 'name_muni' in gdf_spatial.columns: spatial_cols.append('name_muni')
+    
+    gdf = gdf_spatial[spatial_cols].merge(df_gold, left_on='code_tract', right_on='CD_SETOR', how='inner')
+    print(f"Merged Dataset: {gdf.shape}")
+    
+    # Clean up
+    del df_gold
+    del gdf_spatial
+    gc.collect()
+
+    # 3. Prepare Data for Processing
+    # Select numeric columns only
+    numeric_cols = gdf.select_dtypes(include=[np.number]).columns.tolist()
+    target_cols = select_target_columns(numeric_cols)
 
     # Extract coordinates for W generation
     print(f"[{time.strftime('%H:%M:%S')}] Extracting coordinates...")
-    # FIX: Use centroids for polygons
-    centroids = gdf.geometry.centroid
-    coords = np.column_stack((centroids.x, centroids.y))
+    # Centróides em TARGET_CRS pré-calculados (mesmos valores de to_crs + centroid)
+    ensure_centroid_table(SPATIAL_PATH, CENTROIDS_PATH)
+    coords = centroid_coords(CENTROIDS_PATH, gdf['code_tract'], TARGET_CRS)
     
-    # Build Tree once
-    print(f"[{time.strftime('%H:%M:%S')}] Building cKDTree...")
-    tree = cKDTree(coords)
+    # Neighbor Index: uma consulta em max(k) e uma no maior raio, reaproveitada
+    # por Gravidade e KNN/LISA (cache em disco, lido memory-mapped)
+    print(f"[{time.strftime('%H:%M:%S')}] Preparing NeighborIndex...")
+    weights = WeightsCache(WEIGHTS_DIR, SPATIAL_PATH)
+    neighbor_index = weights.neighbor_index(gdf['CD_SETOR'], coords, TARGET_CRS, max(KNN_KS), max(GRAVITY_RADII))
+    graphs = {kind: weights.contiguity(gdf['CD_SETOR'], kind) for kind in CONTIGUITY_WEIGHTS}
+
+    # Escrita incremental: cada família vai para disco assim que fica pronta.
+    # A geometria fica de fora (já está na malha).
+    print(f"[{time.strftime('%H:%M:%S')}] Writing base columns to {OUTPUT_DIR}...")
+    writer = DiamondDatasetWriter(OUTPUT_DIR, gdf['CD_SETOR'])
+    writer.write_columns('base', gdf, list(gdf.columns))
 
     # ---------------------------------------------------------
     # 4.5 GRAVITY FEATURES (Distance Decay)
     # ---------------------------------------------------------
     print(f"\n[{time.strftime('%H:%M:%S')}] Calculating Gravity Features (Hansen Accessibility)...")
     
-    # Definição dos Raios (em Metros) e Beta de Decaimento
-    GRAVITY_RADII = [1000, 2000, 5000] # 1km, 2km, 5km
-    GRAVITY_BETA = 1.5
-    
-    # Identificar colunas de Massa (Riqueza e Pessoas)
-    # Tenta achar os nomes comuns do Censo. Ajuste se necessário.
-    potential_gravity_cols = [
-        'massa_salarial_total', 
-        'total_de_pessoas_v0001',
-        'total_de_domicilios_particulares_dppo_dppv_dppuo_dpio_v0003'
-    ]
-    gravity_cols = [c for c in potential_gravity_cols if c in gdf.columns]
+    gravity_cols = [c for c in GRAVITY_MASS_COLUMNS if c in gdf.columns]
     
     if not gravity_cols:
         print("Warning: No mass columns found for Gravity (massa_salarial, populacao). Skipping.")
     else:
         print(f"Gravity Targets: {gravity_cols}")
         
+        # Matriz esparsa de decaimento por raio (uma consulta no maior raio)
+        # multiplicada pela matriz de massas: todas as colunas de uma vez.
+        mass_matrix = gdf[gravity_cols].to_numpy(dtype=np.float64)
+        gravity = calculate_gravity(neighbor_index, mass_matrix, GRAVITY_RADII, GRAVITY_BETA)
+
+        gravity_features = {}
         for r in GRAVITY_RADII:
-            print(f"   > Processing Radius {r}m...")
-            
-            # Query eficiente para raio fixo
-            # query_ball_point retorna lista de listas de indices
-            indices_list = tree.query_ball_point(coords, r=r)
-            
-            # Como query_ball_point não retorna distâncias, e calcular 300k distancias é lento,
-            # vamos fazer uma aproximação vetorizada inteligente ou loop otimizado.
-            # Para manter "Heavy" mas rápido, vamos iterar (infelizmente necessário para geometria variável)
-            # mas usando list comprehension que é rápida.
-            
-            for col in gravity_cols:
-                print(f"      Calculating for {col}...")
-                # Prepara o array de valores para acesso rápido
-                mass_values = gdf[col].values
-                
-                # Parallelize Gravity Calculation
-                # Split indices_list into chunks
-                # We need to pass (index, neighbors) to keep track of order, or just split and reassemble
-                
-                # Create chunks of (original_index, neighbors)
-                chunk_size = len(indices_list) // N_JOBS + 1
-                chunks = []
-                for i in range(0, len(indices_list), chunk_size):
-                    # Create a list of tuples (original_idx, neighbors) for this chunk
-                    chunk_data = list(enumerate(indices_list[i:i+chunk_size], start=i))
-                    chunks.append(chunk_data)
-                
-                try:
-                    chunk_results = Parallel(n_jobs=N_JOBS, backend=BACKEND, verbose=0)(
-                        delayed(calculate_gravity_chunk)(chunk, coords, mass_values, GRAVITY_BETA)
-                        for chunk in chunks
-                    )
-                    
-                    # Flatten results
-                    decay_sum = np.concatenate(chunk_results)
-                    
-                    # Salva a feature
-                    gdf[f'gravity_{col}_{r}m'] = decay_sum
-                    
-                except Exception as e:
-                    print(f"Error in Gravity Parallel: {e}")
-                    # Fallback to sequential if parallel fails
-                    decay_sum = np.zeros(len(gdf))
-                    for i, neighbors in enumerate(indices_list):
-                        if not neighbors: continue
-                        center_pt = coords[i]
-                        neigh_pts = coords[neighbors]
-                        dists = np.linalg.norm(neigh_pts - center_pt, axis=1)
-                        dists = np.maximum(dists, 1.0)
-                        masses = mass_values[neighbors]
-                        decay_sum[i] = np.sum(masses / (dists ** GRAVITY_BETA))
-                    gdf[f'gravity_{col}_{r}m'] = decay_sum
+            print(f"   > Radius {r}m: {len(gravity_cols)} features.")
+            for c, col in enumerate(gravity_cols):
+                gravity_features[f'gravity_{col}_{r}m'] = gravity[r][:, c]
+        writer.write('gravity', pd.DataFrame(gravity_features))
+
+        del mass_matrix, gravity, gravity_features
+        gc.collect()
 
     print(f"[{time.strftime('%H:%M:%S')}] Gravity calculation done.")
 
     # 5. Parallel KNN & LISA Processing
     print(f"[{time.strftime('%H:%M:%S')}] Starting Parallel Processing (n_jobs={N_JOBS})...")
     
-    all_new_features = []
+    # Publica features e vizinhos UMA vez; os workers recebem só índices de colunas
+    print(f"[{time.strftime('%H:%M:%S')}] Publishing shared arrays to {SHARED_DIR}...")
+    store = SharedArrayStore(SHARED_DIR)
+    try:
+        features_path = store.publish_columns('features', gdf, target_cols)
+        neighbors_path = store.publish('knn_indices', neighbor_index.knn_indices)
+
+        # Daqui em diante os workers leem do memmap: o GeoDataFrame não é mais necessário
+        del gdf
+        gc.collect()
+
+        # Each task receives only a range of column indices into the shared matrix
+        batches = [list(range(i, min(i + LISA_BATCH_SIZE, len(target_cols))))
+                   for i in range(0, len(target_cols), LISA_BATCH_SIZE)]
 
-    for k in KNN_KS:
-        k_start = time.time()
-        print(f"\n--- Processing K={k} ---")
-        
-        # Query Tree for Indices
-        print(f"Querying cKDTree for k={k}...")
-        # k+1 because the first neighbor is the point itself
-        dists, indices = tree.query(coords, k=k+1) 
-        
         # [FEATURE EXTRA] Urban Density Proxy
-        # Salva a média da distância até os vizinhos. 
+        # Salva a média da distância até os vizinhos.
         # Baixo valor = Alta Densidade Urbana. Alto valor = Rural/Esparso.
-        # axis=1 faz a média por linha (setor). Ignora a coluna 0 (self).
-        mean_dist = np.mean(dists[:, 1:], axis=1)
-        all_new_features.append(pd.DataFrame({f'geo_avg_dist_k{k}': mean_dist}))
+        # Todos os k de uma soma acumulada das distâncias até max(KNN_KS).
+        dists, _ = neighbor_index.knn(max(KNN_KS))
+        mean_dists = prefix_means(dists, KNN_KS)
+        writer.write('geo', pd.DataFrame({f'geo_avg_dist_k{k}': mean_dists[k] for k in KNN_KS}))
+        del dists, mean_dists
 
-        # Remove the point itself (first column)
-        neighbor_indices = indices[:, 1:]
-        
-        # Prepare data for workers
-        # We pass the indices matrix and the numpy arrays
-        print(f"Dispatching {len(target_cols)} tasks to workers...")
+        failed_ks = []
+        for ks in ks_groups(KNN_KS):
+            k_start = time.time()
+            print(f"\n--- Processing K={ks} (LISA: {[k for k in ks if k in LISA_KS]}) ---")
+
+            # Prepare data for workers
+            print(f"Dispatching {len(target_cols)} columns in {len(batches)} tasks to workers...")
         
-        results = None
-        try:
-            results = Parallel(n_jobs=N_JOBS, backend=BACKEND, verbose=5)(
-                delayed(process_single_column)(col, gdf[col].values, neighbor_indices, k)
-                for col in target_cols
-            )
-            
-            # Concatenate results for this K
-            print("Concatenating results...")
-            # Filter out empty results (from fast fail)
-            results = [r for r in results if not r.empty]
+            try:
+                # return_as='generator': cada lote é gravado assim que chega,
+                # sem acumular os resultados do grupo inteiro em memória.
+                # Cada tarefa lê os vizinhos até max(ks) uma vez (NeighborIndex
+                # já exclui o próprio ponto) e devolve um DataFrame por k
+                results = Parallel(n_jobs=N_JOBS, backend=BACKEND, verbose=5, return_as='generator')(
+                    delayed(process_column_batch)(
+                        batch, [target_cols[j] for j in batch], features_path, neighbors_path, ks, knn_seeds(ks, LISA_KS, b)
+                    )
+                    for b, batch in enumerate(batches)
+                )
             
-            if results:
-                k_df = pd.concat(results, axis=1)
-                all_new_features.append(k_df)
+                for frames in results:
+                    # Filter out empty results (from fast fail)
+                    for k, batch_df in frames.items():
+                        writer.write(f'knn_k{k}', batch_df)
+                    del frames
             
-        except Exception as e:
-            print(f"Error during parallel execution for K={k}: {e}")
-            import traceback
-            traceback.print_exc()
+            except Exception as e:
+                failed_ks.extend(ks)
+                print(f"Error during parallel execution for K={ks}: {e}")
+                import traceback
+                traceback.print_exc()
         
-        # Cleanup to free memory
-        del neighbor_indices
-        del dists
-        del indices
-        if results:
-            del results
-        gc.collect()
+            gc.collect()
         
-        print(f"Finished K={k} in {time.time() - k_start:.2f}s")
+            print(f"Finished K={ks} in {time.time() - k_start:.2f}s")
 
-    # 5. Merge and Save
-    print(f"\n[{time.strftime('%H:%M:%S')}] Merging all features...")
-    if all_new_features:
-        final_features = pd.concat(all_new_features, axis=1)
-        
-        # Combine with original geometry and IDs (or full gdf)
-        # Using full gdf might be memory intensive if it's huge. 
-        # If you only need the new features + ID, adjust here.
-        final_gdf = pd.concat([gdf, final_features], axis=1)
-        
-        print(f"Saving to {OUTPUT_FILE}...")
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(os.path.abspath(OUTPUT_FILE)), exist_ok=True)
-        
-        final_gdf.to_parquet(OUTPUT_FILE)
-        print(f"Success! Saved {final_gdf.shape[1]} columns.")
-    else:
-        print("No features were generated.")
+        # Contiguidade: mesmas features, vizinhos = setores que encostam no polígono
+        for kind, graph in graphs.items():
+            k_start = time.time()
+            print(f"\n--- Processing {kind} contiguity ({len(graph.islands)} islands) ---")
+            writer.write('geo', pd.DataFrame({f'geo_n_neighbors_{kind}': graph.cardinalities}))
+            try:
+                results = Parallel(n_jobs=N_JOBS, backend=BACKEND, verbose=5, return_as='generator')(
+                    delayed(process_contiguity_batch)(
+                        batch, [target_cols[j] for j in batch], features_path, graph.path, kind, contiguity_seed(kind, b)
+                    )
+                    for b, batch in enumerate(batches)
+                )
+                for frames in results:
+                    for batch_df in frames.values():
+                        writer.write(f'contiguity_{kind}', batch_df)
+                    del frames
+            except Exception as e:
+                failed_ks.append(kind)
+                print(f"Error during parallel execution for {kind}: {e}")
+            print(f"Finished {kind} in {time.time() - k_start:.2f}s")
+
+    finally:
+        # Memmaps apagados mesmo se um estágio falhar
+        store.close()
+
+    # 6. Finalize
+    writer.close()
+    if failed_ks:
+        print(f"⚠️ K={failed_ks} failed.")
+    print(f"\n[{time.strftime('%H:%M:%S')}] Success! Saved {writer.n_columns} columns "
+          f"in {len(writer.files)} files to {OUTPUT_DIR}")
+    return not failed_ks
+
+# ==============================================================================
+# TILED EXECUTION
+# ==============================================================================
+def load_row_plan():
+    """
+    Row order of the global run (mesh JOIN gold), from the keys only:
+    code_tract (+ name_muni), CD_SETOR and the gold row of every sector.
+    """
+    spatial_names = pq.read_schema(SPATIAL_PATH).names
+    spatial_cols = ['code_tract'] + (['name_muni'] if 'name_muni' in spatial_names else [])
+    spatial = pq.read_table(SPATIAL_PATH, columns=spatial_cols).to_pandas()
+    spatial['code_tract'] = normalize_sector_key(spatial['code_tract'])
+
+    gold = pq.read_table(GOLD_PATH, columns=['CD_SETOR']).to_pandas()
+    gold['CD_SETOR'] = normalize_sector_key(gold['CD_SETOR'])
+    gold['gold_row'] = np.arange(len(gold))
+
+    plan = spatial.merge(gold, left_on='code_tract', right_on='CD_SETOR', how='inner')
+    return plan, spatial_cols
+
+
+def gold_numeric_columns():
+    """
+    Numeric gold columns as pandas would type them after read_parquet (no data read).
+    """
+    empty = pq.read_schema(GOLD_PATH).empty_table().to_pandas()
+    return [c for c in empty.select_dtypes(include=[np.number]).columns if c != 'CD_SETOR']
+
+
+def read_gold_columns(columns, gold_rows):
+    """
+    (N, C) float64 matrix of gold columns in the global row order, NaN/inf as 0
+    (same values the global run publishes to the workers).
+    """
+    frame = pq.read_table(GOLD_PATH, columns=columns).to_pandas()
+    matrix = np.empty((len(gold_rows), len(columns)))
+    for j, col in enumerate(columns):
+        matrix[:, j] = np.nan_to_num(frame[col].to_numpy(dtype=np.float64)[gold_rows],
+                                     nan=0.0, posinf=0.0, neginf=0.0)
+    return matrix
+
+
+def build_lisa_references(target_cols, gold_rows, path, graphs=None):
+    """
+    Global pieces every tile needs for exact LISA: per-column mean/std and,
+    for every (k in LISA_KS, column batch), the permutation table and its prefix/suffix
+    sums; for the contiguity graphs, one per (neighbor count, column batch).
+    Reads the gold one column batch at a time. Saved to one .npz.
+    """
+    from spatial_lisa import column_stats, standardize, moran_reference, degree_seed
+    degrees = {kind: [c for c in np.unique(graph.cardinalities) if c > 0] for kind, graph in (graphs or {}).items()}
+    n = len(gold_rows)
+    arrays = {}
+    batches = [list(range(i, min(i + LISA_BATCH_SIZE, len(target_cols))))
+               for i in range(0, len(target_cols), LISA_BATCH_SIZE)]
+    for b, batch in enumerate(batches):
+        values = read_gold_columns([target_cols[j] for j in batch], gold_rows)
+        mean, std = column_stats(values)
+        arrays[f'mean_b{b}'], arrays[f'std_b{b}'] = mean, std
+        keep = std > 0
+        if not keep.any():
+            continue
+        z_at = lambda ids: standardize(values[ids][:, keep], mean[keep], std[keep])
+        for k in LISA_KS:
+            ref = moran_reference(n, k, z_at, LISA_PERMUTATIONS, seed=(RANDOM_SEED, k, b))
+            for name, array in ref.items():
+                arrays[f'{name}_k{k}_b{b}'] = array
+        for kind, counts in degrees.items():
+            for c in counts:
+                ref = moran_reference(n, c, z_at, LISA_PERMUTATIONS, seed=degree_seed(contiguity_seed(kind, b), c))
+                for name, array in ref.items():
+                    arrays[f'{name}_{kind}_c{c}_b{b}'] = array
+        del values
+    np.savez(path, **arrays)
+    return batches
+
+
+def process_tile(tile, plan):
+    """
+    Worker: Diamond features of the core rows of one tile, computed over core + halo.
+    """
+    # Imports locais: o worker roda em outro processo (spawn no Windows)
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    t0 = time.time()
+    rows, core = tile['rows'], tile['core']
+    attrs = tile['attrs']
+
+    # Só as linhas do tile (núcleo + halo) são lidas do gold, na ordem global
+    key_type = pq.read_schema(GOLD_PATH).field('CD_SETOR').type
+    wanted = key_array(attrs['CD_SETOR']).cast(key_type)
+    table = pq.read_table(GOLD_PATH, filters=pc.field('CD_SETOR').isin(wanted))
+    gold = table.to_pandas()
+    gold['CD_SETOR'] = normalize_sector_key(gold['CD_SETOR'])
+    gold = gold.iloc[pd.Index(gold['CD_SETOR']).get_indexer(attrs['CD_SETOR'])].reset_index(drop=True)
+    frame = pd.concat([attrs[plan['spatial_cols']].reset_index(drop=True), gold], axis=1)
+    del table, gold
+
+    # Vizinhos do tile (núcleo + halo) do cache: refazer as features de um
+    # tile não refaz a vizinhança
+    weights = WeightsCache(plan['weights_dir'], SPATIAL_PATH, mesh_hash=plan['mesh_hash'])
+    index = weights.neighbor_index(attrs['CD_SETOR'], tile['coords'], TARGET_CRS, max(plan['knn_ks']), max(GRAVITY_RADII))
+    # Contiguidade do núcleo, já em posições do tile (add_graph_neighbors)
+    graphs = {kind: SpatialWeights(indptr, indices, kind=kind) for kind, (indptr, indices) in tile['graphs'].items()}
+    writer = DiamondDatasetWriter(tile_dir(OUTPUT_DIR, tile['name']), frame['CD_SETOR'].iloc[core])
+    core_frame = frame.iloc[core].reset_index(drop=True)
+    writer.write_columns('base', core_frame, list(core_frame.columns))
+    del core_frame
+
+    gravity_cols = [c for c in GRAVITY_MASS_COLUMNS if c in frame.columns]
+    if gravity_cols:
+        gravity = calculate_gravity(index, frame[gravity_cols].to_numpy(dtype=np.float64), GRAVITY_RADII, GRAVITY_BETA)
+        gravity_features = {}
+        for r in GRAVITY_RADII:
+            for c, col in enumerate(gravity_cols):
+                gravity_features[f'gravity_{col}_{r}m'] = gravity[r][core, c]
+        writer.write('gravity', pd.DataFrame(gravity_features))
+        del gravity, gravity_features
+
+    target_cols = plan['target_cols']
+    values = np.empty((len(frame), len(target_cols)))
+    for j, col in enumerate(target_cols):
+        values[:, j] = np.nan_to_num(frame[col].to_numpy(dtype=np.float64), nan=0.0, posinf=0.0, neginf=0.0)
+    del frame
+    gc.collect()
+
+    refs = np.load(plan['reference_path'])
+    row_ids = rows[core]
+    # Todos os k de uma vez, como na execução global (mesmos grupos, mesma ordem)
+    knn_ks, lisa_ks = plan['knn_ks'], plan['lisa_ks']
+    dists, neighbor_indices = index.knn(max(knn_ks))
+    dists, neighbor_indices = dists[core], neighbor_indices[core]
+    mean_dists = prefix_means(dists, knn_ks)
+    writer.write('geo', pd.DataFrame({f'geo_avg_dist_k{k}': mean_dists[k] for k in knn_ks}))
+    del dists, mean_dists
+    for ks in ks_groups(knn_ks):
+        for b, batch in enumerate(plan['batches']):
+            mean, std = refs[f'mean_b{b}'], refs[f'std_b{b}']
+            references = {}
+            for k in ks:
+                if f'table_k{k}_b{b}' in refs:
+                    references[k] = {name: refs[f'{name}_k{k}_b{b}'] for name in ('table', 'prefix', 'suffix')}
+            frames = column_batch_features(
+                values[:, batch], neighbor_indices[:, :max(ks)], [target_cols[j] for j in batch], ks,
+                knn_seeds(ks, lisa_ks, b), rows=core, stats=(mean, std), references=references, row_ids=row_ids)
+            for k, batch_df in frames.items():
+                writer.write(f'knn_k{k}', batch_df)
+
+    for kind, graph in graphs.items():
+        writer.write('geo', pd.DataFrame({f'geo_n_neighbors_{kind}': graph.cardinalities}))
+        for b, batch in enumerate(plan['batches']):
+            mean, std = refs[f'mean_b{b}'], refs[f'std_b{b}']
+            reference = {}
+            for c in np.unique(graph.cardinalities):
+                if f'table_{kind}_c{c}_b{b}' in refs:
+                    reference[c] = {name: refs[f'{name}_{kind}_c{c}_b{b}'] for name in ('table', 'prefix', 'suffix')}
+            frames = column_batch_features(
+                values[:, batch], graph, [target_cols[j] for j in batch], None, {kind: contiguity_seed(kind, b)},
+                rows=core, stats=(mean, std), references={kind: reference or None}, row_ids=row_ids, suffix=kind)
+            for batch_df in frames.values():
+                writer.write(f'contiguity_{kind}', batch_df)
+
+    writer.close()
+    return tile['name'], len(core), len(rows), writer.n_columns, time.time() - t0
+
+
+def run_tiled():
+    """
+    Tiles (UF or grid + halo) in a process pool. Returns True when every tile succeeded.
+    """
+    import shutil
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    print(f"[{time.strftime('%H:%M:%S')}] Tiled run (mode={TILE_MODE}, only={TILE_ONLY})...")
+    plan_rows, spatial_cols = load_row_plan()
+    print(f"Sectors (mesh JOIN gold): {len(plan_rows):,}")
+
+    # Centróides pré-calculados (sem ler a geometria da malha)
+    ensure_centroid_table(SPATIAL_PATH, CENTROIDS_PATH)
+    coords = centroid_coords(CENTROIDS_PATH, plan_rows['code_tract'], TARGET_CRS)
+
+    target_cols = select_target_columns(gold_numeric_columns())
+
+    # O hash da malha é calculado aqui uma vez; os workers só o recebem.
+    # Contiguidade: grafo global (cache), recortado por tile abaixo
+    weights = WeightsCache(WEIGHTS_DIR, SPATIAL_PATH)
+    graphs = {kind: weights.contiguity(plan_rows['CD_SETOR'], kind) for kind in CONTIGUITY_WEIGHTS}
+
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    reference_path = os.path.join(SHARED_DIR, 'lisa_reference.npz')
+    print(f"[{time.strftime('%H:%M:%S')}] Global LISA statistics ({len(target_cols)} columns)...")
+    try:
+        batches = build_lisa_references(target_cols, plan_rows['gold_row'].to_numpy(), reference_path, graphs)
+
+        tiles = build_tiles(plan_rows['CD_SETOR'].to_numpy(), coords, TILE_MODE, max(KNN_KS), max(GRAVITY_RADII),
+                            grid_size=GRID_SIZE_M, max_rows=TILE_MAX_ROWS, only=TILE_ONLY)
+        print(f"{len(tiles)} tiles, largest core {max((len(t['core']) for t in tiles), default=0):,} "
+              f"(+ halo up to {max((len(t['rows']) for t in tiles), default=0):,} rows)")
+
+        replaced = []
+        if TILE_ONLY is None:
+            if os.path.exists(OUTPUT_DIR):
+                # Execução completa: remove a saída anterior (global ou outro plano de tiles)
+                shutil.rmtree(OUTPUT_DIR)
+        else:
+            index = read_tiles_index(OUTPUT_DIR)
+            if index is None:
+                print(f"Error: --only needs a tiled dataset at {OUTPUT_DIR} (run --tiles={TILE_MODE} first).")
+                return False
+            # Tiles antigos da mesma região (a divisão em quadrantes pode ter mudado)
+            replaced = [name for name in index['tiles'] if tile_selected(name, TILE_ONLY)]
+            for name in replaced:
+                shutil.rmtree(tile_dir(OUTPUT_DIR, name), ignore_errors=True)
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+        plan = {'spatial_cols': spatial_cols, 'target_cols': target_cols,
+                'batches': batches, 'reference_path': reference_path,
+                'knn_ks': KNN_KS, 'lisa_ks': LISA_KS,
+                'weights_dir': WEIGHTS_DIR, 'mesh_hash': weights.mesh_hash}
+        for tile in tiles:
+            tile['graphs'] = add_graph_neighbors(tile, graphs) if graphs else {}
+            tile['coords'] = coords[tile['rows']]
+            tile['attrs'] = plan_rows.iloc[tile['rows']][spatial_cols + ['CD_SETOR']].reset_index(drop=True)
+        del coords, plan_rows, graphs
+        gc.collect()
+
+        done = []
+        failed = []
+        # max_tasks_per_child=1: cada tile em um processo novo (memória devolvida ao SO).
+        # Só existe no Python 3.11+; antes disso os workers são reaproveitados
+        # (mesmo resultado, mas o pico de memória de um tile pode ficar no processo)
+        pool_options = {'max_tasks_per_child': 1} if sys.version_info >= (3, 11) else {}
+        with ProcessPoolExecutor(max_workers=TILE_WORKERS, **pool_options) as executor:
+            futures = {executor.submit(process_tile, tile, plan): tile['name'] for tile in tiles}
+            for future in as_completed(futures):
+                try:
+                    name, n_core, n_rows, n_columns, elapsed = future.result()
+                except Exception as e:
+                    failed.append(futures[future])
+                    print(f"Error in tile {futures[future]}: {e}")
+                    continue
+                done.append(name)
+                print(f"[{time.strftime('%H:%M:%S')}] Tile {name}: {n_core:,} sectors "
+                      f"(+{n_rows - n_core:,} halo), {n_columns} columns in {elapsed:.1f}s")
+
+        write_tiles_index(OUTPUT_DIR, done, drop=replaced, mode=TILE_MODE, grid_size=GRID_SIZE_M, max_rows=TILE_MAX_ROWS)
+    finally:
+        # Tabelas de referência do LISA apagadas mesmo se a execução falhar
+        if os.path.exists(reference_path):
+            os.remove(reference_path)
+    if failed:
+        print(f"⚠️ Tiles failed: {sorted(failed)}")
+    print(f"\n[{time.strftime('%H:%M:%S')}] Saved {len(done)} tiles to {OUTPUT_DIR}")
+    return not failed
+
+
+# ==============================================================================
+# ENTRY POINT
+# ==============================================================================
+def main():
+    start_time = time.time()
+    print(f"[{time.strftime('%H:%M:%S')}] Starting Spatial Feature Engineering (Heavy Duty)...")
+
+    if TILE_ONLY is not None and not TILE_MODE:
+        print("Error: --only requires --tiles=uf|grid.")
+        return
+    unknown = [kind for kind in CONTIGUITY_WEIGHTS if kind not in CONTIGUITY_KINDS]
+    if unknown:
+        print(f"Error: unknown contiguity {unknown}, expected {list(CONTIGUITY_KINDS)}.")
+        return
+    if not KNN_KS or KNN_KS[0] < 1 or not set(LISA_KS) <= set(KNN_KS):
+        print(f"Error: --knn-ks needs k >= 1 and --lisa-ks a subset of it (got {KNN_KS}, {LISA_KS}).")
+        return
+
+    lineage = LineageManifest(os.path.dirname(OUTPUT_DIR))
+    inputs = {'gold': GOLD_PATH, 'mesh': SPATIAL_PATH}
+    # Versão do dicionário por trás do gold (registrada por process_census_duckdb.py)
+    params = dict(LINEAGE_PARAMS, dictionary=LineageManifest(os.path.dirname(GOLD_PATH)).params_of(GOLD_PATH, 'dictionary'))
+    # Refresh parcial (--only) sempre roda e não é registrado como saída completa
+    if TILE_ONLY is None:
+        changed = ['<force>'] if FORCE else lineage.changed_inputs(OUTPUT_DIR, inputs, params)
+        lineage.report(OUTPUT_DIR, changed)
+        if not changed:
+            return
+    lineage.invalidate(OUTPUT_DIR)
+
+    ok = run_tiled() if TILE_MODE else run_global()
+    if ok and TILE_ONLY is None:
+        lineage.record(OUTPUT_DIR, inputs, params)
+    elif not ok:
+        print("⚠️ Output not recorded in the lineage (next run rebuilds it).")
 
     print(f"Total execution time: {time.time() - start_time:.2f}s")
 
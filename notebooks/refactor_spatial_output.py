@@ -1,28 +1,31 @@
-import pandas as pd
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from diamond_writer import diamond_families, read_diamond_dataset
 
 # Paths
-DIAMOND_FILE = r"c:\projetos\projeto-censo\data\diamond\censo_2022_diamond_features.parquet"
+DIAMOND_DIR = r"c:\projetos\projeto-censo\data\diamond\censo_2022_diamond_features"
 OUTPUT_SPATIAL_FILE = r"c:\projetos\projeto-censo\data\diamond\censo_2022_spatial_features_only.parquet"
-GOLD_FILE = r"c:\projetos\projeto-censo\data\gold\censo_2022_features_final.parquet"
+# Colunas da malha (não estão no Gold) que acompanham as features espaciais
+MESH_COLUMNS = ['code_tract', 'name_muni']
 
 def main():
     print("Loading Diamond Dataset...")
-    if not os.path.exists(DIAMOND_FILE):
-        print(f"Error: {DIAMOND_FILE} not found.")
+    if not os.path.exists(DIAMOND_DIR):
+        print(f"Error: {DIAMOND_DIR} not found.")
         return
 
-    df_diamond = pd.read_parquet(DIAMOND_FILE)
+    # The dataset is split by feature family: everything except 'base'
+    # (the Gold columns) is a new spatial feature, so only those files are read.
+    # From 'base' only the mesh columns (not in Gold) are kept.
+    families = [f for f in diamond_families(DIAMOND_DIR) if f != 'base']
+    df_diamond = read_diamond_dataset(DIAMOND_DIR, families=families)
+    df_mesh = read_diamond_dataset(DIAMOND_DIR, columns=MESH_COLUMNS, families=['base'])
+    df_diamond = df_mesh.merge(df_diamond, on='CD_SETOR', how='inner')
     print(f"Diamond Shape: {df_diamond.shape}")
     
-    # Load Gold columns to identify what is "original" and what is "new"
-    print("Loading Gold columns for comparison...")
-    df_gold = pd.read_parquet(GOLD_FILE)
-    gold_cols = set(df_gold.columns)
-    
-    # Identify new columns
-    all_cols = set(df_diamond.columns)
-    new_cols = list(all_cols - gold_cols)
+    new_cols = list(df_diamond.columns)
     
     # Ensure CD_SETOR is in the list for joining
     if 'CD_SETOR' not in new_cols:
@@ -1,21 +1,50 @@
 import pandas as pd
 import geopandas as gpd
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from diamond_writer import read_diamond_dataset
+from lineage import LineageManifest
+from sector_dataset import write_partitioned
+from sector_centroids import ensure_centroid_table
+from sector_key import normalize_sector_key
 
 # Paths
-DIAMOND_FILE = r"c:\projetos\projeto-censo\data\diamond\censo_2022_diamond_features.parquet"
+# Dataset Diamond (pasta com _manifest.json, gerada por process_spatial_features_heavy.py)
+DIAMOND_DIR = r"c:\projetos\projeto-censo\data\diamond\censo_2022_diamond_features"
 GOLD_FILE = r"c:\projetos\projeto-censo\data\gold\censo_2022_features_final.parquet"
 RAW_SPATIAL_FILE = r"c:\projetos\projeto-censo\data\spatial\malha_setores_2022.parquet"
 
-# Outputs
-OUTPUT_MESH = r"c:\projetos\projeto-censo\data\spatial\malha_setores_2022_final.parquet"
-OUTPUT_DIAMOND_FEATURES = r"c:\projetos\projeto-censo\data\diamond\censo_2022_diamond_features_final.parquet"
-OUTPUT_GOLD_FEATURES = r"c:\projetos\projeto-censo\data\gold\censo_2022_gold_standardized.parquet"
+# Outputs: datasets particionados por UF (id_uf=XX/), ordenados por id_setor.
+# Para ler uma cidade: sector_dataset.read_sectors(path, municipio=..., columns=[...])
+OUTPUT_MESH = r"c:\projetos\projeto-censo\data\spatial\malha_setores_2022_final"
+OUTPUT_DIAMOND_FEATURES = r"c:\projetos\projeto-censo\data\diamond\censo_2022_diamond_features_final"
+OUTPUT_GOLD_FEATURES = r"c:\projetos\projeto-censo\data\gold\censo_2022_gold_standardized"
+# Centróides/pontos representativos/área/bbox por id_setor (EPSG:5880 e 4674), lidos
+# pelos estágios espaciais no lugar da geometria (ver src/sector_centroids.py)
+OUTPUT_CENTROIDS = r"c:\projetos\projeto-censo\data\spatial\malha_setores_2022_centroids.parquet"
+
+# Aumente quando os mapas de standardize_taxonomy mudarem: força refazer as três saídas
+TAXONOMY_VERSION = 2
+# Cada saída só é refeita se a entrada dela mudou (--force refaz tudo)
+FORCE = '--force' in sys.argv[1:]
+
+REGISTRY_COLS = [
+    'id_setor', 'geometry', 
+    'id_municipio', 'nm_municipio',
+    'id_distrito', 'nm_distrito',
+    'id_subdistrito', 'nm_subdistrito',
+    'id_bairro', 'nm_bairro',
+    'id_uf', 'nm_uf',
+    'id_regiao', 'nm_regiao',
+    'area_km2'
+]
 
 def standardize_taxonomy(df, is_spatial=False):
     """
     Applies the project taxonomy:
-    - id_*: Codes (String)
+    - id_setor: canonical int64 sector key; other id_*: codes as they come
     - nm_*: Names
     - Lowercase columns
     """
@@ -58,70 +87,96 @@ def standardize_taxonomy(df, is_spatial=False):
     # Remove duplicate columns (keep first)
     df = df.loc[:, ~df.columns.duplicated()]
     
-    # Ensure id_setor is string and clean
+    # Chave canônica int64 (trata float com .0 e texto; ver src/sector_key.py)
     if 'id_setor' in df.columns:
-        df['id_setor'] = df['id_setor'].astype(str)
-        # Remove .0 if present (from float conversion)
-        df['id_setor'] = df['id_setor'].str.replace(r'\.0$', '', regex=True)
+        df['id_setor'] = normalize_sector_key(df['id_setor'])
         
     return df
 
+def upstream_dictionary(path):
+    """
+    Dictionary version recorded in the lineage of an upstream output (gold file or Diamond dir).
+    """
+    return LineageManifest(os.path.dirname(os.path.abspath(path))).params_of(path, 'dictionary')
+
+def needs_build(output, inputs, params):
+    """
+    (lineage, params) if `output` must be rebuilt, None if its inputs are unchanged.
+    """
+    lineage = LineageManifest(os.path.dirname(output))
+    changed = ['<force>'] if FORCE else lineage.changed_inputs(output, inputs, params)
+    lineage.report(output, changed)
+    if not changed:
+        return None
+    lineage.invalidate(output)
+    return lineage
+
 def main():
     # ---------------------------------------------------------
     # 1. Create the Master Mesh (Cadastro)
     # ---------------------------------------------------------
-    print("Loading Raw Spatial Data (The Registry)...")
-    gdf_spatial = gpd.read_parquet(RAW_SPATIAL_FILE)
-    print(f"Raw Spatial Shape: {gdf_spatial.shape}")
-    
-    # Apply Taxonomy
-    gdf_mesh = standardize_taxonomy(gdf_spatial, is_spatial=True)
-    
-    # Select Registry Columns
-    registry_cols = [
-        'id_setor', 'geometry', 
-        'id_municipio', 'nm_municipio',
-        'id_distrito', 'nm_distrito',
-        'id_subdistrito', 'nm_subdistrito',
-        'id_bairro', 'nm_bairro',
-        'id_uf', 'nm_uf',
-        'id_regiao', 'nm_regiao',
-        'area_km2'
-    ]
-    # Filter only existing columns
-    registry_cols = [c for c in registry_cols if c in gdf_mesh.columns]
-    
-    gdf_mesh = gdf_mesh[registry_cols].copy()
-    
-    print(f"Saving Master Mesh (Cadastro) to {OUTPUT_MESH}...")
-    os.makedirs(os.path.dirname(OUTPUT_MESH), exist_ok=True)
-    gdf_mesh.to_parquet(OUTPUT_MESH)
-    print(f"Mesh saved: {gdf_mesh.shape}")
+    mesh_inputs = {'mesh': RAW_SPATIAL_FILE}
+    mesh_params = {'taxonomy': TAXONOMY_VERSION}
+    lineage = needs_build(OUTPUT_MESH, mesh_inputs, mesh_params)
+    if lineage:
+        print("Loading Raw Spatial Data (The Registry)...")
+        gdf_spatial = gpd.read_parquet(RAW_SPATIAL_FILE)
+        print(f"Raw Spatial Shape: {gdf_spatial.shape}")
+        
+        # Apply Taxonomy
+        gdf_mesh = standardize_taxonomy(gdf_spatial, is_spatial=True)
+        
+        # Filter only existing registry columns
+        registry_cols = [c for c in REGISTRY_COLS if c in gdf_mesh.columns]
+        
+        gdf_mesh = gdf_mesh[registry_cols].copy()
+        
+        print(f"Saving Master Mesh (Cadastro) to {OUTPUT_MESH}...")
+        os.makedirs(os.path.dirname(OUTPUT_MESH), exist_ok=True)
+        write_partitioned(gdf_mesh, OUTPUT_MESH, key='id_setor')
+        lineage.record(OUTPUT_MESH, mesh_inputs, mesh_params)
+        print(f"Mesh saved: {gdf_mesh.shape}")
+        del gdf_spatial, gdf_mesh
+
+    # Tabela de centróides da mesma malha (linhagem própria)
+    ensure_centroid_table(RAW_SPATIAL_FILE, OUTPUT_CENTROIDS, key='code_tract', force=FORCE)
 
     # ---------------------------------------------------------
     # 2. Process GOLD Dataset
     # ---------------------------------------------------------
-    print("\nLoading Gold Dataset...")
-    try:
-        df_gold = pd.read_parquet(GOLD_FILE)
-        df_gold = standardize_taxonomy(df_gold, is_spatial=False)
-        
-        # Remove geometry/registry info if present to keep it pure features
-        cols_to_drop = [c for c in df_gold.columns if c in registry_cols and c != 'id_setor']
-        if cols_to_drop:
-            df_gold = df_gold.drop(columns=cols_to_drop)
+    gold_inputs = {'gold': GOLD_FILE}
+    gold_params = {'taxonomy': TAXONOMY_VERSION, 'dictionary': upstream_dictionary(GOLD_FILE)}
+    lineage = needs_build(OUTPUT_GOLD_FEATURES, gold_inputs, gold_params)
+    if lineage:
+        print("\nLoading Gold Dataset...")
+        try:
+            df_gold = pd.read_parquet(GOLD_FILE)
+            df_gold = standardize_taxonomy(df_gold, is_spatial=False)
             
-        print(f"Saving Gold to {OUTPUT_GOLD_FEATURES}...")
-        df_gold.to_parquet(OUTPUT_GOLD_FEATURES)
-    except Exception as e:
-        print(f"Error processing Gold: {e}")
+            # Remove geometry/registry info if present to keep it pure features
+            cols_to_drop = [c for c in df_gold.columns if c in REGISTRY_COLS and c != 'id_setor']
+            if cols_to_drop:
+                df_gold = df_gold.drop(columns=cols_to_drop)
+                
+            print(f"Saving Gold to {OUTPUT_GOLD_FEATURES}...")
+            write_partitioned(df_gold, OUTPUT_GOLD_FEATURES, key='id_setor')
+            lineage.record(OUTPUT_GOLD_FEATURES, gold_inputs, gold_params)
+            del df_gold
+        except Exception as e:
+            print(f"Error processing Gold: {e}")
 
     # ---------------------------------------------------------
     # 3. Process DIAMOND Dataset
     # ---------------------------------------------------------
+    diamond_inputs = {'diamond': DIAMOND_DIR}
+    diamond_params = {'taxonomy': TAXONOMY_VERSION, 'dictionary': upstream_dictionary(DIAMOND_DIR)}
+    lineage = needs_build(OUTPUT_DIAMOND_FEATURES, diamond_inputs, diamond_params)
+    if not lineage:
+        return
+
     print("\nLoading Diamond Dataset...")
-    # Load as pandas (ignore geometry, we have it in Mesh)
-    df_diamond = pd.read_parquet(DIAMOND_FILE)
+    # Reassemble from the manifest (no geometry, we have it in Mesh)
+    df_diamond = read_diamond_dataset(DIAMOND_DIR)
     
     # If it has geometry, drop it immediately to save memory/confusion
     if 'geometry' in df_diamond.columns:
@@ -131,14 +186,15 @@ def main():
     
     # Remove registry info (names of munis, ufs etc) to avoid duplication with Mesh
     # Keep only id_setor and the metrics
-    cols_to_drop = [c for c in df_diamond.columns if c in registry_cols and c != 'id_setor']
+    cols_to_drop = [c for c in df_diamond.columns if c in REGISTRY_COLS and c != 'id_setor']
     if cols_to_drop:
         print(f"Dropping redundant registry columns from Diamond: {cols_to_drop}")
         df_diamond = df_diamond.drop(columns=cols_to_drop)
     
     # Save Features
     print(f"Saving Diamond Features to {OUTPUT_DIAMOND_FEATURES}...")
-    df_diamond.to_parquet(OUTPUT_DIAMOND_FEATURES)
+    write_partitioned(df_diamond, OUTPUT_DIAMOND_FEATURES, key='id_setor')
+    lineage.record(OUTPUT_DIAMOND_FEATURES, diamond_inputs, diamond_params)
     
     print("\nSuccess! Taxonomy applied. Mesh contains Registry. Features contain Metrics.")
 
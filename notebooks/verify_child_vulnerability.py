@@ -1,8 +1,11 @@
-import duckdb
-import pandas as pd
 import os
+import sys
 
-parquet_path = r'C:\projetos\projeto-censo\data\gold\censo_2022_features_final.parquet'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from sector_dataset import read_sectors, dataset_columns
+
+# Gold particionado por UF (gerado por process_census_duckdb.py)
+parquet_path = r'C:\projetos\projeto-censo\data\gold\censo_2022_features_final'
 
 print(f"Verificando arquivo: {parquet_path}")
 
@@ -10,30 +13,28 @@ if not os.path.exists(parquet_path):
     print("Arquivo não encontrado!")
     exit()
 
-con = duckdb.connect()
-df = con.execute(f"SELECT * FROM read_parquet('{parquet_path}') LIMIT 10").df()
-
 print("\nColunas disponíveis:")
-cols = df.columns.tolist()
+cols = dataset_columns(parquet_path)
 print(cols)
 
 target_cols = ['pct_criancas_agua_inadequada', 'pct_criancas_esgoto_inadequado', 'pct_criancas_lixo_inadequado']
 missing = [c for c in target_cols if c not in cols]
 
 if not missing:
+    # Só as 3 colunas (+ CD_SETOR) são lidas
+    df = read_sectors(parquet_path, columns=target_cols)
+
     print("\n--- Amostra de Vulnerabilidade Infantil ---")
     print(df[['CD_SETOR'] + target_cols].head())
     
     # Check stats
-    stats = con.execute(f"""
-        SELECT 
-            AVG(pct_criancas_agua_inadequada) as avg_agua,
-            AVG(pct_criancas_esgoto_inadequado) as avg_esgoto,
-            AVG(pct_criancas_lixo_inadequado) as avg_lixo,
-            MAX(pct_criancas_agua_inadequada) as max_agua,
-            COUNT(*) as total_rows
-        FROM read_parquet('{parquet_path}')
-    """).df()
+    stats = {
+        'avg_agua': df['pct_criancas_agua_inadequada'].mean(),
+        'avg_esgoto': df['pct_criancas_esgoto_inadequado'].mean(),
+        'avg_lixo': df['pct_criancas_lixo_inadequado'].mean(),
+        'max_agua': df['pct_criancas_agua_inadequada'].max(),
+        'total_rows': len(df),
+    }
     print("\n--- Estatísticas ---")
     print(stats)
 else:
@@ -1,14 +1,17 @@
-import duckdb
 import os
+import sys
 
-output_parquet = r'C:\projetos\projeto-censo\data\gold\censo_2022_features_final.parquet'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from sector_dataset import read_sectors, dataset_columns
 
-con = duckdb.connect(':memory:')
-if os.path.exists(output_parquet):
-    print(f"Inspecting Final Dataset: {output_parquet}")
+# Gold particionado por UF (gerado por process_census_duckdb.py); só o schema
+# e as colunas verificadas são lidos
+output_dataset = r'C:\projetos\projeto-censo\data\gold\censo_2022_features_final'
+
+if os.path.exists(output_dataset):
+    print(f"Inspecting Final Dataset: {output_dataset}")
     # Get columns
-    df_cols = con.execute(f"DESCRIBE SELECT * FROM read_parquet('{output_parquet}')").df()
-    cols = df_cols['column_name'].tolist()
+    cols = dataset_columns(output_dataset)
     
     print(f"Total Columns: {len(cols)}")
     
@@ -28,8 +31,8 @@ if os.path.exists(output_parquet):
         if feat in cols:
             print(f"[OK] {feat}")
             # Show some stats
-            stats = con.execute(f"SELECT MIN({feat}), AVG({feat}), MAX({feat}) FROM read_parquet('{output_parquet}')").fetchone()
-            print(f"    Min: {stats[0]:.4f}, Avg: {stats[1]:.4f}, Max: {stats[2]:.4f}")
+            values = read_sectors(output_dataset, columns=[feat])[feat]
+            print(f"    Min: {values.min():.4f}, Avg: {values.mean():.4f}, Max: {values.max():.4f}")
         else:
             print(f"[MISSING] {feat}")
 
@@ -1,8 +1,11 @@
-import duckdb
-import pandas as pd
 import os
+import sys
 
-parquet_path = r'C:\projetos\projeto-censo\data\gold\censo_2022_features_final.parquet'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from sector_dataset import read_sectors, dataset_columns
+
+# Gold particionado por UF (gerado por process_census_duckdb.py)
+parquet_path = r'C:\projetos\projeto-censo\data\gold\censo_2022_features_final'
 
 print(f"Verificando arquivo: {parquet_path}")
 
@@ -10,26 +13,25 @@ if not os.path.exists(parquet_path):
     print("Arquivo não encontrado!")
     exit()
 
-con = duckdb.connect()
-df = con.execute(f"SELECT * FROM read_parquet('{parquet_path}') LIMIT 10").df()
-
+cols = dataset_columns(parquet_path)
 print("\nColunas disponíveis:")
-print(df.columns.tolist())
+print(cols)
+
+if 'taxa_alfabetizacao_15_mais' in cols:
+    df = read_sectors(parquet_path, columns=['taxa_alfabetizacao_15_mais'])
 
-if 'taxa_alfabetizacao_15_mais' in df.columns:
     print("\n--- Amostra de Taxa de Alfabetização ---")
     print(df[['CD_SETOR', 'taxa_alfabetizacao_15_mais']].head())
     
     # Check for nulls or weird values
-    stats = con.execute(f"""
-        SELECT 
-            MIN(taxa_alfabetizacao_15_mais) as min_rate,
-            MAX(taxa_alfabetizacao_15_mais) as max_rate,
-            AVG(taxa_alfabetizacao_15_mais) as avg_rate,
-            COUNT(*) as total_rows,
-            COUNT(taxa_alfabetizacao_15_mais) as non_null_rows
-        FROM read_parquet('{parquet_path}')
-    """).df()
+    rate = df['taxa_alfabetizacao_15_mais']
+    stats = {
+        'min_rate': rate.min(),
+        'max_rate': rate.max(),
+        'avg_rate': rate.mean(),
+        'total_rows': len(df),
+        'non_null_rows': int(rate.notna().sum()),
+    }
     print("\n--- Estatísticas ---")
     print(stats)
 else:
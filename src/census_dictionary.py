@@ -0,0 +1,135 @@
+import os
+import re
+import sys
+import hashlib
+from unicodedata import normalize
+import pandas as pd
+
+# ==============================================================================
+# DICIONÁRIO DE DADOS COMPILADO (cache do xlsx do IBGE)
+# ==============================================================================
+# Abrir e percorrer o xlsx do dicionário leva segundos em todo script que
+# precisa dos nomes das variáveis. Aqui o xlsx é compilado UMA vez para uma
+# tabela Parquet compacta, cujo nome leva o hash do conteúdo do xlsx:
+#
+#   dictionary_cache/dicionario_<sha256[:16]>.parquet
+#
+# Enquanto o IBGE não publicar um dicionário novo, os scripts carregam o cache
+# em milissegundos. Colunas da tabela:
+#   code         código da variável (V0001)
+#   slug         descrição normalizada (total_de_pessoas)
+#   column       nome da coluna no silver (slug + "_" + código em minúsculas)
+#   sheet        planilha (tema) de origem
+#   sheet_row    posição da variável dentro da planilha
+#   description  descrição original
+#   dtype        'float64' para médias/taxas/percentuais, 'int64' para contagens
+
+DATA_DIR = r"c:\projetos\projeto-censo\data\raw"
+DICT_FILE = os.path.join(DATA_DIR, "dicionario_de_dados_agregados_por_setores_censitarios_20250417.xlsx")
+CACHE_DIR_NAME = "dictionary_cache"
+
+# Incrementar quando a lógica de compilação (slug, colunas) mudar
+COMPILER_VERSION = 1
+
+FLOAT_KEYWORDS = [
+    'media', 'variancia', 'percentual', 'razao', 'taxa', 'rendimento',
+    'valor', 'area', 'densidade', 'indice',
+]
+
+def slugify(text):
+    if not isinstance(text, str):
+        return str(text)
+    text = normalize('NFKD', text).encode('ASCII', 'ignore').decode('ASCII')
+    text = text.lower()
+    text = re.sub(r'[^a-z0-9]+', '_', text)
+    text = text.strip('_')
+    return text
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def guess_dtype(slug):
+    words = slug.split('_')
+    return 'float64' if any(k in words for k in FLOAT_KEYWORDS) else 'int64'
+
+def compile_dictionary(xlsx_path=DICT_FILE):
+    """
+    Parses every variable sheet of the IBGE xlsx (one workbook open) into
+    a single table, in sheet order.
+    """
+    sheets = pd.read_excel(xlsx_path, sheet_name=None)
+    parts = []
+    for sheet, df in sheets.items():
+        if 'Siglas' in sheet: continue
+        if 'Variável' not in df.columns or 'Descrição' not in df.columns: continue
+
+        codes = df['Variável'].astype(str).str.strip().str.upper()
+        descriptions = df['Descrição']
+        slugs = descriptions.map(slugify)
+        parts.append(pd.DataFrame({
+            'code': codes,
+            'slug': slugs,
+            # Append code to ensure uniqueness and traceability
+            'column': slugs + '_' + codes.str.lower(),
+            'sheet': sheet,
+            'sheet_row': range(len(df)),
+            'description': descriptions.astype(str),
+            'dtype': slugs.map(guess_dtype),
+        }))
+
+    if not parts:
+        return pd.DataFrame(columns=['code', 'slug', 'column', 'sheet', 'sheet_row', 'description', 'dtype'])
+    return pd.concat(parts, ignore_index=True)
+
+def dictionary_version(xlsx_path=DICT_FILE):
+    """
+    Compiler version + xlsx content hash, e.g. 'v1_3f2a...'. Recorded in the
+    lineage of every layer built from the renamed silver columns.
+    """
+    return f"v{COMPILER_VERSION}_{file_hash(xlsx_path)[:16]}"
+
+def cache_path(xlsx_path=DICT_FILE, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(xlsx_path), CACHE_DIR_NAME)
+    return os.path.join(cache_dir, f"dicionario_{dictionary_version(xlsx_path)}.parquet")
+
+def load_dictionary_table(xlsx_path=DICT_FILE, cache_dir=None):
+    """
+    Compiled dictionary table, rebuilt only when the xlsx content changes.
+    """
+    path = cache_path(xlsx_path, cache_dir)
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+
+    print(f"Compiling dictionary {os.path.basename(xlsx_path)} -> {path}")
+    table = compile_dictionary(xlsx_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    table.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return table
+
+def load_var_map(xlsx_path=DICT_FILE, cache_dir=None):
+    """
+    {VARIABLE_CODE: silver column name}. When a code appears in more than one
+    sheet the last one wins, as in the original iterrows loop.
+    """
+    table = load_dictionary_table(xlsx_path, cache_dir)
+    return dict(zip(table['code'], table['column']))
+
+def load_dtype_map(xlsx_path=DICT_FILE, cache_dir=None):
+    """
+    {VARIABLE_CODE: 'int64' | 'float64'}, same last-wins rule as load_var_map.
+    """
+    table = load_dictionary_table(xlsx_path, cache_dir)
+    return dict(zip(table['code'], table['dtype']))
+
+if __name__ == "__main__":
+    xlsx = sys.argv[1] if len(sys.argv) > 1 else DICT_FILE
+    table = load_dictionary_table(xlsx)
+    print(f"{len(table)} variables in {table['sheet'].nunique()} sheets.")
+    print(table.groupby('sheet').size().to_string())
@@ -0,0 +1,379 @@
+import os
+import sys
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# ==============================================================================
+# GEOCODIFICAÇÃO POR CEP + NÚMERO (índice sobre o CNEFE em Parquet)
+# ==============================================================================
+# O cnefe_2022_optimized.parquet (ingest_cnefe_to_parquet.py) está ordenado por
+# cep, numero dentro de cada UF. Este módulo monta UMA vez um índice compacto
+# em memória e resolve lotes de endereços sem varrer o Parquet:
+#
+#   ceps      uint32 (n_ceps)   CEPs distintos, ordenados
+#   cep_start int64  (n_ceps)   faixa [start, stop) de cada CEP nos arrays abaixo
+#   cep_stop  int64  (n_ceps)
+#   numeros   int32  (n_rows)   número do endereço (-1 = SN/não numérico),
+#                               ordenado numericamente dentro de cada CEP
+#   row_ids   uint32 (n_rows)   linha correspondente no dataset Parquet
+#
+# Cerca de 8 bytes por endereço. A busca do número é uma bissecção vetorizada
+# dentro da faixa do CEP; se o número não existir, usa o número mais próximo
+# do mesmo CEP. Latitude/longitude/setor são lidos depois, só dos row groups
+# que contêm as linhas encontradas (offsets dos row groups vêm do metadata).
+
+BASE_DIR = Path(__file__).parent.parent
+CNEFE_PATH = BASE_DIR / "data" / "processed" / "cnefe_2022_optimized.parquet"
+INDEX_DIR = BASE_DIR / "data" / "processed" / "cnefe_address_index"
+
+ARRAY_NAMES = ['ceps', 'cep_start', 'cep_stop', 'numeros', 'row_ids']
+VALUE_COLUMNS = ['latitude', 'longitude', 'id_setor_censitario']
+NO_NUMBER = -1
+NUMBER_PATTERN = r'^\s*(\d{1,9})'
+# Row groups decodificados mantidos em memória entre lotes
+ROW_GROUP_CACHE = 64
+
+MATCH_EXACT = 'exact'
+MATCH_NEAREST = 'nearest'
+MATCH_CEP = 'cep'
+
+
+def dataset_files(path=CNEFE_PATH):
+    """
+    Parquet files of the CNEFE dataset (a single file or a COD_UF=xx/ directory), in a stable order.
+    """
+    path = Path(path)
+    if path.is_file():
+        return [path]
+    return sorted(p for p in path.rglob("*.parquet") if not p.name.startswith('.'))
+
+
+def dataset_signature(files):
+    return [{'path': str(p), 'size': os.path.getsize(p), 'mtime': int(os.path.getmtime(p))} for p in files]
+
+
+def parse_ceps(values):
+    """
+    CEPs as uint32 (0 = invalid). Accepts strings with or without '-', or integers.
+    """
+    s = pd.Series(values).astype('string').str.replace(r'\D', '', regex=True)
+    s = s.where(s.str.len().between(1, 8))
+    return pd.to_numeric(s, errors='coerce').fillna(0).to_numpy(np.uint32)
+
+
+def parse_numeros(values):
+    """
+    Leading integer of the address number ('123A' -> 123); NO_NUMBER for 'SN', '', None.
+    """
+    s = pd.Series(values).astype('string').str.extract(NUMBER_PATTERN, expand=False)
+    return pd.to_numeric(s, errors='coerce').fillna(NO_NUMBER).to_numpy(np.int32)
+
+
+def _parse_arrow_ceps(column):
+    digits = pc.replace_substring_regex(column.cast(pa.string()), r'\D', '')
+    valid = pc.and_(pc.greater(pc.utf8_length(digits), 0), pc.less_equal(pc.utf8_length(digits), 8))
+    digits = pc.if_else(valid, digits, pa.scalar(None, pa.string()))
+    return pc.fill_null(pc.cast(digits, pa.uint32()), 0).to_numpy(zero_copy_only=False)
+
+
+def _parse_arrow_numeros(column):
+    match = pc.extract_regex(column.cast(pa.string()), NUMBER_PATTERN.replace('(', '(?P<n>', 1))
+    numbers = pc.cast(pc.struct_field(match, [0]), pa.int64())
+    return pc.fill_null(numbers, NO_NUMBER).to_numpy(zero_copy_only=False).astype(np.int32)
+
+
+class AddressIndex:
+    """
+    CEP -> row range index over the CNEFE Parquet, with numbers sorted inside each CEP.
+    """
+
+    def __init__(self, ceps, cep_start, cep_stop, numeros, row_ids, files, row_group_offsets):
+        self.ceps = ceps
+        self.cep_start = cep_start
+        self.cep_stop = cep_stop
+        self.numeros = numeros
+        self.row_ids = row_ids
+        self.files = files                          # [{'path', 'size', 'mtime'}]
+        self.row_group_offsets = row_group_offsets  # por arquivo: início de cada row group (+ total no fim)
+        self.file_offsets = np.cumsum([0] + [offsets[-1] for offsets in row_group_offsets])
+        self._readers = {}
+        self._cache = OrderedDict()
+
+    @property
+    def n_rows(self):
+        return len(self.numeros)
+
+    # --------------------------------------------------------------------------
+    # BUILD
+    # --------------------------------------------------------------------------
+    @classmethod
+    def build(cls, path=CNEFE_PATH):
+        """
+        Reads only cep and numero from every file and sorts (cep, numero) per file.
+        """
+        files = dataset_files(path)
+        if not files:
+            raise FileNotFoundError(f"No Parquet files found in {path}")
+
+        cep_parts, numero_parts, row_parts = [], [], []
+        row_group_offsets = []
+        offset = 0
+        for file_path in files:
+            pf = pq.ParquetFile(file_path)
+            counts = [pf.metadata.row_group(i).num_rows for i in range(pf.num_row_groups)]
+            row_group_offsets.append(np.cumsum([0] + counts).tolist())
+
+            table = pf.read(columns=['cep', 'numero'])
+            ceps = _parse_arrow_ceps(table.column('cep'))
+            numeros = _parse_arrow_numeros(table.column('numero'))
+            del table
+
+            # O Parquet está ordenado por numero como TEXTO ('10' < '2'):
+            # reordena numericamente dentro de cada CEP
+            order = np.lexsort((numeros, ceps))
+            keep = order[ceps[order] != 0]
+            cep_parts.append(ceps[keep])
+            numero_parts.append(numeros[keep])
+            row_parts.append((keep + offset).astype(np.uint32))
+            offset += len(ceps)
+            print(f"  Indexed {file_path.parent.name}/{file_path.name}: {len(ceps):,} rows")
+
+        ceps = np.concatenate(cep_parts)
+        numeros = np.concatenate(numero_parts)
+        row_ids = np.concatenate(row_parts)
+        del cep_parts, numero_parts, row_parts
+
+        # Cada arquivo está ordenado, mas uma mesma faixa de CEP pode aparecer
+        # em mais de uma UF: ordena o conjunto (estável) para ter faixas contíguas
+        if np.any(ceps[1:] < ceps[:-1]):
+            order = np.lexsort((numeros, ceps))
+            ceps, numeros, row_ids = ceps[order], numeros[order], row_ids[order]
+
+        boundaries = np.flatnonzero(np.diff(ceps)) + 1
+        cep_start = np.concatenate([[0], boundaries]).astype(np.int64)
+        cep_stop = np.concatenate([boundaries, [len(ceps)]]).astype(np.int64)
+        unique_ceps = ceps[cep_start]
+
+        return cls(unique_ceps, cep_start, cep_stop, numeros, row_ids,
+                   dataset_signature(files), row_group_offsets)
+
+    # --------------------------------------------------------------------------
+    # PERSISTÊNCIA
+    # --------------------------------------------------------------------------
+    def save(self, path=INDEX_DIR):
+        """
+        Saves the index as a directory of .npy files plus a meta.json.
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        meta = {
+            'n_rows': self.n_rows,
+            'n_ceps': len(self.ceps),
+            'files': self.files,
+            'row_group_offsets': self.row_group_offsets,
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path=INDEX_DIR, mmap_mode=None):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        return cls(files=meta['files'], row_group_offsets=meta['row_group_offsets'], **arrays)
+
+    @classmethod
+    def load_or_build(cls, path=INDEX_DIR, cnefe_path=CNEFE_PATH, mmap_mode=None):
+        """
+        Reuses the index saved at `path` while the CNEFE files are unchanged
+        (same paths, sizes and mtimes); otherwise builds it and saves it.
+        """
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['files'] == dataset_signature(dataset_files(cnefe_path)):
+                print(f"Loading cached AddressIndex from {path}...")
+                return cls.load(path, mmap_mode=mmap_mode)
+
+        print(f"Building AddressIndex from {cnefe_path}...")
+        start = time.time()
+        index = cls.build(cnefe_path)
+        index.save(path)
+        print(f"AddressIndex: {index.n_rows:,} addresses, {len(index.ceps):,} CEPs in {time.time() - start:.1f}s")
+        return index
+
+    # --------------------------------------------------------------------------
+    # BUSCA
+    # --------------------------------------------------------------------------
+    def _search_numbers(self, lo, hi, targets):
+        """
+        Vectorized bisection: first position in [lo, hi) with numero >= target.
+        """
+        lo = lo.copy()
+        hi = hi.copy()
+        active = lo < hi
+        while active.any():
+            mid = (lo + hi) // 2
+            go_right = active & (self.numeros[np.minimum(mid, self.n_rows - 1)] < targets)
+            lo = np.where(go_right, mid + 1, lo)
+            hi = np.where(active & ~go_right, mid, hi)
+            active = lo < hi
+        return lo
+
+    def match(self, ceps, numeros):
+        """
+        Resolves (CEP, number) pairs to dataset rows.
+        Returns (row ids as int64 with -1 when the CEP is unknown, match level, number found).
+        """
+        ceps = parse_ceps(ceps)
+        numeros = parse_numeros(numeros)
+        n = len(ceps)
+
+        rows = np.full(n, -1, dtype=np.int64)
+        level = np.full(n, None, dtype=object)
+        found = np.full(n, NO_NUMBER, dtype=np.int64)
+
+        pos = np.searchsorted(self.ceps, ceps)
+        pos_c = np.minimum(pos, len(self.ceps) - 1)
+        known = (ceps != 0) & (self.ceps[pos_c] == ceps)
+        if not known.any():
+            return rows, level, found
+
+        q = np.flatnonzero(known)
+        start = self.cep_start[pos_c[q]]
+        stop = self.cep_stop[pos_c[q]]
+        # Endereços sem número (-1) ficam no começo da faixa do CEP
+        first_numbered = self._search_numbers(start, stop, np.zeros(len(q), dtype=np.int32))
+        has_numbers = first_numbered < stop
+        target = numeros[q].astype(np.int64)
+
+        # Candidatos: primeiro número >= alvo e o anterior a ele (mesmo CEP)
+        right = self._search_numbers(first_numbered, stop, target)
+        left = right - 1
+        right_ok = right < stop
+        left_ok = left >= first_numbered
+        right_num = np.where(right_ok, self.numeros[np.minimum(right, self.n_rows - 1)], 0).astype(np.int64)
+        left_num = np.where(left_ok, self.numeros[np.clip(left, 0, self.n_rows - 1)], 0).astype(np.int64)
+        use_left = left_ok & (~right_ok | (target - left_num <= right_num - target))
+        pick = np.where(use_left, left, right)
+        pick_num = np.where(use_left, left_num, right_num)
+
+        numbered = (target != NO_NUMBER) & has_numbers
+        # Sem número (ou CEP só com SN): endereço do meio da faixa do CEP
+        pick = np.where(numbered, pick, (start + stop) // 2)
+        pick_num = np.where(numbered, pick_num, self.numeros[(start + stop) // 2])
+
+        rows[q] = self.row_ids[pick]
+        found[q] = pick_num
+        level[q] = np.where(~numbered, MATCH_CEP, np.where(pick_num == target, MATCH_EXACT, MATCH_NEAREST))
+        return rows, level, found
+
+    # --------------------------------------------------------------------------
+    # LEITURA DOS VALORES (row groups necessários)
+    # --------------------------------------------------------------------------
+    def _row_group(self, file_id, rg, columns):
+        key = (file_id, rg, tuple(columns))
+        table = self._cache.get(key)
+        if table is not None:
+            self._cache.move_to_end(key)
+            return table
+        reader = self._readers.get(file_id)
+        if reader is None:
+            reader = pq.ParquetFile(self.files[file_id]['path'])
+            self._readers[file_id] = reader
+        table = reader.read_row_group(rg, columns=list(columns))
+        self._cache[key] = table
+        if len(self._cache) > ROW_GROUP_CACHE:
+            self._cache.popitem(last=False)
+        return table
+
+    def take(self, rows, columns=VALUE_COLUMNS):
+        """
+        Values of `columns` at dataset rows (-1 -> null), reading only the row groups that contain them.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        out = {c: np.full(len(rows), np.nan, dtype=object) for c in columns}
+        valid = np.flatnonzero(rows >= 0)
+        if len(valid) == 0:
+            return pd.DataFrame(out)
+
+        integer_columns = set()
+        file_ids = np.searchsorted(self.file_offsets, rows[valid], side='right') - 1
+        local = rows[valid] - self.file_offsets[file_ids]
+        for file_id in np.unique(file_ids):
+            in_file = file_ids == file_id
+            offsets = np.asarray(self.row_group_offsets[file_id])
+            rgs = np.searchsorted(offsets, local[in_file], side='right') - 1
+            for rg in np.unique(rgs):
+                sel = np.flatnonzero(in_file)[rgs == rg]
+                table = self._row_group(int(file_id), int(rg), columns)
+                picked = table.take(pa.array(local[sel] - offsets[rg]))
+                for c in columns:
+                    out[c][valid[sel]] = picked.column(c).to_numpy(zero_copy_only=False)
+                    if pa.types.is_integer(picked.schema.field(c).type):
+                        integer_columns.add(c)
+
+        df = pd.DataFrame(out)
+        for c in columns:
+            if c in integer_columns:
+                df[c] = pd.array([None if pd.isna(v) else int(v) for v in df[c]], dtype='Int64')
+            elif c in ('latitude', 'longitude'):
+                df[c] = df[c].astype(float)
+        return df
+
+    def geocode(self, ceps, numeros, columns=VALUE_COLUMNS):
+        """
+        Batch geocoding. Returns one row per input with `columns` plus
+        match ('exact', 'nearest', 'cep' or None) and numero_encontrado.
+        """
+        rows, level, found = self.match(ceps, numeros)
+        result = self.take(rows, columns)
+        result['match'] = level
+        result['numero_encontrado'] = np.where(found == NO_NUMBER, np.nan, found)
+        return result
+
+
+def geocode_frame(df, cep_col='cep', numero_col='numero', index=None, batch_size=1_000_000):
+    """
+    Adds latitude/longitude/id_setor_censitario/match to a DataFrame of addresses.
+    """
+    if index is None:
+        index = AddressIndex.load_or_build()
+    parts = []
+    for start in range(0, len(df), batch_size):
+        chunk = df.iloc[start:start + batch_size]
+        parts.append(index.geocode(chunk[cep_col].to_numpy(), chunk[numero_col].to_numpy()))
+    result = pd.concat(parts, ignore_index=True) if parts else index.geocode([], [])
+    result.index = df.index
+    return pd.concat([df, result], axis=1)
+
+
+if __name__ == "__main__":
+    # Uso: python src/cnefe_geocoder.py enderecos.csv|parquet saida.parquet [coluna_cep] [coluna_numero]
+    if len(sys.argv) < 3:
+        print("Uso: python src/cnefe_geocoder.py <entrada.csv|parquet> <saida.parquet> [coluna_cep] [coluna_numero]")
+        sys.exit(1)
+    input_path, output_path = sys.argv[1], sys.argv[2]
+    cep_col = sys.argv[3] if len(sys.argv) > 3 else 'cep'
+    numero_col = sys.argv[4] if len(sys.argv) > 4 else 'numero'
+
+    if input_path.endswith('.parquet'):
+        addresses = pd.read_parquet(input_path)
+    else:
+        addresses = pd.read_csv(input_path, sep=None, engine='python', dtype=str)
+
+    start = time.time()
+    geocoded = geocode_frame(addresses, cep_col, numero_col)
+    elapsed = time.time() - start
+    print(f"Geocoded {len(geocoded):,} addresses in {elapsed:.1f}s ({len(geocoded) / max(elapsed, 1e-9):,.0f} addr/s)")
+    print(geocoded['match'].value_counts(dropna=False).to_string())
+    geocoded.to_parquet(output_path, index=False)
@@ -0,0 +1,148 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+# ==============================================================================
+# TILES COM HALO (Diamond por UF ou grade regular)
+# ==============================================================================
+# A execução global carrega o país inteiro em um GeoDataFrame. Em tiles, cada
+# worker recebe só os setores do seu tile (núcleo) mais um halo: todos os
+# setores a menos de H metros do retângulo do núcleo, com
+#
+#   H = max(maior raio da gravidade, maior distância ao (max_k)-ésimo vizinho
+#           entre os setores do núcleo)
+#
+# Assim todo vizinho KNN e todo vizinho dentro do raio de um setor do núcleo
+# está no tile, e os resultados do núcleo são idênticos aos da execução
+# global (o NeighborIndex desempata vizinhos por id, e os ids do tile seguem a
+# ordem global). O halo só entra como vizinhança: nada dele é gravado. Grafos
+# de contiguidade não dependem da distância: add_graph_neighbors inclui no halo
+# os setores que encostam no núcleo.
+#
+# A árvore usada para medir H é só de coordenadas (N x 2), barata mesmo para
+# o Brasil inteiro; o que não cabe em memória são as features, e essas cada
+# worker lê apenas para as linhas do seu tile.
+
+TILE_MODES = ('uf', 'grid')
+DEFAULT_GRID_SIZE = 200_000     # metros (CRS projetado)
+DEFAULT_MAX_ROWS = 60_000       # núcleo máximo por tile (tiles maiores viram quadrantes)
+# Folga no retângulo do halo para arredondamento de ponto flutuante
+HALO_SLACK_M = 1.0
+
+
+def tile_labels(keys, coords, mode='uf', grid_size=DEFAULT_GRID_SIZE):
+    """
+    Tile name of every sector: 'uf35' (first 2 digits of the key) or
+    'g003_012' (cell of a regular grid over the projected coordinates).
+    """
+    if mode == 'uf':
+        return np.array(['uf' + str(k)[:2] for k in keys], dtype=object)
+    if mode == 'grid':
+        cells = np.floor((coords - coords.min(axis=0)) / grid_size).astype(np.int64)
+        return np.array([f'g{x:03d}_{y:03d}' for x, y in cells], dtype=object)
+    raise ValueError(f"unknown tile mode '{mode}', expected one of {TILE_MODES}")
+
+
+def split_large_tiles(labels, coords, max_rows=DEFAULT_MAX_ROWS):
+    """
+    Splits every tile with more than max_rows sectors into quadrants around
+    its median point, recursively ('uf35' -> 'uf35_0' ... 'uf35_3'), so the
+    memory of a worker is bounded by max_rows plus the halo.
+    """
+    labels = labels.copy()
+    pending = [name for name in np.unique(labels)]
+    while pending:
+        name = pending.pop()
+        rows = np.flatnonzero(labels == name)
+        if len(rows) <= max_rows:
+            continue
+        cx, cy = np.median(coords[rows], axis=0)
+        quadrant = (coords[rows, 0] > cx).astype(int) + 2 * (coords[rows, 1] > cy).astype(int)
+        if len(np.unique(quadrant)) == 1:
+            # Pontos repetidos: divide pela ordem
+            quadrant = np.arange(len(rows)) * 4 // len(rows)
+        for qd in range(4):
+            child = f'{name}_{qd}'
+            labels[rows[quadrant == qd]] = child
+            pending.append(child)
+    return labels
+
+
+def halo_distance(tree, core_coords, max_k, max_radius):
+    """
+    Largest distance a core sector reaches: the gravity radius or its
+    (max_k)-th neighbor (k+1 with itself; never smaller than the true k-th).
+    """
+    if len(core_coords) == 0:
+        return float(max_radius)
+    k = min(max_k + 1, tree.n)
+    dists, _ = tree.query(core_coords, k=k)
+    dists = dists.reshape(len(core_coords), -1)
+    return float(max(max_radius, np.max(dists[:, -1])))
+
+
+def tile_rows(coords, tree, core, max_k, max_radius):
+    """
+    Sorted global ids of the core + halo rows of one tile and the halo
+    distance used.
+    """
+    h = halo_distance(tree, coords[core], max_k, max_radius) + HALO_SLACK_M
+    lo = coords[core].min(axis=0) - h
+    hi = coords[core].max(axis=0) + h
+    inside = np.all((coords >= lo) & (coords <= hi), axis=1)
+    return np.flatnonzero(inside), h
+
+
+def tile_selected(name, only):
+    """
+    True when `only` is empty or names the tile or one of its parents
+    ('uf35' selects 'uf35', 'uf35_0', 'uf35_0_2', ...).
+    """
+    return not only or any(name == o or name.startswith(o + '_') for o in only)
+
+
+def graph_rows(graph, ids):
+    """
+    Rows `ids` of a CSR graph (anything with indptr/indices): a local indptr
+    and the global neighbor ids.
+    """
+    indptr = np.asarray(graph.indptr)
+    cards = indptr[ids + 1] - indptr[ids]
+    local = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(cards, out=local[1:])
+    positions = np.repeat(indptr[ids] - local[:-1], cards) + np.arange(local[-1])
+    return local, np.asarray(graph.indices)[positions]
+
+
+def add_graph_neighbors(tile, graphs):
+    """
+    Adds the graph neighbors of the core rows to the tile (a polygon can touch
+    a sector beyond the distance halo) and returns {name: (indptr, indices)},
+    the core rows of every graph in positions of the new tile['rows'].
+    """
+    core_ids = tile['rows'][tile['core']]
+    parts = {name: graph_rows(graph, core_ids) for name, graph in graphs.items()}
+    tile['rows'] = np.unique(np.concatenate([tile['rows']] + [neighbors for _, neighbors in parts.values()]))
+    tile['core'] = np.searchsorted(tile['rows'], core_ids)
+    return {name: (indptr, np.searchsorted(tile['rows'], neighbors).astype(np.int32))
+            for name, (indptr, neighbors) in parts.items()}
+
+
+def build_tiles(keys, coords, mode='uf', max_k=15, max_radius=5000, grid_size=DEFAULT_GRID_SIZE,
+                max_rows=DEFAULT_MAX_ROWS, only=None):
+    """
+    Tile plan: list of {'name', 'rows' (core + halo, global ids in order),
+    'core' (positions of the core rows inside 'rows'), 'halo_m'}.
+    only: tile names or prefixes (e.g. ['uf35']) to build a subset.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    labels = split_large_tiles(tile_labels(keys, coords, mode, grid_size), coords, max_rows)
+    tree = cKDTree(coords)
+
+    tiles = []
+    for name in sorted(np.unique(labels)):
+        if not tile_selected(name, only):
+            continue
+        core = np.flatnonzero(labels == name)
+        rows, h = tile_rows(coords, tree, core, max_k, max_radius)
+        tiles.append({'name': name, 'rows': rows, 'core': np.searchsorted(rows, core), 'halo_m': h})
+    return tiles
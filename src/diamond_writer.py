@@ -0,0 +1,173 @@
+import os
+import json
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# ==============================================================================
+# DIAMOND DATASET WRITER (escrita incremental por família de features)
+# ==============================================================================
+# Em vez de concatenar todas as features em memória e gravar um único Parquet
+# gigante, cada lote de colunas é gravado assim que fica pronto em um arquivo
+# próprio dentro de uma pasta por família (base, gravity, knn_k5, ...):
+#
+#   censo_2022_diamond_features/
+#       _manifest.json
+#       base/part-0000.parquet
+#       gravity/part-0000.parquet
+#       knn_k5/part-0000.parquet ...
+#
+# Todos os arquivos têm as mesmas linhas, na mesma ordem, e repetem a coluna
+# chave (CD_SETOR). A geometria fica fora (ela já está na malha).
+# O _manifest.json lista arquivo -> colunas para o leitor remontar a tabela
+# lendo só os arquivos que contêm as colunas pedidas.
+
+MANIFEST_NAME = '_manifest.json'
+# Execução em tiles (diamond_tiles.py): um dataset como o acima por tile em
+# tile=<nome>/, e um _tiles.json na raiz com a lista de tiles
+TILES_NAME = '_tiles.json'
+ROW_GROUP_SIZE = 100_000
+COMPRESSION = 'zstd'
+
+
+class DiamondDatasetWriter:
+    """
+    Writes column batches of one table as separate Parquet files plus a manifest.
+    """
+
+    def __init__(self, directory, keys, key_name='CD_SETOR', overwrite=True):
+        if overwrite and os.path.exists(directory):
+            shutil.rmtree(directory)
+        self.directory = directory
+        self.key_name = key_name
+        self.keys = pa.array(pd.Series(keys).reset_index(drop=True))
+        self.n_rows = len(self.keys)
+        self.files = []
+        self._parts = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, family, frame):
+        """
+        Appends the columns of `frame` (same rows/order as the keys) as a new
+        file of `family`. Streams the table to disk in row groups.
+        """
+        if frame is None or frame.shape[1] == 0:
+            return None
+        if len(frame) != self.n_rows:
+            raise ValueError(f"{family}: expected {self.n_rows} rows, got {len(frame)}")
+
+        table = pa.Table.from_pandas(frame.reset_index(drop=True), preserve_index=False)
+        if self.key_name not in table.column_names:
+            table = table.add_column(0, self.key_name, self.keys)
+
+        part = self._parts.get(family, 0)
+        self._parts[family] = part + 1
+        rel_path = os.path.join(family, f"part-{part:04d}.parquet")
+        path = os.path.join(self.directory, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with pq.ParquetWriter(path, table.schema, compression=COMPRESSION) as writer:
+            for batch in table.to_batches(max_chunksize=ROW_GROUP_SIZE):
+                writer.write_batch(batch, row_group_size=ROW_GROUP_SIZE)
+
+        columns = [c for c in table.column_names if c != self.key_name]
+        self.files.append({'path': rel_path.replace(os.sep, '/'), 'family': family, 'columns': columns})
+        return path
+
+    def write_columns(self, family, frame, columns, batch_size=200):
+        """
+        Writes a wide DataFrame in batches of `batch_size` columns,
+        so only one batch is converted to Arrow at a time.
+        """
+        for i in range(0, len(columns), batch_size):
+            self.write(family, frame[columns[i:i + batch_size]])
+
+    def close(self):
+        """
+        Writes the manifest. Readers ignore datasets without it.
+        """
+        manifest = {
+            'key': self.key_name,
+            'n_rows': self.n_rows,
+            'files': self.files,
+        }
+        with open(os.path.join(self.directory, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    @property
+    def n_columns(self):
+        return sum(len(f['columns']) for f in self.files)
+
+
+def tile_dir(directory, name):
+    return os.path.join(directory, f"tile={name}")
+
+
+def read_tiles_index(directory):
+    path = os.path.join(directory, TILES_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_tiles_index(directory, names, drop=(), **info):
+    """
+    Adds `names` to the tile list of a tiled Diamond dataset (a partial
+    refresh keeps the tiles it did not recompute) and removes `drop`.
+    """
+    index = read_tiles_index(directory) or {'tiles': []}
+    index.update(info)
+    index['tiles'] = sorted((set(index['tiles']) - set(drop)) | set(names))
+    tmp_path = os.path.join(directory, TILES_NAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, TILES_NAME))
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def diamond_families(directory):
+    """
+    Feature families of a Diamond dataset (union over the tiles when tiled).
+    """
+    index = read_tiles_index(directory)
+    dirs = [directory] if index is None else [tile_dir(directory, name) for name in index['tiles']]
+    return sorted({f['family'] for d in dirs for f in read_manifest(d)['files']})
+
+
+def read_diamond_dataset(directory, columns=None, families=None, tiles=None):
+    """
+    Reassembles a Diamond dataset (or a subset of its columns/families)
+    into a single DataFrame with the key column first. Tiled datasets are
+    concatenated tile by tile (`tiles` selects some of them).
+    """
+    index = read_tiles_index(directory)
+    if index is not None:
+        names = index['tiles'] if tiles is None else [t for t in index['tiles'] if t in tiles]
+        frames = [read_diamond_dataset(tile_dir(directory, name), columns, families) for name in names]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    manifest = read_manifest(directory)
+    key = manifest['key']
+    wanted = None if columns is None else set(columns)
+
+    frames = []
+    for entry in manifest['files']:
+        if families is not None and entry['family'] not in families:
+            continue
+        cols = entry['columns'] if wanted is None else [c for c in entry['columns'] if c in wanted]
+        if not cols:
+            continue
+        df = pd.read_parquet(os.path.join(directory, entry['path']), columns=cols if frames else [key] + cols)
+        frames.append(df)
+
+    if not frames:
+        return pd.DataFrame(columns=[key])
+    return pd.concat(frames, axis=1)
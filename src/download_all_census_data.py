@@ -3,14 +3,17 @@ from bs4 import BeautifulSoup
 import os
 import zipfile
 from urllib.parse import urljoin
+from download_manager import DownloadManager
 
 BASE_URL = "https://ftp.ibge.gov.br/Censos/Censo_Demografico_2022/Agregados_por_Setores_Censitarios/Agregados_por_Setor_csv/"
 DATA_DIR = r"c:\projetos\projeto-censo\data\raw"
+# Downloads simultâneos (o FTP do IBGE limita conexões por IP; não exagere)
+MAX_WORKERS = 4
 
-def list_zip_files(url):
+def list_zip_files(url, session=requests):
     print(f"Fetching file list from {url}...")
     try:
-        response = requests.get(url)
+        response = session.get(url)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, 'html.parser')
         
@@ -25,24 +28,6 @@ def list_zip_files(url):
         print(f"Error fetching file list: {e}")
         return []
 
-def download_file(url, dest_path):
-    if os.path.exists(dest_path):
-        print(f"File already exists: {dest_path}")
-        return True
-    
-    print(f"Downloading {url} to {dest_path}...")
-    try:
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            with open(dest_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192): 
-                    f.write(chunk)
-        print("Download complete.")
-        return True
-    except Exception as e:
-        print(f"Error downloading {url}: {e}")
-        return False
-
 def unzip_file(zip_path, extract_to):
     print(f"Unzipping {zip_path}...")
     try:
@@ -57,14 +42,18 @@ def unzip_file(zip_path, extract_to):
 def main():
     os.makedirs(DATA_DIR, exist_ok=True)
     
-    zip_files = list_zip_files(BASE_URL)
+    # Downloads concorrentes, retomáveis (.part + Range) e verificados (tamanho + CRC)
+    manager = DownloadManager(DATA_DIR, max_workers=MAX_WORKERS)
+    
+    zip_files = list_zip_files(BASE_URL, session=manager.session)
     print(f"Found {len(zip_files)} zip files.")
     
-    for filename in zip_files:
-        file_url = urljoin(BASE_URL, filename)
-        dest_path = os.path.join(DATA_DIR, filename)
-        
-        if download_file(file_url, dest_path):
+    urls = [urljoin(BASE_URL, filename) for filename in zip_files]
+    results = manager.download_all(urls)
+    
+    for url in urls:
+        dest_path = results.get(url)
+        if dest_path:
             unzip_file(dest_path, DATA_DIR)
 
 if __name__ == "__main__":
@@ -1,8 +1,14 @@
 import ftplib
 import os
+import sys
+import zlib
+import struct
 import zipfile
 import time
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from lineage import JsonManifest
 
 # ==============================================================================
 # CONFIGURAÇÃO
@@ -13,57 +19,348 @@ FTP_PATH = '/Cadastro_Nacional_de_Enderecos_para_Fins_Estatisticos/Censo_Demogra
 
 # Define caminhos relativos ao projeto (funciona no Windows e Linux/Databricks)
 # Se o script roda em src/, o projeto está um nível acima
-BASE_DIR = Path(__file__).parent.parent 
+BASE_DIR = Path(__file__).parent.parent
 LOCAL_DIR = BASE_DIR / "data" / "raw" / "cnefe"
+MANIFEST_FILE = LOCAL_DIR / "_cnefe_manifest.json"
 
-def download_and_extract():
-    if not os.path.exists(LOCAL_DIR):
-        os.makedirs(LOCAL_DIR)
-        
-    print(f"🚀 Conectando ao FTP do IBGE: {FTP_HOST}")
-    print(f"📂 Salvando em: {LOCAL_DIR}")
-    ftp = ftplib.FTP(FTP_HOST)
+# UFs a baixar: None = todas as 27. Ex.: ['14_RR'] para o modo de teste.
+# Também pode ser passado na linha de comando: python src/download_cnefe_ftp.py 14_RR 35_SP
+UFS = None
+
+# Conexões FTP simultâneas (uma UF por conexão). O IBGE limita conexões por IP.
+FTP_CONNECTIONS = 3
+MAX_RETRIES = 5
+TIMEOUT = 120
+BLOCK_SIZE = 1024 * 1024
+
+# 'stream': descompacta durante o download (o zip nunca vai para o disco).
+# 'download': baixa o zip inteiro (com REST) e extrai depois (modo antigo).
+MODE = 'stream'
+
+LOCAL_HEADER_SIG = b'PK\x03\x04'
+CENTRAL_DIR_SIG = b'PK\x01\x02'
+DATA_DESCRIPTOR_SIG = b'PK\x07\x08'
+FLAG_DATA_DESCRIPTOR = 0x08
+ZIP64_EXTRA_ID = 0x0001
+
+# ==============================================================================
+# STREAMING UNZIP
+# ==============================================================================
+class StreamUnsupported(Exception):
+    """
+    The zip cannot be extracted while streaming (process_uf falls back to download mode).
+    """
+
+
+class StreamingZipExtractor:
+    """
+    Extracts a zip file from a byte stream using only the local file headers.
+
+    Members are written to `dest_dir/<name>.part` and renamed after their CRC
+    is checked. The decompressor state lives in this object, so when the
+    connection drops the download can continue with REST at `consumed`.
+    Supports stored and deflated members, data descriptors and ZIP64.
+    """
+
+    def __init__(self, dest_dir):
+        self.dest_dir = Path(dest_dir)
+        self.consumed = 0        # bytes do zip já processados (offset para o REST)
+        self.members = []        # membros concluídos
+        self.finished = False
+        self._buffer = b''
+        self._state = 'header'
+        self._member = None
+
+    # ---- helpers -------------------------------------------------------------
+    def _take(self, n):
+        chunk, self._buffer = self._buffer[:n], self._buffer[n:]
+        return chunk
+
+    def _open_member(self, name, flags, method, crc, comp_size, size, zip64):
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise StreamUnsupported(f"compression method {method} not supported in stream mode")
+        if method == zipfile.ZIP_STORED and flags & FLAG_DATA_DESCRIPTOR:
+            raise StreamUnsupported("stored member with data descriptor cannot be streamed")
+
+        is_dir = name.endswith('/')
+        part_path = None
+        handle = None
+        if not is_dir:
+            part_path = self.dest_dir / (os.path.basename(name) + '.part')
+            handle = open(part_path, 'wb')
+        self._member = {
+            'name': name, 'flags': flags, 'method': method, 'crc': crc,
+            'comp_size': comp_size, 'size': size, 'zip64': zip64,
+            'remaining': comp_size, 'running_crc': 0, 'written': 0,
+            'part_path': part_path, 'handle': handle,
+            'decompressor': zlib.decompressobj(-zlib.MAX_WBITS) if method == zipfile.ZIP_DEFLATED else None,
+        }
+
+    def _write(self, data):
+        m = self._member
+        if data and m['handle'] is not None:
+            m['handle'].write(data)
+        m['running_crc'] = zlib.crc32(data, m['running_crc'])
+        m['written'] += len(data)
+
+    def _close_member(self, crc, size):
+        m = self._member
+        if m['handle'] is not None:
+            m['handle'].close()
+        if m['running_crc'] != crc or m['written'] != size:
+            if m['part_path'] is not None:
+                os.remove(m['part_path'])
+            raise zipfile.BadZipFile(f"CRC/size mismatch in member {m['name']}")
+        if m['part_path'] is not None:
+            final_path = self.dest_dir / os.path.basename(m['name'])
+            os.replace(m['part_path'], final_path)
+            self.members.append(final_path.name)
+        self._member = None
+
+    def abort(self):
+        if self._member is not None and self._member['handle'] is not None:
+            self._member['handle'].close()
+            os.remove(self._member['part_path'])
+            self._member = None
+
+    # ---- state machine -------------------------------------------------------
+    def feed(self, data):
+        self.consumed += len(data)
+        self._buffer += data
+        while not self.finished:
+            if not self._step():
+                break
+
+    def _step(self):
+        """
+        Processes as much of the buffer as possible. Returns False when more bytes are needed.
+        """
+        if self._state == 'header':
+            if len(self._buffer) < 4:
+                return False
+            sig = self._buffer[:4]
+            if sig == CENTRAL_DIR_SIG:
+                # Chegou no diretório central: todos os membros já foram lidos
+                self.finished = True
+                return False
+            if sig != LOCAL_HEADER_SIG:
+                raise zipfile.BadZipFile(f"unexpected signature {sig!r} at offset {self.consumed - len(self._buffer)}")
+            if len(self._buffer) < 30:
+                return False
+            (_, _, flags, method, _, _, crc, comp_size, size,
+             name_len, extra_len) = struct.unpack('<4sHHHHHIIIHH', self._buffer[:30])
+            if len(self._buffer) < 30 + name_len + extra_len:
+                return False
+            self._take(30)
+            name = self._take(name_len).decode('utf-8' if flags & 0x800 else 'cp437')
+            extra = self._take(extra_len)
+
+            zip64 = False
+            pos = 0
+            while pos + 4 <= len(extra):
+                header_id, data_size = struct.unpack('<HH', extra[pos:pos + 4])
+                if header_id == ZIP64_EXTRA_ID:
+                    zip64 = True
+                    fields = extra[pos + 4:pos + 4 + data_size]
+                    if size == 0xFFFFFFFF and len(fields) >= 8:
+                        size = struct.unpack('<Q', fields[:8])[0]
+                        fields = fields[8:]
+                    if comp_size == 0xFFFFFFFF and len(fields) >= 8:
+                        comp_size = struct.unpack('<Q', fields[:8])[0]
+                pos += 4 + data_size
+
+            self._open_member(name, flags, method, crc, comp_size, size, zip64)
+            self._state = 'data'
+            return True
+
+        if self._state == 'data':
+            m = self._member
+            if m['decompressor'] is None:
+                # STORED: tamanho conhecido
+                chunk = self._take(m['remaining'])
+                m['remaining'] -= len(chunk)
+                self._write(chunk)
+                if m['remaining'] > 0:
+                    return False
+            else:
+                d = m['decompressor']
+                chunk, self._buffer = self._buffer, b''
+                self._write(d.decompress(chunk))
+                if not d.eof:
+                    return False
+                self._write(d.flush())
+                # Bytes depois do fim do deflate voltam para o buffer
+                self._buffer = d.unused_data + self._buffer
+
+            if m['flags'] & FLAG_DATA_DESCRIPTOR:
+                self._state = 'descriptor'
+            else:
+                self._close_member(m['crc'], m['size'])
+                self._state = 'header'
+            return True
+
+        if self._state == 'descriptor':
+            m = self._member
+            sizes_len = 16 if m['zip64'] else 8
+            has_sig = self._buffer[:4] == DATA_DESCRIPTOR_SIG
+            need = (4 if has_sig else 0) + 4 + sizes_len
+            if len(self._buffer) < need:
+                return False
+            if has_sig:
+                self._take(4)
+            crc = struct.unpack('<I', self._take(4))[0]
+            fmt = '<QQ' if m['zip64'] else '<II'
+            _, size = struct.unpack(fmt, self._take(sizes_len))
+            self._close_member(crc, size)
+            self._state = 'header'
+            return True
+
+        return False
+
+# ==============================================================================
+# FTP
+# ==============================================================================
+def connect():
+    ftp = ftplib.FTP(FTP_HOST, timeout=TIMEOUT)
     ftp.login()
     ftp.cwd(FTP_PATH)
-    
+    ftp.voidcmd('TYPE I')
+    return ftp
+
+def list_uf_files(ufs=None):
+    ftp = connect()
     files = ftp.nlst()
+    sizes = {}
     # Filtra apenas zips
     files = [f for f in files if f.endswith('.zip')]
-    
-    # MODO DE TESTE: Baixar apenas Roraima (RR) para validar layout
-    files = [f for f in files if '14_RR' in f]
-    
-    print(f"📋 Encontrados {len(files)} arquivos para baixar.")
-    
-    for filename in files:
-        local_zip_path = os.path.join(LOCAL_DIR, filename)
-        
-        # Verifica se já foi baixado/extraído (lógica simples)
-        # Se o CSV extraído já existe, pula. (O nome do CSV dentro do zip geralmente é parecido)
-        # Mas como não sabemos o nome exato do CSV dentro, verificamos o zip.
-        
-        print(f"⬇️ Baixando {filename}...")
-        start = time.time()
-        with open(local_zip_path, 'wb') as f:
-            ftp.retrbinary('RETR ' + filename, f.write)
-        end = time.time()
-        print(f"   ✅ Download concluído em {end-start:.2f}s")
-        
-        print(f"📦 Extraindo {filename}...")
+    if ufs:
+        files = [f for f in files if any(uf in f for uf in ufs)]
+    # NLST deixa a sessão em ASCII; SIZE só é confiável em modo binário
+    ftp.voidcmd('TYPE I')
+    for f in files:
         try:
-            with zipfile.ZipFile(local_zip_path, 'r') as zip_ref:
-                zip_ref.extractall(LOCAL_DIR)
-            print(f"   ✅ Extração concluída.")
-            
-            # Opcional: Deletar o zip para economizar espaço
-            os.remove(local_zip_path)
-            print(f"   🗑️ Zip removido.")
-            
-        except zipfile.BadZipFile:
-            print(f"   ❌ Erro: Arquivo zip corrompido.")
-
+            sizes[f] = ftp.size(f)
+        except ftplib.error_perm:
+            sizes[f] = None
     ftp.quit()
-    print("🎉 Todos os arquivos foram baixados e extraídos!")
+    return files, sizes
+
+def retrieve(filename, callback, offset_fn, on_retry=None):
+    """
+    RETR with automatic reconnect + REST at offset_fn() after a dropped connection.
+    """
+    last_error = None
+    for attempt in range(1, MAX_RETRIES + 1):
+        ftp = None
+        try:
+            ftp = connect()
+            offset = offset_fn()
+            ftp.retrbinary('RETR ' + filename, callback, blocksize=BLOCK_SIZE, rest=offset or None)
+            ftp.quit()
+            return
+        except (ftplib.error_temp, ftplib.error_reply, EOFError, OSError) as e:
+            last_error = e
+            print(f"   ⚠️ {filename}: conexão interrompida ({e}); tentativa {attempt}/{MAX_RETRIES}, retomando...")
+            if on_retry is not None:
+                on_retry()
+            if ftp is not None:
+                try:
+                    ftp.close()
+                except Exception:
+                    pass
+            time.sleep(min(2 ** attempt, 30))
+    raise RuntimeError(f"{filename}: falhou após {MAX_RETRIES} tentativas ({last_error})")
+
+def fetch_streaming(filename):
+    extractor = StreamingZipExtractor(LOCAL_DIR)
+    try:
+        retrieve(filename, extractor.feed, lambda: extractor.consumed)
+    except Exception:
+        extractor.abort()
+        raise
+    if not extractor.finished:
+        extractor.abort()
+        raise zipfile.BadZipFile(f"{filename}: stream ended before the central directory")
+    return extractor.members
+
+def fetch_download(filename, remote_size):
+    local_zip_path = os.path.join(LOCAL_DIR, filename)
+    part_path = local_zip_path + '.part'
+
+    with open(part_path, 'ab') as f:
+        retrieve(filename, f.write, lambda: (f.flush(), os.path.getsize(part_path))[1])
+    if remote_size is not None and os.path.getsize(part_path) != remote_size:
+        raise zipfile.BadZipFile(f"{filename}: tamanho {os.path.getsize(part_path)} != {remote_size}")
+    os.replace(part_path, local_zip_path)
+
+    with zipfile.ZipFile(local_zip_path, 'r') as zip_ref:
+        members = [n for n in zip_ref.namelist() if not n.endswith('/')]
+        zip_ref.extractall(LOCAL_DIR)
+    # Deletar o zip para economizar espaço
+    os.remove(local_zip_path)
+    return members
+
+# ==============================================================================
+# MANIFESTO
+# ==============================================================================
+def is_done(manifest, filename, remote_size):
+    entry = manifest.get(filename)
+    if entry is None or entry.get('zip_size') != remote_size:
+        return False
+    return all((LOCAL_DIR / m).exists() for m in entry['members'])
+
+# ==============================================================================
+# EXECUÇÃO
+# ==============================================================================
+def process_uf(filename, remote_size, manifest):
+    if is_done(manifest, filename, remote_size):
+        print(f"⏭️ {filename}: já extraído.")
+        return filename
+
+    print(f"⬇️ Baixando {filename} ({MODE})...")
+    start = time.time()
+    mode = MODE
+    if mode == 'stream':
+        try:
+            members = fetch_streaming(filename)
+        except StreamUnsupported as e:
+            print(f"   ⚠️ {filename}: {e}; usando modo download.")
+            mode = 'download'
+    if mode == 'download':
+        members = fetch_download(filename, remote_size)
+
+    elapsed = time.time() - start
+    mb = (remote_size or 0) / (1024 * 1024)
+    print(f"   ✅ {filename}: {len(members)} arquivo(s) em {elapsed:.1f}s ({mb / max(elapsed, 1e-9):.1f} MB/s)")
+    manifest.set(filename, {'zip_size': remote_size, 'members': members, 'finished_at': time.time()})
+    return filename
+
+def download_and_extract(ufs=UFS):
+    if not os.path.exists(LOCAL_DIR):
+        os.makedirs(LOCAL_DIR)
+
+    print(f"🚀 Conectando ao FTP do IBGE: {FTP_HOST}")
+    print(f"📂 Salvando em: {LOCAL_DIR}")
+    files, sizes = list_uf_files(ufs)
+
+    print(f"📋 Encontrados {len(files)} arquivos para baixar ({FTP_CONNECTIONS} conexões).")
+    manifest = JsonManifest(MANIFEST_FILE)
+    start = time.time()
+    failed = []
+    with ThreadPoolExecutor(max_workers=FTP_CONNECTIONS) as executor:
+        futures = {executor.submit(process_uf, f, sizes[f], manifest): f for f in files}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"   ❌ {futures[future]}: {e}")
+                failed.append(futures[future])
+
+    print(f"⏱️ Tempo total: {time.time() - start:.1f}s")
+    if failed:
+        print(f"❌ Falharam ({len(failed)}): {failed}. Rode novamente para retomar.")
+    else:
+        print("🎉 Todos os arquivos foram baixados e extraídos!")
 
 if __name__ == "__main__":
-    download_and_extract()
+    download_and_extract(sys.argv[1:] or UFS)
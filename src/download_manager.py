@@ -0,0 +1,213 @@
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from lineage import JsonManifest
+
+# ==============================================================================
+# DOWNLOAD MANAGER (HTTP, concorrente e retomável)
+# ==============================================================================
+# - Pool limitado de threads compartilhando uma requests.Session (keep-alive).
+# - Download para <arquivo>.part; se a conexão cair, a próxima tentativa
+#   continua de onde parou com "Range: bytes=<tamanho>-".
+# - Ao final confere o tamanho contra o Content-Length e, para .zip, o CRC de
+#   todos os membros contra o diretório central (ZipFile.testzip).
+# - Só então renomeia para o nome final e registra no manifesto local
+#   (_download_manifest.json). Um arquivo presente no disco mas ausente do
+#   manifesto é verificado antes de ser considerado baixado.
+
+MANIFEST_NAME = '_download_manifest.json'
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+MAX_WORKERS = 4
+MAX_RETRIES = 3
+TIMEOUT = 60
+
+
+class DownloadError(Exception):
+    pass
+
+
+def filename_from_url(url):
+    return unquote(os.path.basename(urlparse(url).path))
+
+
+def verify_zip(path):
+    """
+    Checks every member's CRC against the zip central directory.
+    Returns None if OK, or an error message.
+    """
+    try:
+        with zipfile.ZipFile(path) as zf:
+            bad = zf.testzip()
+            if bad is not None:
+                return f"CRC mismatch in member {bad}"
+    except zipfile.BadZipFile as e:
+        return f"bad zip file: {e}"
+    return None
+
+
+class DownloadManager:
+    """
+    Downloads files into `dest_dir` with bounded concurrency, resume and verification.
+    """
+
+    def __init__(self, dest_dir, max_workers=MAX_WORKERS, chunk_size=CHUNK_SIZE,
+                 max_retries=MAX_RETRIES, timeout=TIMEOUT, session=None):
+        self.dest_dir = dest_dir
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        os.makedirs(dest_dir, exist_ok=True)
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+        self.manifest = JsonManifest(os.path.join(dest_dir, MANIFEST_NAME))
+
+    # --------------------------------------------------------------------------
+    # DOWNLOAD
+    # --------------------------------------------------------------------------
+    def _remote_info(self, url):
+        r = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+        r.raise_for_status()
+        size = r.headers.get('Content-Length')
+        return {
+            'size': int(size) if size is not None else None,
+            'accept_ranges': r.headers.get('Accept-Ranges', '').lower() == 'bytes',
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+        }
+
+    def _verify(self, path, expected_size):
+        size = os.path.getsize(path)
+        if expected_size is not None and size != expected_size:
+            return f"size {size} != expected {expected_size}"
+        if path.lower().endswith('.zip') or path.lower().endswith('.zip.part'):
+            return verify_zip(path)
+        return None
+
+    def _is_complete(self, filename, dest_path, remote):
+        if not os.path.exists(dest_path):
+            return False
+        entry = self.manifest.get(filename)
+        if entry is not None:
+            same_size = remote['size'] is None or entry.get('size') == remote['size']
+            same_version = remote['etag'] is None or entry.get('etag') == remote['etag']
+            return same_size and same_version and os.path.getsize(dest_path) == entry.get('size')
+
+        # Arquivo antigo (baixado antes do manifesto): verifica antes de confiar
+        error = self._verify(dest_path, remote['size'])
+        if error is None:
+            self.manifest.set(filename, {**remote, 'size': os.path.getsize(dest_path), 'verified_at': time.time()})
+            return True
+        print(f"   ⚠️ {filename}: existing file failed verification ({error}), downloading again.")
+        os.remove(dest_path)
+        return False
+
+    def _fetch(self, url, part_path, remote):
+        """
+        Streams url into part_path, resuming from its current size when possible.
+        """
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if remote['size'] is not None and offset > remote['size']:
+            offset = 0
+        if offset and offset == remote['size']:
+            # .part já completo (execução interrompida no testzip ou antes do
+            # rename): não há o que baixar, só verificar
+            return offset
+        headers = {}
+        if offset and remote['accept_ranges']:
+            headers['Range'] = f"bytes={offset}-"
+            if remote['etag']:
+                headers['If-Range'] = remote['etag']
+        else:
+            offset = 0
+
+        with self.session.get(url, stream=True, headers=headers, timeout=self.timeout) as r:
+            if offset and r.status_code == 416:
+                # Range além do fim: o .part já tem o arquivo inteiro, verifica
+                return offset
+            r.raise_for_status()
+            if offset and r.status_code != 206:
+                # Servidor ignorou o Range (ou arquivo mudou): recomeça do zero
+                offset = 0
+            mode = 'ab' if offset else 'wb'
+            with open(part_path, mode) as f:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        f.write(chunk)
+        return offset
+
+    def download(self, url):
+        """
+        Downloads one URL. Returns the final path; raises DownloadError on failure.
+        """
+        filename = filename_from_url(url)
+        dest_path = os.path.join(self.dest_dir, filename)
+        part_path = dest_path + '.part'
+
+        remote = None
+        last_error = None
+        for attempt in range(1, self.max_retries + 1):
+            start = time.time()
+            try:
+                # HEAD dentro das tentativas: um erro transitório não aborta o arquivo
+                if remote is None:
+                    remote = self._remote_info(url)
+                    if self._is_complete(filename, dest_path, remote):
+                        print(f"   ✅ {filename}: already downloaded and verified.")
+                        return dest_path
+                offset = self._fetch(url, part_path, remote)
+            except requests.RequestException as e:
+                last_error = f"{type(e).__name__}: {e}"
+                print(f"   ⚠️ {filename}: attempt {attempt} interrupted ({last_error}), will resume.")
+                time.sleep(min(2 ** attempt, 30))
+                continue
+
+            error = self._verify(part_path, remote['size'])
+            if error is not None:
+                last_error = error
+                print(f"   ⚠️ {filename}: attempt {attempt} failed verification ({error}).")
+                # Arquivo completo mas inválido: não adianta retomar
+                if remote['size'] is None or os.path.getsize(part_path) >= remote['size']:
+                    os.remove(part_path)
+                continue
+
+            os.replace(part_path, dest_path)
+            size = os.path.getsize(dest_path)
+            elapsed = max(time.time() - start, 1e-9)
+            mb = (size - offset) / (1024 * 1024)
+            self.manifest.set(filename, {**remote, 'size': size, 'url': url, 'verified_at': time.time()})
+            print(f"   ✅ {filename}: {mb:.1f} MB in {elapsed:.1f}s ({mb / max(elapsed, 1e-9):.1f} MB/s)")
+            return dest_path
+
+        raise DownloadError(f"{filename}: failed after {self.max_retries} attempts ({last_error})")
+
+    def download_all(self, urls):
+        """
+        Downloads all URLs concurrently. Returns {url: path or None}.
+        """
+        results = {}
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.download, url): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    results[url] = future.result()
+                except Exception as e:
+                    print(f"   ❌ {e}")
+                    results[url] = None
+        ok = sum(1 for p in results.values() if p)
+        print(f"Downloaded {ok}/{len(urls)} files in {time.time() - start:.1f}s.")
+        return results
@@ -0,0 +1,521 @@
+import os
+import json
+import hashlib
+from fnmatch import fnmatchcase
+from silver_schema import SchemaResolver, CODE_SUFFIX
+from lineage import LineageManifest
+from sector_key import SECTOR_KEY_VERSION
+
+# ==============================================================================
+# REGISTRO DE FEATURES DA CAMADA GOLD (Expert)
+# ==============================================================================
+# Cada feature é declarada UMA vez: família, tabela de origem de cada termo,
+# numerador/denominador e política para denominador zero/nulo. O registro é
+# compilado em UMA query DuckDB:
+#   - cada Parquet do silver é lido uma única vez, só com as colunas que
+#     alguma feature usa (projeção explícita no read_parquet);
+#   - só entram no JOIN as tabelas usadas pelas features pedidas;
+#   - termos ausentes (arquivo ou código) viram NULL, e somas usam COALESCE(x, 0),
+#     como nas views antigas que trocavam a coluna que faltava por 0.
+#
+# Termos: um código do IBGE ('V01226', resolvido pelo sufixo _vXXXXX via
+# SchemaResolver) ou o nome exato de uma coluna derivada do massivo ('pop_0_19').
+
+MASSIVE_FILE = 'censo_2022_agregado_massivo.parquet'
+OBITOS_FILE = 'Agregados_por_setores_obitos_BR.parquet'
+DEMOG_FILE = 'Agregados_por_setores_demografia_BR.parquet'
+PARENTESCO_FILE = 'Agregados_por_setores_parentesco_BR.parquet'
+DOM1_FILE = 'Agregados_por_setores_caracteristicas_domicilio1_BR.parquet'
+ALFAB_FILE = 'Agregados_por_setores_alfabetizacao_BR.parquet'
+DOM3_FILE = 'Agregados_por_setores_caracteristicas_domicilio3_BR_20250417.parquet'
+
+KEY = 'CD_SETOR'
+
+# alias SQL e arquivo de cada tabela. A chave de cada uma (CD_SETOR, 'setor'
+# no dom3, em texto ou float) é achada no schema e lida como BIGINT
+# (SchemaResolver.key / src/sector_key.py): todos os JOINs são entre inteiros.
+SOURCES = {
+    'massive': {'alias': 'm', 'file': MASSIVE_FILE},
+    'obitos': {'alias': 'o', 'file': OBITOS_FILE},
+    'demografia': {'alias': 'dem', 'file': DEMOG_FILE},
+    'parentesco': {'alias': 'p', 'file': PARENTESCO_FILE},
+    'dom1': {'alias': 'd1', 'file': DOM1_FILE},
+    'alfabetizacao': {'alias': 'a', 'file': ALFAB_FILE},
+    'dom3': {'alias': 'd3', 'file': DOM3_FILE},
+}
+BASE_SOURCE = 'massive'
+
+# Políticas para denominador zero ou nulo
+NULL_IF_ZERO = 'null'   # x / NULLIF(den, 0)
+ZERO_IF_ZERO = 'zero'   # CASE WHEN den > 0 THEN x / den ELSE 0 END
+
+
+def code_range(start, end, prefix='V00'):
+    return [f'{prefix}{i}' for i in range(start, end + 1)]
+
+
+def total(name, family, source, terms, legacy_name=None):
+    """
+    Sum of terms (nulls count as 0).
+    """
+    return {'name': name, 'family': family, 'kind': 'total', 'terms': {source: list(terms)},
+            'numerator': [(source, t) for t in terms], 'legacy_name': legacy_name}
+
+
+def ratio(name, family, numerator, denominator, null_policy=ZERO_IF_ZERO, scale=1,
+          max_value=None, legacy_name=None):
+    """
+    sum(numerator) / sum(denominator) * scale. numerator/denominator are
+    lists of (source, term).
+    """
+    terms = {}
+    for source, term in list(numerator) + list(denominator):
+        terms.setdefault(source, []).append(term)
+    return {'name': name, 'family': family, 'kind': 'ratio', 'terms': terms,
+            'numerator': list(numerator), 'denominator': list(denominator),
+            'null_policy': null_policy, 'scale': scale, 'max_value': max_value,
+            'legacy_name': legacy_name}
+
+
+def expression(name, family, inputs, sql, legacy_name=None):
+    """
+    Free SQL over named inputs ({placeholder: (source, term)}), for indices
+    that are not a ratio. Missing inputs are NULL.
+    """
+    terms = {}
+    for source, term in inputs.values():
+        terms.setdefault(source, []).append(term)
+    return {'name': name, 'family': family, 'kind': 'expression', 'terms': terms,
+            'inputs': dict(inputs), 'sql': sql, 'legacy_name': legacy_name}
+
+
+def _m(*terms):
+    return [('massive', t) for t in terms]
+
+
+def _t(source, terms):
+    return [(source, t) for t in terms]
+
+
+# Totais do massivo pelo nome exato da coluna derivada, não pelo código: o
+# rename do notebook (v0 -> v) também gera pct_dom1_*_v0001 ... _v0089, que
+# compartilham o sufixo de total_de_pessoas_v0001 / ..._v0003.
+TOTAL_PESSOAS = 'total_de_pessoas_v0001'
+TOTAL_DOMICILIOS = 'total_de_domicilios_particulares_dppo_dppv_dppuo_dpio_v0003'
+
+OBITOS_TOTAL = ['V01226', 'V01227']
+OBITOS_JOVENS_M = ['V01231', 'V01232', 'V01233']
+POP_JOVENS_M = ['V01012', 'V01013', 'V01014']
+
+FEATURES = [
+    # --- DEMOGRAFIA ---
+    ratio('expert_demog_dependency_ratio', 'demografia',
+          _m('pop_0_19', 'pop_70_plus'), _m('pop_20_69'),
+          null_policy=NULL_IF_ZERO, legacy_name='razao_dependencia'),
+    ratio('expert_demog_aging_index', 'demografia',
+          _m('pop_70_plus'), _m('pop_0_19'),
+          null_policy=NULL_IF_ZERO, legacy_name='indice_envelhecimento'),
+
+    # --- DIVERSIDADE RACIAL (Simpson) ---
+    expression('expert_social_racial_diversity_index', 'diversidade',
+               {'b': ('massive', 'pct_branca'), 'p': ('massive', 'pct_preta'), 'pd': ('massive', 'pct_parda')},
+               """CASE WHEN {b} IS NOT NULL THEN
+            1 - (POWER({b}, 2) + POWER({p}, 2) + POWER({pd}, 2)
+                 + POWER(GREATEST(0, 1 - ({b} + {p} + {pd})), 2))
+        ELSE NULL END""",
+               legacy_name='indice_diversidade_racial'),
+
+    # --- POTENCIAL DE CONSUMO ---
+    expression('expert_econ_consumption_potential_index', 'consumo',
+               {'r': ('massive', 'renda_per_capita_sm'), 'd': ('massive', 'densidade_demografica')},
+               """CASE WHEN {r} IS NOT NULL AND {d} IS NOT NULL THEN {r} * LN({d} + 1) ELSE NULL END""",
+               legacy_name='indice_potencial_consumo'),
+
+    # --- MORTALIDADE ---
+    total('raw_health_total_deaths', 'mortalidade', 'obitos', OBITOS_TOTAL, legacy_name='total_obitos'),
+    ratio('expert_health_mortality_rate_1000', 'mortalidade',
+          _t('obitos', OBITOS_TOTAL), _m(TOTAL_PESSOAS), scale=1000, legacy_name='taxa_mortalidade_1000'),
+    total('raw_health_youth_male_deaths', 'mortalidade', 'obitos', OBITOS_JOVENS_M),
+    total('raw_demog_youth_male_pop', 'mortalidade', 'demografia', POP_JOVENS_M),
+    ratio('expert_health_youth_mortality_rate', 'mortalidade',
+          _t('obitos', OBITOS_JOVENS_M), _t('demografia', POP_JOVENS_M), scale=1000),
+
+    # --- ESTRUTURA FAMILIAR ---
+    # V01042: Responsável | V01043/V01044: Cônjuges | V01046: Filho só do responsável
+    # V01049: Pais/Sogros | V01051: Netos
+    ratio('expert_family_conjugality_rate', 'familia',
+          _t('parentesco', ['V01043', 'V01044']), _t('parentesco', ['V01042']),
+          legacy_name='taxa_conjugalidade'),
+    ratio('expert_family_single_parent_proxy', 'familia',
+          _t('parentesco', ['V01046']), _t('parentesco', ['V01042']),
+          legacy_name='taxa_monoparental_proxy'),
+    ratio('expert_family_multigenerational_rate', 'familia',
+          _t('parentesco', ['V01049', 'V01051']), _t('parentesco', ['V01042']),
+          legacy_name='taxa_multigeracional'),
+
+    # --- DOMICÍLIOS UNIPESSOAIS ---
+    ratio('expert_family_one_person_household_pct', 'domicilios',
+          _t('dom1', ['V00017']), _m(TOTAL_DOMICILIOS), legacy_name='pct_domicilios_unipessoais'),
+
+    # --- EDUCAÇÃO (ALFABETIZAÇÃO 15+) ---
+    # Total 15+ (V00644 a V00656), alfabetizados 15+ (V00748 a V00760)
+    ratio('expert_edu_literacy_rate_15_plus', 'educacao',
+          _t('alfabetizacao', code_range(748, 760)), _t('alfabetizacao', code_range(644, 656)),
+          null_policy=NULL_IF_ZERO, max_value=1.0),
+
+    # --- VULNERABILIDADE INFANTIL (SANEAMENTO) ---
+    # Água 516-523, inadequada 518-523 (Poço raso, Fonte, Carro-pipa, Chuva, Rios, Outra)
+    ratio('expert_child_vuln_water_inadequate_pct', 'vulnerabilidade_infantil',
+          _t('dom3', code_range(518, 523)), _t('dom3', code_range(516, 523))),
+    # Esgoto 588-595, inadequado 591-595 (Fossa rudimentar, Vala, Rio, Outra, Não tem)
+    ratio('expert_child_vuln_sewage_inadequate_pct', 'vulnerabilidade_infantil',
+          _t('dom3', code_range(591, 595)), _t('dom3', code_range(588, 595))),
+    # Lixo 618-623, inadequado 620-623 (Queimado, Enterrado, Baldio, Outro)
+    ratio('expert_child_vuln_garbage_inadequate_pct', 'vulnerabilidade_infantil',
+          _t('dom3', code_range(620, 623)), _t('dom3', code_range(618, 623))),
+]
+
+FEATURES_BY_NAME = {f['name']: f for f in FEATURES}
+
+
+def select_features(names=None, families=None):
+    features = FEATURES
+    if names is not None:
+        unknown = set(names) - set(FEATURES_BY_NAME)
+        if unknown:
+            raise KeyError(f"unknown features: {sorted(unknown)}")
+        features = [f for f in features if f['name'] in names]
+    if families is not None:
+        features = [f for f in features if f['family'] in families]
+    return features
+
+
+def sources_of(features):
+    """
+    {source: set of terms} referenced by the features.
+    """
+    used = {}
+    for f in features:
+        for source, terms in f['terms'].items():
+            used.setdefault(source, set()).update(terms)
+    return used
+
+
+def is_code(term):
+    return CODE_SUFFIX.fullmatch(term.lower()) is not None
+
+
+def sql_path(path):
+    return str(path).replace("\\", "/").replace("'", "''")
+
+
+def keyed_scan(resolver, filename, columns='*'):
+    """
+    Subquery over one silver file with its sector key as BIGINT CD_SETOR
+    first, then `columns` (list of names or '*').
+    """
+    key_column, key_sql = resolver.key(filename)
+    if columns == '*':
+        rest = [f'* EXCLUDE ("{key_column}")']
+    else:
+        rest = [f'"{c}"' for c in columns if c not in (key_column, KEY)]
+    select = ', '.join([f"{key_sql} AS {KEY}"] + rest)
+    return f"(SELECT {select} FROM read_parquet('{sql_path(resolver.path(filename))}'))"
+
+
+class FeatureCompiler:
+    """
+    Resolves the terms of a set of features against the silver schemas and
+    compiles them into a single projection-pruned DuckDB SELECT.
+    """
+
+    def __init__(self, data_dir, features=None, resolver=None):
+        self.data_dir = data_dir
+        self.features = FEATURES if features is None else features
+        self.resolver = resolver or SchemaResolver(data_dir)
+        self.used = sources_of(self.features)
+        self.used.setdefault(BASE_SOURCE, set())
+        self.columns = self._resolve()
+
+    def _resolve(self):
+        """
+        {source: {term: silver column or None}}, printing everything that is missing.
+        """
+        columns = {}
+        missing = []
+        for source, terms in self.used.items():
+            filename = SOURCES[source]['file']
+            available = set(self.resolver.columns(filename))
+            columns[source] = {}
+            for term in sorted(terms):
+                col = self.resolver.resolve(filename, term) if is_code(term) else (term if term in available else None)
+                columns[source][term] = col
+                if col is None:
+                    missing.append((source, term))
+
+        n_terms = sum(len(t) for t in self.used.values())
+        print(f"Feature registry: {len(self.features)} features, "
+              f"{n_terms - len(missing)}/{n_terms} terms resolved in {len(self.used)} tables.")
+        for source in sorted({s for s, _ in missing}):
+            filename = SOURCES[source]['file']
+            reason = "file not found" if not self.resolver.exists(filename) else "not in schema"
+            terms = [t for s, t in missing if s == source]
+            print(f"  ⚠️ {source} [{filename}] ({reason}): {', '.join(terms)}")
+        return columns
+
+    # --------------------------------------------------------------------------
+    # SQL
+    # --------------------------------------------------------------------------
+    def ref(self, source, term):
+        col = self.columns[source].get(term)
+        if col is None:
+            return 'NULL'
+        return f'{SOURCES[source]["alias"]}."{col}"'
+
+    def _sum(self, terms):
+        if not terms:
+            return '0'
+        return ' + '.join(f'COALESCE({self.ref(s, t)}, 0)' for s, t in terms)
+
+    def feature_sql(self, feature):
+        if feature['kind'] == 'total':
+            return f"({self._sum(feature['numerator'])})"
+
+        if feature['kind'] == 'expression':
+            refs = {k: self.ref(s, t) for k, (s, t) in feature['inputs'].items()}
+            return f"({feature['sql'].format(**refs)})"
+
+        num = f"({self._sum(feature['numerator'])})"
+        den = f"({self._sum(feature['denominator'])})"
+        value = f"{num} / {den}"
+        if feature['scale'] != 1:
+            value = f"({value}) * {feature['scale']}"
+        if feature['max_value'] is not None:
+            value = f"LEAST({feature['max_value']}, {value})"
+        if feature['null_policy'] == NULL_IF_ZERO:
+            return f"CASE WHEN {den} <> 0 THEN {value} ELSE NULL END"
+        return f"CASE WHEN {den} > 0 THEN {value} ELSE 0 END"
+
+    def source_scan(self, source):
+        """
+        Subquery that reads only the key and the referenced columns of one silver file.
+        """
+        cols = sorted({c for c in self.columns[source].values() if c is not None})
+        return keyed_scan(self.resolver, SOURCES[source]['file'], cols)
+
+    def joined_sources(self):
+        # Tabelas sem nenhuma coluna resolvida não entram no JOIN
+        return [s for s in self.used
+                if s != BASE_SOURCE and any(c is not None for c in self.columns[s].values())]
+
+    def compile(self, base_columns='*', names='canonical'):
+        """
+        SELECT with the base columns of the massive table (list of names or '*')
+        followed by one column per feature. names='legacy' uses each feature's
+        legacy_name when it has one.
+        """
+        base = SOURCES[BASE_SOURCE]
+        base_alias = base['alias']
+
+        if base_columns == '*':
+            base_scan = keyed_scan(self.resolver, base['file'])
+            select = [f"{base_alias}.*"]
+        else:
+            output = [KEY] + [c for c in base_columns if c != KEY]
+            # Colunas do massivo usadas pelas features também precisam ser lidas
+            needed = output + sorted({c for c in self.columns[BASE_SOURCE].values() if c is not None} - set(output))
+            base_scan = keyed_scan(self.resolver, base['file'], needed)
+            select = [f'{base_alias}."{c}"' for c in output]
+
+        for f in self.features:
+            alias = f['legacy_name'] if names == 'legacy' and f.get('legacy_name') else f['name']
+            select.append(f"{self.feature_sql(f)} AS {alias}")
+
+        joins = [f"FROM {base_scan} {base_alias}"]
+        for source in self.joined_sources():
+            alias = SOURCES[source]['alias']
+            joins.append(f"LEFT JOIN {self.source_scan(source)} {alias} ON {base_alias}.{KEY} = {alias}.{KEY}")
+
+        return "SELECT\n    " + ",\n    ".join(select) + "\n" + "\n".join(joins)
+
+
+# ==============================================================================
+# PERFIS DE SAÍDA (projeção do gold)
+# ==============================================================================
+# O massivo tem 2.000+ colunas, mas a maioria dos consumidores usa ~50. Um
+# perfil define quais colunas do massivo entram (nomes exatos ou padrões
+# glob, ex.: 'calc_*') e quais features do registro são calculadas; só essas
+# colunas são lidas de cada Parquet. 'full' mantém o comportamento antigo (m.*).
+PROFILES = {
+    'full': {
+        'base_columns': '*',
+        'features': None,
+    },
+    'credit': {
+        'base_columns': [
+            'calc_*',
+            'massa_salarial_total',
+            'renda_per_capita_sm',
+            'rendimento_medio_responsavel',
+            'rendimento_medio_responsavel_sm',
+            'densidade_demografica',
+            'pop_0_19', 'pop_20_69', 'pop_70_plus',
+            'pct_branca', 'pct_preta', 'pct_parda',
+            TOTAL_PESSOAS,
+            TOTAL_DOMICILIOS,
+        ],
+        'features': None,
+    },
+}
+
+# Escrita do gold: ZSTD + row groups menores, ordenado por CD_SETOR, para que
+# o min/max de CD_SETOR de cada row group permita pular UFs/municípios inteiros
+GOLD_COMPRESSION = 'ZSTD'
+GOLD_ROW_GROUP_SIZE = 50_000
+
+
+def expand_columns(patterns, available):
+    """
+    Exact names and glob patterns -> existing columns, in order, without duplicates.
+    Returns (columns, patterns that matched nothing).
+    """
+    columns = []
+    unmatched = []
+    for pattern in patterns:
+        if any(ch in pattern for ch in '*?['):
+            matches = [c for c in available if fnmatchcase(c, pattern)]
+        else:
+            matches = [pattern] if pattern in available else []
+        if not matches:
+            unmatched.append(pattern)
+        columns.extend(c for c in matches if c not in columns)
+    return columns, unmatched
+
+
+def _expand_profile(resolver, base):
+    """
+    Base columns of a profile (names/patterns or '*') -> existing columns of
+    the massive table, CD_SETOR first, reporting patterns that matched nothing.
+    """
+    if base == '*':
+        return base
+    available = resolver.columns(SOURCES[BASE_SOURCE]['file'])
+    columns, unmatched = expand_columns([KEY] + list(base), available)
+    if unmatched:
+        print(f"  ⚠️ Base columns not found in {SOURCES[BASE_SOURCE]['file']}: {', '.join(unmatched)}")
+    return columns
+
+
+# ==============================================================================
+# BUILD INCREMENTAL (uma saída por família + linhagem)
+# ==============================================================================
+# Cada família de features é gravada em <gold>/_families/<familia>.parquet
+# (CD_SETOR + features) com a impressão digital dos arquivos do silver que ela
+# lê (massivo + tabelas temáticas) e da própria definição. Se só o Parquet de
+# óbitos mudou, só 'mortalidade' é recalculada; o gold final é remontado a
+# partir das famílias (JOIN por CD_SETOR), sem reler as tabelas temáticas.
+FAMILY_DIR_NAME = '_families'
+
+
+def features_by_family(features):
+    families = {}
+    for f in features:
+        families.setdefault(f['family'], []).append(f)
+    return families
+
+
+def definition_hash(features):
+    text = json.dumps(features, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def family_inputs(data_dir, features):
+    """
+    {source: silver path} read by a set of features (always includes the massive table).
+    """
+    used = set(sources_of(features)) | {BASE_SOURCE}
+    return {s: os.path.join(data_dir, SOURCES[s]['file']) for s in sorted(used)}
+
+
+def copy_atomic(con, query, output_path, options='FORMAT PARQUET'):
+    tmp_path = output_path + '.tmp'
+    con.execute(f"COPY ({query}) TO '{sql_path(tmp_path)}' ({options})")
+    os.replace(tmp_path, output_path)
+
+
+def build_families(con, data_dir, family_dir, features=None, params=None, force=False):
+    """
+    Recomputes the family files whose inputs or definitions changed.
+    Returns {family: path} for every family.
+    """
+    os.makedirs(family_dir, exist_ok=True)
+    lineage = LineageManifest(family_dir)
+    resolver = SchemaResolver(data_dir)
+    paths = {}
+    for family, family_features in features_by_family(FEATURES if features is None else features).items():
+        path = os.path.join(family_dir, f'{family}.parquet')
+        paths[family] = path
+        inputs = family_inputs(data_dir, family_features)
+        family_params = dict(params or {}, definition=definition_hash(family_features))
+        changed = ['<force>'] if force else lineage.changed_inputs(path, inputs, family_params)
+        lineage.report(path, changed)
+        if not changed:
+            continue
+        compiler = FeatureCompiler(data_dir, family_features, resolver)
+        copy_atomic(con, compiler.compile(base_columns=[KEY]), path,
+                    f'FORMAT PARQUET, COMPRESSION {GOLD_COMPRESSION}')
+        lineage.record(path, inputs, family_params)
+    return paths
+
+
+def build_gold_incremental(con, data_dir, output_path, profile='full', columns=None, features=None,
+                           params=None, force=False):
+    """
+    Compiles and writes the gold table from per-family files. `columns` (list
+    of names/patterns) overrides the profile's base columns; `features` (list
+    of names) its features. Families and the final file are only recomputed
+    when their inputs changed. `params` (e.g.
+    the dictionary version of the silver) is part of every lineage record.
+    Returns the number of rows of the gold file.
+    """
+    spec = PROFILES[profile]
+    base = spec['base_columns'] if columns is None else columns
+    names = spec['features'] if features is None else features
+    selected = select_features(names)
+
+    # Formato da chave (BIGINT) entra na linhagem de famílias e do arquivo final
+    params = dict(params or {}, sector_key=SECTOR_KEY_VERSION)
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    family_paths = build_families(con, data_dir, os.path.join(output_dir, FAMILY_DIR_NAME),
+                                  selected, params, force)
+    families = list(features_by_family(selected))
+
+    base_path = os.path.join(data_dir, SOURCES[BASE_SOURCE]['file'])
+    inputs = {BASE_SOURCE: base_path}
+    inputs.update({f'family:{name}': family_paths[name] for name in families})
+    final_params = dict(params or {}, profile=profile, columns=base, features=[f['name'] for f in selected])
+
+    lineage = LineageManifest(output_dir)
+    changed = ['<force>'] if force else lineage.changed_inputs(output_path, inputs, final_params)
+    lineage.report(output_path, changed)
+    if changed:
+        resolver = SchemaResolver(data_dir)
+        base = _expand_profile(resolver, base)
+        if base == '*':
+            print(f"Profile '{profile}': all base columns + {len(selected)} features.")
+        else:
+            print(f"Profile '{profile}': {len(base)} base columns + {len(selected)} features.")
+        base_scan = keyed_scan(resolver, SOURCES[BASE_SOURCE]['file'], base)
+
+        alias_of = {name: f'f{i}' for i, name in enumerate(families)}
+        select = ['m.*'] + [f'{alias_of[f["family"]]}."{f["name"]}"' for f in selected]
+        joins = [f"FROM {base_scan} m"]
+        for name in families:
+            alias = alias_of[name]
+            joins.append(f"LEFT JOIN read_parquet('{sql_path(family_paths[name])}') {alias} "
+                         f"ON m.{KEY} = {alias}.{KEY}")
+        query = "SELECT " + ", ".join(select) + "\n" + "\n".join(joins) + f"\nORDER BY m.{KEY}"
+        copy_atomic(con, query, output_path,
+                    f'FORMAT PARQUET, COMPRESSION {GOLD_COMPRESSION}, ROW_GROUP_SIZE {GOLD_ROW_GROUP_SIZE}')
+        lineage.record(output_path, inputs, final_params)
+    return con.execute(f"SELECT COUNT(*) FROM read_parquet('{sql_path(output_path)}')").fetchone()[0]
@@ -1,8 +1,12 @@
 import duckdb
 import os
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+from lineage import JsonManifest
+
 # ==============================================================================
 # CONFIGURAÇÃO
 # ==============================================================================
@@ -15,18 +19,191 @@ OUTPUT_FILE = BASE_DIR / "data" / "processed" / "cnefe_2022_optimized.parquet"
 os.makedirs(OUTPUT_FILE.parent, exist_ok=True)
 
 # Configuração de Memória (Deixe uma folga para o SO)
-MEMORY_LIMIT = "24GB" 
+# Com o modo por UF o sort global some: cada UF é ordenada sozinha, então
+# 12GB cabe numa máquina de 16GB (o maior estado, SP, ordena com spill em disco).
+MEMORY_LIMIT_GB = 12
+MEMORY_LIMIT = f"{MEMORY_LIMIT_GB}GB"
+THREADS = max(1, os.cpu_count() or 1)
+# Pasta para o spill do DuckDB quando a ordenação de uma UF não couber em memória
+TEMP_DIR = BASE_DIR / "data" / "tmp" / "duckdb_cnefe"
+
+# 'per_uf': uma UF por vez (ou UF_PARALLEL em paralelo), ordenada dentro da própria partição, retomável.
+# 'global': modo antigo, um único COPY com ORDER BY sobre todos os CSVs.
+INGEST_MODE = 'per_uf'
+# UFs processadas ao mesmo tempo. Memória e threads são divididas entre elas.
+UF_PARALLEL = 1
+ROW_GROUP_SIZE = 100_000
+MANIFEST_FILE = OUTPUT_FILE / "_ingest_manifest.json"
+UF_PATTERN = re.compile(r'^(\d{2})')
+
+# Colunas úteis para Geocodificação (mesma projeção nos dois modos)
+# 1. Seleciona só as colunas úteis
+# 2. Limpa o CEP (Remove traço)
+# 3. Garante que Lat/Lon sejam numéricos
+SELECT_COLUMNS = """
+            "COD_MUN",
+            "NOM_MUNICIPIO" as municipio,
+            "NOM_BAIRRO" as bairro,
+            "NOM_LOGRADOURO" as logradouro,
+            TRIM("NUM_ENDERECO") as numero,
+            
+            -- Limpeza do CEP (Remove não numéricos)
+            regexp_replace("NUM_CEP", '[^0-9]', '', 'g') as cep,
+            
+            -- Garante que Lat/Lon sejam numéricos
+            CAST(REPLACE("LATITUDE", ',', '.') AS DOUBLE) as latitude,
+            CAST(REPLACE("LONGITUDE", ',', '.') AS DOUBLE) as longitude,
+            
+            "COD_SETOR" as id_setor_censitario
+"""
+
+WHERE_CLAUSE = """
+        WHERE 
+            "LATITUDE" IS NOT NULL 
+            AND "LONGITUDE" IS NOT NULL
+            AND "NUM_CEP" IS NOT NULL
+"""
+
+def sql_path(path):
+    return str(path).replace("\\", "/").replace("'", "''")
+
+def dir_size_gb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total / (1024 * 1024 * 1024)
+
+def connect(memory_limit=MEMORY_LIMIT, threads=THREADS):
+    # Conecta em memória (mas usa disco se estourar a RAM)
+    con = duckdb.connect(database=':memory:')
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    con.execute(f"SET memory_limit='{memory_limit}';")
+    con.execute(f"SET threads={int(threads)};")
+    con.execute(f"SET temp_directory='{sql_path(TEMP_DIR)}';")
+    # Sem isso o DuckDB guarda a ordem de leitura dos CSVs, o que custa memória
+    con.execute("SET preserve_insertion_order=false;")
+    return con
+
+# ==============================================================================
+# MODO POR UF (out-of-core, retomável)
+# ==============================================================================
+# Cada UF vira OUTPUT_FILE/COD_UF=<uf>/data_0.parquet, o mesmo layout que o
+# PARTITION_BY (COD_UF) gerava, mas ordenada só dentro da própria UF (CEP e
+# Número continuam ordenados dentro de cada arquivo, que é o que o Range Scan
+# precisa). O arquivo é escrito em um .tmp e renomeado no fim; o manifesto
+# guarda tamanho/mtime dos CSVs de origem, então uma UF só é refeita se os
+# CSVs mudarem ou se o arquivo final não existir.
+
+def uf_of_csv(con, csv_path):
+    m = UF_PATTERN.match(csv_path.name)
+    if m:
+        return m.group(1)
+    # Nome fora do padrão 14_RR.csv: olha a primeira linha
+    row = con.execute(f"""SELECT "COD_UF" FROM read_csv_auto('{sql_path(csv_path)}', header=True) LIMIT 1""").fetchone()
+    return f"{int(row[0]):02d}"
+
+def group_csvs_by_uf(csv_files):
+    con = connect(memory_limit='1GB', threads=1)
+    groups = {}
+    for csv_path in csv_files:
+        groups.setdefault(uf_of_csv(con, csv_path), []).append(csv_path)
+    con.close()
+    return dict(sorted(groups.items()))
+
+def source_signature(csv_files):
+    return {p.name: [os.path.getsize(p), int(os.path.getmtime(p))] for p in csv_files}
+
+def uf_output_path(uf):
+    return OUTPUT_FILE / f"COD_UF={int(uf)}" / "data_0.parquet"
+
+def ingest_uf(uf, csv_files, manifest, memory_limit, threads):
+    out_path = uf_output_path(uf)
+    signature = source_signature(csv_files)
+    entry = manifest.get(uf)
+    if out_path.exists() and entry is not None and entry.get('sources') == signature:
+        print(f"⏭️ UF {uf}: já processada ({entry['rows']:,} linhas).")
+        return uf, 0, 0.0
+
+    size_mb = sum(s for s, _ in signature.values()) / (1024 * 1024)
+    print(f"⏳ UF {uf}: {len(csv_files)} CSV(s), {size_mb:,.0f} MB...")
+    start = time.time()
+
+    os.makedirs(out_path.parent, exist_ok=True)
+    tmp_path = out_path.with_name(out_path.name + '.tmp')
+    file_list = ", ".join(f"'{sql_path(p)}'" for p in csv_files)
+
+    con = connect(memory_limit, threads)
+    try:
+        rows = con.execute(f"""
+        COPY (
+            SELECT {SELECT_COLUMNS}
+            FROM read_csv_auto([{file_list}], header=True)
+            {WHERE_CLAUSE}
+            ORDER BY cep, numero
+        ) TO '{sql_path(tmp_path)}' (FORMAT 'PARQUET', CODEC 'SNAPPY', ROW_GROUP_SIZE {ROW_GROUP_SIZE});
+        """).fetchone()[0]
+    finally:
+        con.close()
+    os.replace(tmp_path, out_path)
+
+    elapsed = time.time() - start
+    print(f"   ✅ UF {uf}: {rows:,} linhas em {elapsed:.1f}s "
+          f"({rows / max(elapsed, 1e-9):,.0f} linhas/s | {size_mb / max(elapsed, 1e-9):.1f} MB/s)")
+    manifest.set(uf, {'sources': signature, 'rows': rows, 'seconds': round(elapsed, 1)})
+    return uf, rows, elapsed
 
 def ingest_cnefe():
+    print(f"🚀 Iniciando Ingestão do CNEFE com DuckDB (uma UF por vez, {UF_PARALLEL} em paralelo)...")
+    print(f"📂 Input: {INPUT_DIR}")
+    print(f"💾 Output: {OUTPUT_FILE}")
+    print(f"🧠 Memória: {MEMORY_LIMIT} | Threads: {THREADS} | Spill: {TEMP_DIR}")
+
+    csv_files = sorted(INPUT_DIR.glob("*.csv"))
+    if not csv_files:
+        print("❌ Nenhum CSV encontrado. Rode antes: python src/download_cnefe_ftp.py")
+        return
+    groups = group_csvs_by_uf(csv_files)
+    os.makedirs(OUTPUT_FILE, exist_ok=True)
+    manifest = JsonManifest(MANIFEST_FILE)
+
+    # Memória e threads divididas entre as UFs simultâneas
+    memory_limit = f"{max(1, MEMORY_LIMIT_GB // UF_PARALLEL)}GB"
+    threads = max(1, THREADS // UF_PARALLEL)
+
+    start_time = time.time()
+    total_rows = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=UF_PARALLEL) as executor:
+        futures = {executor.submit(ingest_uf, uf, files, manifest, memory_limit, threads): uf
+                   for uf, files in groups.items()}
+        for i, future in enumerate(as_completed(futures), 1):
+            uf = futures[future]
+            try:
+                _, rows, _ = future.result()
+                total_rows += rows
+            except Exception as e:
+                print(f"   ❌ UF {uf}: {e}")
+                failed.append(uf)
+            print(f"📊 Progresso: {i}/{len(groups)} UFs")
+
+    duration = time.time() - start_time
+    print(f"✅ {total_rows:,} linhas novas em {duration:.2f} segundos "
+          f"({total_rows / max(duration, 1e-9):,.0f} linhas/s).")
+    print(f"📦 Tamanho Final: {dir_size_gb(OUTPUT_FILE):.2f} GB")
+    if failed:
+        print(f"❌ UFs com erro: {failed}. Rode novamente para retomar só elas.")
+
+# ==============================================================================
+# MODO GLOBAL (antigo)
+# ==============================================================================
+def ingest_cnefe_global():
     print(f"🚀 Iniciando Ingestão do CNEFE com DuckDB...")
     print(f"📂 Input: {INPUT_DIR}")
     print(f"💾 Output: {OUTPUT_FILE}")
     
     start_time = time.time()
     
-    # Conecta em memória (mas usa disco se estourar a RAM)
-    con = duckdb.connect(database=':memory:')
-    con.execute(f"SET memory_limit='{MEMORY_LIMIT}';")
+    con = connect()
     
     # 1. DEFINIÇÃO DA LEITURA E LIMPEZA
     # O DuckDB consegue ler todos os CSVs da pasta com o wildcard *.csv
@@ -35,14 +212,12 @@ def ingest_cnefe():
     print("⏳ Lendo CSVs, Limpando e Convertendo (Isso pode levar alguns minutos)...")
     
     # Caminho para globbing (DuckDB precisa de string)
-    input_glob = str(INPUT_DIR / "*.csv")
-    output_path = str(OUTPUT_FILE)
+    input_glob = sql_path(INPUT_DIR / "*.csv")
+    output_path = sql_path(OUTPUT_FILE)
     
-    # A Query abaixo faz tudo em uma passada só:
-    # 1. Lê os CSVs
-    # 2. Seleciona só as colunas úteis (Geocodificação)
-    # 3. Limpa o CEP (Remove traço)
-    # 4. Ordena por CEP e Número (Otimização crucial para o Join depois)
+    # A Query abaixo faz tudo em uma passada só e ordena por CEP e Número
+    # (Otimização crucial para o Join depois). O ORDER BY é global: é ele que
+    # exige muita memória; prefira o modo por UF.
     
     # NOTA: Usamos PARTITION_BY (COD_UF) para quebrar o arquivo gigante em vários menores.
     # Isso ajuda no Git LFS (evita arquivo de 15GB) e ajuda no Spark (Partition Pruning).
@@ -51,27 +226,9 @@ def ingest_cnefe():
     COPY (
         SELECT 
             "COD_UF",
-            "COD_MUN",
-            "NOM_MUNICIPIO" as municipio,
-            "NOM_BAIRRO" as bairro,
-            "NOM_LOGRADOURO" as logradouro,
-            TRIM("NUM_ENDERECO") as numero,
-            
-            -- Limpeza do CEP (Remove não numéricos)
-            regexp_replace("NUM_CEP", '[^0-9]', '', 'g') as cep,
-            
-            -- Garante que Lat/Lon sejam numéricos
-            CAST(REPLACE("LATITUDE", ',', '.') AS DOUBLE) as latitude,
-            CAST(REPLACE("LONGITUDE", ',', '.') AS DOUBLE) as longitude,
-            
-            "COD_SETOR" as id_setor_censitario
-            
-        FROM read_csv_auto('{input_glob}', header=True, filename=True)
-        WHERE 
-            "LATITUDE" IS NOT NULL 
-            AND "LONGITUDE" IS NOT NULL
-            AND "NUM_CEP" IS NOT NULL
-        
+            {SELECT_COLUMNS}
+        FROM read_csv_auto('{input_glob}', header=True)
+        {WHERE_CLAUSE}
         ORDER BY cep, numero
     ) TO '{output_path}' (FORMAT 'PARQUET', CODEC 'SNAPPY', PARTITION_BY (COD_UF));
     """
@@ -82,7 +239,7 @@ def ingest_cnefe():
         duration = end_time - start_time
         
         # Verifica tamanho final
-        size_gb = os.path.getsize(OUTPUT_FILE) / (1024 * 1024 * 1024)
+        size_gb = dir_size_gb(OUTPUT_FILE)
         
         print(f"✅ Sucesso! Arquivo gerado em {duration:.2f} segundos.")
         print(f"📦 Tamanho Final: {size_gb:.2f} GB")
@@ -96,7 +253,10 @@ if __name__ == "__main__":
     # Verifica se o DuckDB está instalado
     try:
         import duckdb
-        ingest_cnefe()
+        if INGEST_MODE == 'global':
+            ingest_cnefe_global()
+        else:
+            ingest_cnefe()
     except ImportError:
         print("❌ Biblioteca 'duckdb' não encontrada.")
         print("Instale rodando: pip install duckdb")
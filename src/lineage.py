@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+# ==============================================================================
+# LINHAGEM (silver -> gold -> diamond -> taxonomia)
+# ==============================================================================
+# Cada camada guarda um _lineage.json na pasta de saída com, para cada arquivo
+# gerado, a impressão digital das entradas usadas (tamanho, mtime, SHA-256 do
+# conteúdo e, para Parquet, hash do schema) e os parâmetros relevantes
+# (versão do dicionário, configurações do estágio). Um estágio só é refeito
+# quando alguma entrada ou parâmetro mudou.
+#
+# O SHA-256 de arquivos grandes é caro: se tamanho e mtime são os mesmos da
+# última vez, o hash registrado é reaproveitado sem reler o arquivo.
+
+MANIFEST_NAME = '_lineage.json'
+HASH_BLOCK = 4 * 1024 * 1024
+
+
+def sha256_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def parquet_schema_hash(path):
+    """
+    Hash of the column names and types (footer only).
+    """
+    import pyarrow.parquet as pq
+    schema = pq.read_schema(path)
+    text = ';'.join(f"{f.name}:{f.type}" for f in schema)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def directory_listing_hash(path):
+    """
+    Cheap fingerprint of a directory: relative path, size and mtime of every file.
+    """
+    entries = []
+    for root, _, files in os.walk(path):
+        for name in files:
+            full = os.path.join(root, name)
+            st = os.stat(full)
+            entries.append(f"{os.path.relpath(full, path)}|{st.st_size}|{int(st.st_mtime)}")
+    return hashlib.sha1('\n'.join(sorted(entries)).encode('utf-8')).hexdigest()
+
+
+def params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class JsonManifest:
+    """
+    {key: entry} JSON file shared by the threads of one stage. Every set()
+    rewrites it atomically (temp file + rename).
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    def get(self, key, default=None):
+        return self.entries.get(key, default)
+
+    def set(self, key, entry):
+        with self._lock:
+            self.entries[key] = entry
+            self.save()
+        return entry
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class LineageManifest(JsonManifest):
+    """
+    Input fingerprints and parameters behind each output of one pipeline stage.
+    """
+
+    def __init__(self, directory, name=MANIFEST_NAME):
+        super().__init__(os.path.join(directory, name))
+        # Hashes conhecidos por (caminho, tamanho, mtime), de qualquer saída
+        self._known = {}
+        for entry in self.entries.values():
+            for fp in entry.get('inputs', {}).values():
+                if 'sha256' in fp:
+                    self._known[(fp['path'], fp['size'], fp['mtime'])] = fp
+
+    # --------------------------------------------------------------------------
+    # IMPRESSÃO DIGITAL
+    # --------------------------------------------------------------------------
+    def fingerprint(self, path, content_hash=True):
+        """
+        {'path', 'size', 'mtime', 'sha256', 'schema'} for a file, or
+        {'path', 'listing'} for a directory (e.g. the Diamond dataset).
+        """
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            return {'path': path, 'missing': True}
+        if os.path.isdir(path):
+            return {'path': path, 'listing': directory_listing_hash(path)}
+
+        st = os.stat(path)
+        fp = {'path': path, 'size': st.st_size, 'mtime': int(st.st_mtime)}
+        known = self._known.get((path, fp['size'], fp['mtime']))
+        if known is not None:
+            return dict(known)
+        if content_hash:
+            fp['sha256'] = sha256_file(path)
+        if path.endswith('.parquet'):
+            fp['schema'] = parquet_schema_hash(path)
+        if 'sha256' in fp:
+            self._known[(path, fp['size'], fp['mtime'])] = fp
+        return fp
+
+    @staticmethod
+    def same(a, b):
+        """
+        Same content: compares hashes when both have them (a touched but identical
+        file is unchanged), otherwise size + mtime or the directory listing.
+        An input missing now and in the recorded run (an optional theme file)
+        is unchanged.
+        """
+        if a is None or b is None:
+            return False
+        if a.get('missing') or b.get('missing'):
+            return bool(a.get('missing')) and bool(b.get('missing'))
+        if 'listing' in a or 'listing' in b:
+            return a.get('listing') == b.get('listing')
+        if 'sha256' in a and 'sha256' in b:
+            return a['sha256'] == b['sha256'] and a.get('schema') == b.get('schema')
+        return a['size'] == b['size'] and a['mtime'] == b['mtime']
+
+    # --------------------------------------------------------------------------
+    # CONSULTA
+    # --------------------------------------------------------------------------
+    def changed_inputs(self, output, inputs, params=None, content_hash=True):
+        """
+        Names of the inputs (and '<params>') that differ from the last recorded run
+        of `output`. Every name is returned when the output has no record or is missing.
+        inputs: {name: path}.
+        """
+        output = os.path.abspath(output)
+        entry = self.entries.get(output)
+        if entry is None or not os.path.exists(output):
+            return list(inputs) + ['<params>']
+        changed = []
+        for name, path in inputs.items():
+            if not self.same(entry['inputs'].get(name), self.fingerprint(path, content_hash)):
+                changed.append(name)
+        if entry.get('params_hash') != params_hash(params or {}):
+            changed.append('<params>')
+        return changed
+
+    def has_record(self, output):
+        return os.path.abspath(output) in self.entries
+
+    def is_current(self, output, inputs, params=None, content_hash=True):
+        return not self.changed_inputs(output, inputs, params, content_hash)
+
+    def record(self, output, inputs, params=None, content_hash=True, **extra):
+        """
+        Stores the fingerprints of `inputs` and the params used to produce `output`.
+        """
+        output = os.path.abspath(output)
+        entry = {
+            'inputs': {name: self.fingerprint(path, content_hash) for name, path in inputs.items()},
+            'params': params or {},
+            'params_hash': params_hash(params or {}),
+            'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            **extra,
+        }
+        return self.set(output, entry)
+
+    def params_of(self, output, key, default=None):
+        """
+        One param of the last recorded run of `output` (e.g. the dictionary
+        version behind the gold file, to record it in the Diamond lineage).
+        """
+        output = os.path.abspath(output)
+        return self.entries.get(output, {}).get('params', {}).get(key, default)
+
+    def invalidate(self, output):
+        """
+        Drops the record of `output` before rewriting it in place, so an
+        interrupted run is never taken as current.
+        """
+        output = os.path.abspath(output)
+        with self._lock:
+            if self.entries.pop(output, None) is not None:
+                self.save()
+
+    def param_values(self, key):
+        """
+        Distinct values of one recorded param across all outputs, e.g. the
+        dictionary version(s) behind the silver files, to pass downstream.
+        """
+        values = {json.dumps(e.get('params', {}).get(key), sort_keys=True) for e in self.entries.values()}
+        return sorted(json.loads(v) for v in values if v != 'null')
+
+    def report(self, output, changed):
+        name = os.path.basename(output)
+        if not changed:
+            print(f"⏭️ {name}: inputs unchanged, skipping.")
+        elif not self.has_record(output):
+            print(f"🔨 {name}: no lineage record, building.")
+        else:
+            print(f"🔨 {name}: changed inputs -> {', '.join(changed)}")
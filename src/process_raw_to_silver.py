@@ -1,62 +1,50 @@
 import pandas as pd
 import os
 import glob
-import re
-from unicodedata import normalize
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from census_dictionary import load_var_map, load_dtype_map, dictionary_version
+from lineage import LineageManifest
+from sector_key import find_sector_key, normalize_key_column, SECTOR_KEY_VERSION
 
 DATA_DIR = r"c:\projetos\projeto-censo\data\raw"
 OUTPUT_DIR = r"c:\projetos\projeto-censo\data\silver"
 DICT_FILE = os.path.join(DATA_DIR, "dicionario_de_dados_agregados_por_setores_censitarios_20250417.xlsx")
 
-def slugify(text):
-    if not isinstance(text, str):
-        return str(text)
-    text = normalize('NFKD', text).encode('ASCII', 'ignore').decode('ASCII')
-    text = text.lower()
-    text = re.sub(r'[^a-z0-9]+', '_', text)
-    text = text.strip('_')
-    return text
+# Um processo por arquivo CSV. Cada worker carrega um CSV inteiro em memória,
+# então reduza se os arquivos nacionais não couberem em RAM ao mesmo tempo.
+N_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# Parse tipado (pyarrow, uma passada) em vez de ler tudo como str e converter.
+# Se falhar em algum arquivo, cai no parse antigo (string round-trip).
+TYPED_PARSE = True
+SAMPLE_ROWS = 10_000
+# Marcadores de ausência/sigilo do IBGE
+NA_VALUES = ['.', 'X']
+# Inteiros até 2^24 são exatos em float32
+FLOAT32_EXACT_INT = 2 ** 24
+# dtype do dicionário compilado -> tipo Arrow do parse
+DICTIONARY_ARROW_TYPES = {'int64': pa.int64(), 'float64': pa.float64()}
+# Reprocessa tudo, ignorando o _lineage.json do silver
+FORCE = False
 
 def load_dictionary():
+    # Compiled once per xlsx version (see census_dictionary.py)
     print("Loading dictionary...")
-    xls = pd.ExcelFile(DICT_FILE)
-    var_map = {}
-    
-    for sheet in xls.sheet_names:
-        if 'Siglas' in sheet: continue
-        print(f"  Processing sheet: {sheet}")
-        df = pd.read_excel(DICT_FILE, sheet_name=sheet)
-        
-        if 'Variável' in df.columns and 'Descrição' in df.columns:
-            for _, row in df.iterrows():
-                var_code = str(row['Variável']).strip().upper()
-                desc = row['Descrição']
-                # Append code to ensure uniqueness and traceability
-                slug = slugify(desc)
-                var_map[var_code] = f"{slug}_{var_code.lower()}"
-                
+    var_map = load_var_map(DICT_FILE)
+    dtype_map = load_dtype_map(DICT_FILE)
     print(f"Dictionary loaded with {len(var_map)} variables.")
-    return var_map
+    return var_map, dtype_map
 
-def process_file(csv_file, var_map):
-    filename = os.path.basename(csv_file)
-    name_no_ext = os.path.splitext(filename)[0]
-    output_path = os.path.join(OUTPUT_DIR, f"{name_no_ext}.parquet")
-    
-    if os.path.exists(output_path):
-        print(f"Skipping {filename} (already processed)")
-        return
+def is_key_column(col):
+    # ID/name columns (CD_SETOR, NM_MUN, setor, ...) are parsed as strings;
+    # the sector key is converted to int64 afterwards (normalize_key_column)
+    return col.startswith('CD_') or col.startswith('NM_') or find_sector_key([col]) is not None
 
-    print(f"Processing {filename}...")
-    
-    # Read CSV
-    try:
-        df = pd.read_csv(csv_file, sep=';', encoding='utf-8', dtype=str)
-    except UnicodeDecodeError:
-        print("  UTF-8 failed, trying Latin-1")
-        df = pd.read_csv(csv_file, sep=';', encoding='latin1', dtype=str)
-    
+def rename_columns(df, var_map):
     # Rename columns
     new_cols = {}
     for col in df.columns:
@@ -72,6 +60,97 @@ def process_file(csv_file, var_map):
             new_cols[col] = col
             
     df.rename(columns=new_cols, inplace=True)
+    return df
+
+def build_dtype_plan(csv_file, encoding, dtype_map):
+    """
+    Decides the Arrow type of every column once, before the full parse:
+    key columns -> string, dictionary variables -> the dictionary dtype
+    (int64 counts, float64 rates/means), other columns -> float64 if the
+    sampled values are numeric, else string.
+    """
+    sample = pd.read_csv(csv_file, sep=';', encoding=encoding, dtype=str, nrows=SAMPLE_ROWS)
+    plan = {}
+    for col in sample.columns:
+        if is_key_column(col):
+            plan[col] = pa.string()
+            continue
+        values = sample[col].dropna()
+        values = values[~values.isin(NA_VALUES)]
+        dtype = dtype_map.get(col.upper())
+        if dtype in DICTIONARY_ARROW_TYPES:
+            plan[col] = DICTIONARY_ARROW_TYPES[dtype]
+            # O dtype do dicionário vem do nome da variável: uma "contagem"
+            # com decimais na amostra vira float64 em vez de quebrar o parse
+            if dtype == 'int64' and values.str.contains(',', regex=False).any():
+                plan[col] = pa.float64()
+        else:
+            numeric = pd.to_numeric(values.str.replace(',', '.'), errors='coerce')
+            plan[col] = pa.float64() if numeric.notna().all() else pa.string()
+    return plan
+
+def downcast_numeric(df):
+    """
+    Integral columns -> int32 (or int64 if out of range) when there are no
+    nulls, float32 when there are nulls and the values are exact in float32.
+    Non-integral columns stay float64.
+    """
+    # Contagens do dicionário sem nulos chegam como int64
+    for col in df.select_dtypes(include=['int64']).columns:
+        values = df[col].to_numpy()
+        if len(values) and values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max:
+            df[col] = values.astype(np.int32)
+    for col in df.select_dtypes(include=['float64']).columns:
+        values = df[col].to_numpy()
+        valid = values[~np.isnan(values)]
+        if len(valid) == 0 or not np.all(np.mod(valid, 1) == 0):
+            continue
+        lo, hi = valid.min(), valid.max()
+        if len(valid) < len(values):
+            if max(abs(lo), abs(hi)) <= FLOAT32_EXACT_INT:
+                df[col] = values.astype(np.float32)
+        elif lo >= np.iinfo(np.int32).min and hi <= np.iinfo(np.int32).max:
+            df[col] = values.astype(np.int32)
+        else:
+            df[col] = values.astype(np.int64)
+    return df
+
+def read_typed(csv_file, dtype_map):
+    """
+    One-pass typed parse with the pyarrow CSV reader: decimal ',', '.' and 'X'
+    as nulls, column types from build_dtype_plan. Tries UTF-8, then Latin-1.
+    """
+    last_error = None
+    for encoding in ['utf-8', 'latin1']:
+        try:
+            plan = build_dtype_plan(csv_file, encoding, dtype_map)
+            table = pa_csv.read_csv(
+                csv_file,
+                read_options=pa_csv.ReadOptions(encoding=encoding),
+                parse_options=pa_csv.ParseOptions(delimiter=';'),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types=plan,
+                    null_values=NA_VALUES + [''],
+                    strings_can_be_null=True,
+                    decimal_point=',',
+                ),
+            )
+            return downcast_numeric(table.to_pandas())
+        except (UnicodeDecodeError, pa.ArrowInvalid) as e:
+            print(f"  Typed parse with {encoding} failed: {str(e)[:200]}")
+            last_error = e
+    raise last_error
+
+def read_legacy(csv_file):
+    """
+    Original string round-trip: everything as str, then converted column by column.
+    """
+    # Read CSV
+    try:
+        df = pd.read_csv(csv_file, sep=';', encoding='utf-8', dtype=str)
+    except UnicodeDecodeError:
+        print("  UTF-8 failed, trying Latin-1")
+        df = pd.read_csv(csv_file, sep=';', encoding='latin1', dtype=str)
     
     # Treat values
     # Replace '.' with NaN
@@ -85,7 +164,7 @@ def process_file(csv_file, var_map):
     
     for col in df.columns:
         # Skip ID columns from conversion to float (keep as object/string or int if clean)
-        if col.startswith('CD_') or col.startswith('NM_'):
+        if is_key_column(col):
             continue
             
         # Try to convert to numeric
@@ -101,20 +180,104 @@ def process_file(csv_file, var_map):
             # Let's use 'coerce' but report if we created NaNs? 
             # For now, let's just remove the try/except suppression and use coerce to avoid the FutureWarning.
             df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+def silver_path(csv_file):
+    name_no_ext = os.path.splitext(os.path.basename(csv_file))[0]
+    return os.path.join(OUTPUT_DIR, f"{name_no_ext}.parquet")
+
+def process_file(csv_file, var_map, dtype_map):
+    filename = os.path.basename(csv_file)
+    output_path = silver_path(csv_file)
+
+    # Quem decide se o arquivo precisa ser refeito é o main (linhagem). A
+    # escrita é feita em um .tmp e renomeada no fim, então uma execução
+    # interrompida nunca deixa um Parquet pela metade com o nome final.
+    print(f"Processing {filename}...")
+    start = time.time()
+    size_mb = os.path.getsize(csv_file) / (1024 * 1024)
+    
+    df = None
+    if TYPED_PARSE:
+        try:
+            df = read_typed(csv_file, dtype_map)
+        except Exception as e:
+            print(f"  Typed parse failed ({e}), falling back to string parse")
+    if df is None:
+        df = read_legacy(csv_file)
+
+    rename_columns(df, var_map)
+
+    # Chave do setor canônica em todos os arquivos: CD_SETOR int64 (o dom3
+    # traz 'setor' lido como float, outros CD_SETOR em texto)
+    if find_sector_key(df.columns) is not None:
+        df = normalize_key_column(df)
             
-    # Save to Parquet
-    df.to_parquet(output_path, index=False, engine='fastparquet')
-    print(f"  Saved to {output_path}")
+    # Save to Parquet (atomic: temp file + rename)
+    tmp_path = output_path + ".tmp"
+    df.to_parquet(tmp_path, index=False, engine='fastparquet')
+    os.replace(tmp_path, output_path)
+
+    elapsed = time.time() - start
+    rows = len(df)
+    print(f"  Saved to {output_path} "
+          f"({rows:,} rows in {elapsed:.1f}s | {rows / max(elapsed, 1e-9):,.0f} rows/s | {size_mb / max(elapsed, 1e-9):.1f} MB/s)")
+    return filename, rows, size_mb, elapsed
+
+def select_stale(csv_files, lineage, params):
+    """
+    CSVs whose silver Parquet is missing or was built from different content
+    or with a different dictionary / parse setting. An output from before the
+    lineage manifest existed has no record, so it is rebuilt: nothing says which
+    dictionary or parse setting produced it.
+    """
+    stale = []
+    for csv_file in csv_files:
+        output_path = silver_path(csv_file)
+        if FORCE:
+            stale.append(csv_file)
+            continue
+        changed = lineage.changed_inputs(output_path, {'csv': csv_file}, params)
+        if changed:
+            stale.append(csv_file)
+        else:
+            print(f"Skipping {os.path.basename(csv_file)} (unchanged)")
+    return stale
 
 def main():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    var_map = load_dictionary()
-    
-    csv_files = glob.glob(os.path.join(DATA_DIR, "*.csv"))
-    print(f"Found {len(csv_files)} CSV files.")
+    var_map, dtype_map = load_dictionary()
+
+    # O nome das colunas do silver depende do dicionário: se o xlsx (ou o
+    # compilador) mudar, todos os arquivos são refeitos.
+    params = {'dictionary': dictionary_version(DICT_FILE), 'typed_parse': TYPED_PARSE,
+              'sector_key': SECTOR_KEY_VERSION}
+    lineage = LineageManifest(OUTPUT_DIR)
+
+    all_csv = glob.glob(os.path.join(DATA_DIR, "*.csv"))
+    csv_files = select_stale(all_csv, lineage, params)
+    print(f"Found {len(all_csv)} CSV files, {len(csv_files)} to convert with {N_WORKERS} workers...")
     
-    for csv_file in csv_files:
-        process_file(csv_file, var_map)
+    start = time.time()
+    total_rows = 0
+    total_mb = 0.0
+    with ProcessPoolExecutor(max_workers=N_WORKERS) as executor:
+        futures = {executor.submit(process_file, csv_file, var_map, dtype_map): csv_file for csv_file in csv_files}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error processing {os.path.basename(futures[future])}: {e}")
+                continue
+            if result:
+                _, rows, size_mb, _ = result
+                lineage.record(silver_path(futures[future]), {'csv': futures[future]}, params, rows=rows)
+                total_rows += rows
+                total_mb += size_mb
+
+    elapsed = time.time() - start
+    print(f"Done: {total_rows:,} rows / {total_mb:,.0f} MB in {elapsed:.1f}s "
+          f"({total_rows / max(elapsed, 1e-9):,.0f} rows/s | {total_mb / max(elapsed, 1e-9):.1f} MB/s)")
 
 if __name__ == "__main__":
     main()
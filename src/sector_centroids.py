@@ -0,0 +1,141 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from lineage import LineageManifest
+from sector_key import normalize_sector_key
+
+# ==============================================================================
+# TABELA DE CENTRÓIDES DA MALHA (pré-calculada uma vez)
+# ==============================================================================
+# Os estágios espaciais só precisam de pontos, mas cada execução lia centenas
+# de MB de polígonos em WKB, reprojetava a malha inteira e calculava os
+# centróides. A tabela abaixo é gerada junto com a malha (Master Mesh em
+# refactor_taxonomy_and_split.py) e tem uma linha por setor, ordenada por
+# id_setor (int64, chave canônica de src/sector_key.py), só com números (float64):
+#
+#   x_5880, y_5880         centróide em SIRGAS 2000 / Brazil Polyconic (metros)
+#   x_4674, y_4674         centróide em SIRGAS 2000 lat/lon (graus)
+#   rep_x_*, rep_y_*       ponto representativo (sempre dentro do polígono)
+#   area_m2                área no CRS métrico
+#   xmin_*, ymin_*, ...    bounding box nos dois CRS
+#
+# O centróide em 5880 é calculado como gdf.to_crs("EPSG:5880").geometry.centroid,
+# e o centróide em 4674 como o centróide do polígono em graus (o que o
+# KNN.from_dataframe do libpysal usa): os resultados dos estágios não mudam.
+
+METRIC_CRS = "EPSG:5880"
+GEOGRAPHIC_CRS = "EPSG:4674"
+CRS_SUFFIXES = {METRIC_CRS: '5880', GEOGRAPHIC_CRS: '4674'}
+KEY_COLUMN = 'id_setor'
+# Aumente quando as colunas ou o cálculo mudarem: refaz a tabela
+CENTROIDS_VERSION = 2
+BATCH_SIZE = 50_000
+
+
+def mesh_crs(path):
+    """
+    CRS of the geometry column from the GeoParquet metadata (None if absent).
+    """
+    from pyproj import CRS
+    meta = pq.read_schema(path).metadata or {}
+    geo = json.loads(meta.get(b'geo', b'{}'))
+    crs = geo.get('columns', {}).get(geo.get('primary_column', 'geometry'), {}).get('crs')
+    if isinstance(crs, dict):
+        return CRS.from_json_dict(crs)
+    return CRS.from_user_input(crs) if crs else None
+
+
+def geometry_columns(geoms, suffix, area=False):
+    """
+    Centroid, representative point, bbox (and area) of a GeoSeries, named
+    with the CRS suffix.
+    """
+    centroids = geoms.centroid
+    reps = geoms.representative_point()
+    bounds = geoms.bounds
+    columns = {
+        f'x_{suffix}': centroids.x.to_numpy(),
+        f'y_{suffix}': centroids.y.to_numpy(),
+        f'rep_x_{suffix}': reps.x.to_numpy(),
+        f'rep_y_{suffix}': reps.y.to_numpy(),
+        f'xmin_{suffix}': bounds['minx'].to_numpy(),
+        f'ymin_{suffix}': bounds['miny'].to_numpy(),
+        f'xmax_{suffix}': bounds['maxx'].to_numpy(),
+        f'ymax_{suffix}': bounds['maxy'].to_numpy(),
+    }
+    if area:
+        columns['area_m2'] = geoms.area.to_numpy()
+    return columns
+
+
+def compute_centroid_table(mesh_path, key='code_tract', batch_size=BATCH_SIZE):
+    """
+    Centroid table of a GeoParquet mesh, reading key + geometry in row
+    batches (the attributes are never read). Sorted by id_setor; a repeated
+    key keeps its first polygon.
+    """
+    import geopandas as gpd
+    crs = mesh_crs(mesh_path)
+    parts = []
+    for batch in pq.ParquetFile(mesh_path).iter_batches(columns=[key, 'geometry'], batch_size=batch_size):
+        geoms = gpd.GeoSeries.from_wkb(batch.column('geometry').to_numpy(zero_copy_only=False), crs=crs)
+        part = {KEY_COLUMN: normalize_sector_key(batch.column(key).to_pandas())}
+        for target, suffix in CRS_SUFFIXES.items():
+            projected = geoms if geoms.crs == target else geoms.to_crs(target)
+            part.update(geometry_columns(projected, suffix, area=(target == METRIC_CRS)))
+        parts.append(pd.DataFrame(part))
+        del geoms
+
+    table = pd.concat(parts, ignore_index=True)
+    table = table.drop_duplicates(KEY_COLUMN, keep='first')
+    return table.sort_values(KEY_COLUMN, kind='stable').reset_index(drop=True)
+
+
+def write_centroid_table(mesh_path, output_path, key='code_tract'):
+    table = compute_centroid_table(mesh_path, key)
+    tmp_path = output_path + '.tmp'
+    table.to_parquet(tmp_path, index=False, compression='zstd')
+    os.replace(tmp_path, output_path)
+    return len(table)
+
+
+def ensure_centroid_table(mesh_path, output_path, key='code_tract', force=False):
+    """
+    Builds the centroid table of `mesh_path` at `output_path` unless the
+    lineage says it is current. Returns output_path.
+    """
+    lineage = LineageManifest(os.path.dirname(os.path.abspath(output_path)))
+    inputs = {'mesh': mesh_path}
+    params = {'version': CENTROIDS_VERSION, 'key': key}
+    changed = ['<force>'] if force else lineage.changed_inputs(output_path, inputs, params)
+    lineage.report(output_path, changed)
+    if changed:
+        lineage.invalidate(output_path)
+        n = write_centroid_table(mesh_path, output_path, key)
+        lineage.record(output_path, inputs, params)
+        print(f"Centroid table saved: {output_path} ({n:,} sectors)")
+    return output_path
+
+
+def centroid_coords(path, keys, crs=METRIC_CRS, kind='centroid'):
+    """
+    (N, 2) float64 points for `keys` (any sector key format), in that order.
+    kind: 'centroid' or 'representative'. Raises KeyError for keys that are
+    not in the table.
+    """
+    if crs not in CRS_SUFFIXES:
+        raise ValueError(f"centroid table has no columns for {crs}; available: {list(CRS_SUFFIXES)}")
+    suffix = CRS_SUFFIXES[crs]
+    prefix = 'rep_' if kind == 'representative' else ''
+    x_col, y_col = f'{prefix}x_{suffix}', f'{prefix}y_{suffix}'
+
+    table = pq.read_table(path, columns=[KEY_COLUMN, x_col, y_col])
+    positions = pd.Index(table.column(KEY_COLUMN).to_numpy()).get_indexer(normalize_sector_key(keys))
+    if (positions < 0).any():
+        missing = np.asarray(keys)[positions < 0]
+        raise KeyError(f"{len(missing)} sectors not in {path}, e.g. {list(missing[:3])}")
+    return np.column_stack((table.column(x_col).to_numpy()[positions],
+                            table.column(y_col).to_numpy()[positions]))
@@ -0,0 +1,235 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sector_key import normalize_sector_key, normalize_municipio_code, SECTOR_DIGITS, MUNICIPIO_DIGITS
+
+# ==============================================================================
+# DATASETS PARTICIONADOS POR UF (gold / diamond / malha)
+# ==============================================================================
+# O código do setor (15 dígitos) é hierárquico: UF (2) + município (5) +
+# distrito (2) + subdistrito (2) + setor (4). Os datasets publicados são
+# gravados em partições hive por UF, ordenados pelo código do setor dentro de
+# cada partição (o que agrupa os municípios em row groups contíguos):
+#
+#   censo_2022_gold_standardized/
+#       id_uf=11/part-0000.parquet
+#       id_uf=35/part-0000.parquet ...
+#
+# Ao ler uma cidade, o filtro de UF descarta as outras pastas (partition
+# pruning) e o intervalo de códigos do município descarta os row groups de
+# fora pelo min/max do código do setor. A coluna id_uf não é gravada nos
+# arquivos: na leitura ela vem do nome da pasta e volta ao tipo da taxonomia
+# (código em texto, '35'), como na malha e no gold padronizado de antes.
+
+PARTITION_COLUMN = 'id_uf'
+UF_DIGITS = 2
+# Row groups pequenos: um município médio (~85 setores) cai em um row group,
+# São Paulo (~27 mil) em poucos
+ROW_GROUP_SIZE = 10_000
+COMPRESSION = 'zstd'
+KEY_CANDIDATES = ['id_setor', 'CD_SETOR', 'code_tract']
+
+
+def uf_of(keys):
+    """
+    UF code (first 2 digits of the sector key) of every key, as int.
+    Raises ValueError for invalid keys.
+    """
+    return normalize_sector_key(keys) // 10 ** (SECTOR_DIGITS - UF_DIGITS)
+
+
+def partition_dir(directory, uf):
+    return os.path.join(directory, f"{PARTITION_COLUMN}={int(uf):02d}")
+
+
+def _swap(tmp_dir, directory):
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_dir, directory)
+
+
+def _fresh(directory):
+    tmp_dir = directory.rstrip('/\\') + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    return tmp_dir
+
+
+# ==============================================================================
+# ESCRITA
+# ==============================================================================
+def write_partitioned(frame, directory, key, row_group_size=ROW_GROUP_SIZE):
+    """
+    Writes a DataFrame or GeoDataFrame (GeoParquet metadata is kept) as a
+    dataset partitioned by UF and sorted by `key`. The directory is replaced
+    atomically. Returns {uf: rows}.
+    """
+    codes = normalize_sector_key(frame[key])
+    ufs = codes // 10 ** (SECTOR_DIGITS - UF_DIGITS)
+    order = np.argsort(codes, kind='stable')
+    frame = frame.iloc[order]
+    ufs = ufs[order]
+    if PARTITION_COLUMN in frame.columns:
+        frame = frame.drop(columns=[PARTITION_COLUMN])
+
+    tmp_dir = _fresh(directory)
+    counts = {}
+    bounds = np.flatnonzero(np.diff(ufs)) + 1
+    for start, stop in zip(np.r_[0, bounds], np.r_[bounds, len(ufs)]):
+        uf = int(ufs[start])
+        path = os.path.join(partition_dir(tmp_dir, uf), 'part-0000.parquet')
+        os.makedirs(os.path.dirname(path))
+        frame.iloc[start:stop].to_parquet(path, index=False, compression=COMPRESSION,
+                                          row_group_size=row_group_size)
+        counts[uf] = int(stop - start)
+    _swap(tmp_dir, directory)
+    return counts
+
+
+def partition_parquet(source_path, directory, key='CD_SETOR', row_group_size=ROW_GROUP_SIZE):
+    """
+    Splits a (large) Parquet file into a UF-partitioned dataset, one UF in
+    memory at a time: only the key column is read up front, then each UF is
+    read with a key-range filter (cheap when the source is sorted by key).
+    Returns {uf: rows}.
+    """
+    key_type = pq.read_schema(source_path).field(key).type
+    keys = pq.read_table(source_path, columns=[key]).column(key).to_pandas()
+    tmp_dir = _fresh(directory)
+    counts = {}
+    for uf in np.unique(uf_of(keys)):
+        table = pq.read_table(source_path, filters=key_filter(key, key_type, f'{uf:02d}'))
+        table = table.sort_by(key)
+        if PARTITION_COLUMN in table.column_names:
+            table = table.drop_columns([PARTITION_COLUMN])
+        path = os.path.join(partition_dir(tmp_dir, uf), 'part-0000.parquet')
+        os.makedirs(os.path.dirname(path))
+        pq.write_table(table, path, compression=COMPRESSION, row_group_size=row_group_size)
+        counts[int(uf)] = table.num_rows
+    _swap(tmp_dir, directory)
+    return counts
+
+
+# ==============================================================================
+# LEITURA
+# ==============================================================================
+def key_filter(key, key_type, prefix):
+    """
+    Expression selecting the sector keys that start with `prefix` (UF or
+    municipality code), as a range so row-group min/max statistics apply.
+    """
+    prefix = str(prefix)
+    upper = str(int(prefix) + 1).zfill(len(prefix))
+    if pa.types.is_integer(key_type):
+        scale = 10 ** (SECTOR_DIGITS - len(prefix))
+        return (ds.field(key) >= int(prefix) * scale) & (ds.field(key) < int(upper) * scale)
+    return (ds.field(key) >= prefix) & (ds.field(key) < upper)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set, np.ndarray, pd.Series)):
+        return [str(v) for v in value]
+    return [str(value)]
+
+
+def dataset_schema(path):
+    """
+    Schema of a single Parquet file or of a UF-partitioned dataset (with id_uf).
+    """
+    return ds.dataset(path, format='parquet', partitioning='hive').schema
+
+
+def dataset_columns(path):
+    return dataset_schema(path).names
+
+
+def find_key(schema, key=None):
+    if key is not None:
+        return key
+    for candidate in KEY_CANDIDATES:
+        if candidate in schema.names:
+            return candidate
+    raise KeyError(f"no sector key column among {KEY_CANDIDATES}")
+
+
+def sector_filter(schema, key, uf=None, municipio=None):
+    """
+    Filter expression for lists of UF and/or municipality codes (OR within
+    each list). Uses the id_uf partition when the dataset has one.
+    """
+    municipios = [m.zfill(MUNICIPIO_DIGITS) for m in _as_list(municipio)]
+    ufs = sorted({u.zfill(UF_DIGITS) for u in _as_list(uf)} | {m[:UF_DIGITS] for m in municipios})
+    key_type = schema.field(key).type
+
+    parts = []
+    if ufs:
+        if PARTITION_COLUMN in schema.names:
+            parts.append(ds.field(PARTITION_COLUMN).isin([int(u) for u in ufs]))
+        else:
+            expr = None
+            for u in ufs:
+                e = key_filter(key, key_type, u)
+                expr = e if expr is None else expr | e
+            parts.append(expr)
+    if municipios:
+        expr = None
+        for m in municipios:
+            e = key_filter(key, key_type, m)
+            expr = e if expr is None else expr | e
+        parts.append(expr)
+
+    if not parts:
+        return None
+    expr = parts[0]
+    for e in parts[1:]:
+        expr = expr & e
+    return expr
+
+
+def read_sectors(path, uf=None, municipio=None, columns=None, key=None):
+    """
+    Reads the rows of some UFs/municipalities (codes; int or str; single or
+    list) and only the requested columns from a UF-partitioned dataset or a
+    plain Parquet file. The key column always comes first. Returns a
+    GeoDataFrame when the data is GeoParquet and the geometry is selected.
+    """
+    schema = dataset_schema(path)
+    key = find_key(schema, key)
+    if columns is not None:
+        columns = [key] + [c for c in columns if c != key]
+    expr = sector_filter(schema, key, uf, municipio)
+
+    geo = b'geo' in (schema.metadata or {})
+    if geo and (columns is None or 'geometry' in columns):
+        import geopandas as gpd
+        df = gpd.read_parquet(path, columns=columns, filters=expr)
+    else:
+        df = pq.read_table(path, columns=columns, filters=expr, partitioning='hive').to_pandas()
+    return restore_partition_column(df) if os.path.isdir(path) else df
+
+
+def restore_partition_column(df):
+    """
+    id_uf read from the hive folder name (categorical of ints) back to the
+    taxonomy's string code ('35').
+    """
+    if PARTITION_COLUMN in df.columns:
+        df[PARTITION_COLUMN] = df[PARTITION_COLUMN].astype(int).map(lambda uf: f"{uf:0{UF_DIGITS}d}")
+    return df
+
+
+def lookup_municipio(path, name, code_column='id_municipio', name_column='nm_municipio'):
+    """
+    Municipality codes (there are homonyms in different UFs) for a name,
+    reading only the two columns.
+    """
+    df = pq.read_table(path, columns=[code_column, name_column], partitioning='hive').to_pandas()
+    codes = df.loc[df[name_column] == name, code_column].dropna().unique()
+    return [str(code) for code in np.unique(normalize_municipio_code(codes))]
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# ==============================================================================
+# CHAVE CANÔNICA DO SETOR (int64)
+# ==============================================================================
+# O código do setor tem 15 dígitos (UF + município + distrito + subdistrito +
+# setor) e cabe exato em int64 (e em float64, < 2^53). Cada arquivo do IBGE
+# traz a chave de um jeito: CD_SETOR em texto, 'setor' lido como float
+# (355030801000001.0), 'CD_setor', 'index' em exports do pandas, code_tract
+# float na malha do geobr. Todos passam por normalize_sector_key, do silver em
+# diante, e os JOINs/merges rodam sobre inteiros: 8 bytes por linha em vez de
+# uma string Python de 15 caracteres, e o Parquet compacta melhor a coluna
+# ordenada.
+
+SECTOR_DIGITS = 15
+MUNICIPIO_DIGITS = 7
+KEY_MIN = 10 ** (SECTOR_DIGITS - 1)
+KEY_MAX = 10 ** SECTOR_DIGITS - 1
+KEY_DTYPE = np.int64
+# Nome canônico em cada camada: silver/gold/diamond usam CD_SETOR, a taxonomia id_setor
+KEY_NAME = 'CD_SETOR'
+# Variantes do nome da coluna, em ordem de preferência ('index' só se não houver outra)
+KEY_ALIASES = ['CD_SETOR', 'id_setor', 'code_tract', 'setor', 'COD_SETOR', 'index']
+# Aumente se o formato da chave mudar: as camadas guardam na linhagem e refazem
+SECTOR_KEY_VERSION = 1
+
+
+def find_sector_key(columns):
+    """
+    Name of the sector key column among `columns` (case-insensitive match of
+    KEY_ALIASES, e.g. 'CD_setor'), or None.
+    """
+    by_lower = {}
+    for c in columns:
+        by_lower.setdefault(str(c).lower(), c)
+    for alias in KEY_ALIASES:
+        if alias.lower() in by_lower:
+            return by_lower[alias.lower()]
+    return None
+
+
+def normalize_sector_key(values):
+    """
+    Sector keys (str with or without '.0', int, float) -> int64 numpy array.
+    Raises ValueError for nulls or values that are not 15-digit codes.
+    """
+    values = pd.Series(values)
+    keys, bad = _integer_codes(values)
+    _check(keys, bad, values)
+    return keys
+
+
+def normalize_municipio_code(values):
+    """
+    Municipality codes (7 digits) or sector keys (15 digits), as str with or
+    without '.0', int or float -> int64 numpy array of 7-digit municipality
+    codes. Raises ValueError for nulls or values of any other length.
+    """
+    values = pd.Series(values)
+    codes, bad = _integer_codes(values)
+    sectors = (codes >= KEY_MIN) & (codes <= KEY_MAX)
+    codes = np.where(sectors, codes // 10 ** (SECTOR_DIGITS - MUNICIPIO_DIGITS), codes)
+    bad = bad | (codes < 10 ** (MUNICIPIO_DIGITS - 1)) | (codes >= 10 ** MUNICIPIO_DIGITS)
+    if bad.any():
+        examples = values[bad].head(3).tolist()
+        raise ValueError(f"{int(bad.sum())} invalid municipality codes (expected {MUNICIPIO_DIGITS} "
+                         f"or {SECTOR_DIGITS} digits), e.g. {examples}")
+    return codes
+
+
+def _integer_codes(values):
+    """
+    (int64 codes, invalid mask) of a Series of IBGE codes in any format.
+    """
+    if pd.api.types.is_integer_dtype(values) and not values.isna().any():
+        keys = values.to_numpy(dtype=KEY_DTYPE)
+        bad = np.zeros(len(keys), dtype=bool)
+    elif pd.api.types.is_float_dtype(values):
+        # Artefato de float (355030801000001.0): exato em float64, só arredonda
+        floats = values.to_numpy(dtype=np.float64)
+        bad = np.isnan(floats) | (floats != np.round(floats))
+        keys = np.where(bad, 0, np.round(floats)).astype(KEY_DTYPE)
+    else:
+        text = values.astype('string').str.strip().str.replace(r'\.0+$', '', regex=True)
+        digits = text.str.fullmatch(r'\d+').fillna(False).astype(bool)
+        numbers = pd.to_numeric(text.where(digits), errors='coerce')
+        bad = numbers.isna().to_numpy()
+        keys = numbers.fillna(0).to_numpy(dtype=KEY_DTYPE)
+    return keys, bad
+
+
+def _check(keys, bad, original):
+    bad = bad | (keys < KEY_MIN) | (keys > KEY_MAX)
+    if bad.any():
+        examples = pd.Series(original)[bad].head(3).tolist()
+        raise ValueError(f"{int(bad.sum())} invalid sector keys (expected {SECTOR_DIGITS} digits), e.g. {examples}")
+
+
+def normalize_key_column(df, name=KEY_NAME):
+    """
+    Finds the sector key column of `df` (any variant), converts it to int64,
+    renames it to `name` and moves it first. Returns the new frame.
+    """
+    source = find_sector_key(df.columns)
+    if source is None:
+        raise KeyError(f"no sector key column among {KEY_ALIASES}")
+    keys = normalize_sector_key(df[source])
+    df = df.drop(columns=[c for c in {source, name} if c in df.columns])
+    df.insert(0, name, keys)
+    return df
+
+
+def key_array(keys):
+    """
+    Arrow int64 array of normalized keys (e.g. for pyarrow isin filters).
+    """
+    return pa.array(normalize_sector_key(keys), type=pa.int64())
+
+
+def sql_sector_key(column, arrow_type):
+    """
+    DuckDB expression that reads a key column of the given Arrow type as BIGINT.
+    """
+    quoted = f'"{column}"'
+    if pa.types.is_integer(arrow_type):
+        return f"CAST({quoted} AS BIGINT)"
+    if pa.types.is_floating(arrow_type):
+        return f"CAST(ROUND({quoted}) AS BIGINT)"
+    return f"CAST(REGEXP_REPLACE(TRIM(CAST({quoted} AS VARCHAR)), '\\.0+$', '') AS BIGINT)"
@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from pyproj import CRS, Transformer
+
+# ==============================================================================
+# PONTO -> SETOR CENSITÁRIO (point-in-polygon em lote)
+# ==============================================================================
+# Monta UMA vez uma STRtree (shapely 2) sobre os polígonos da malha de setores
+# e responde milhões de pontos por consulta vetorizada:
+#   1. predicate='within': o ponto está dentro do setor;
+#   2. pontos que caem em buracos/bordas da malha (ou no mar, perto da costa)
+#      recebem o setor mais próximo (query_nearest), até MAX_NEAREST_DISTANCE_M.
+#      Se a malha está em graus, o fallback usa uma segunda árvore em METRIC_CRS,
+#      montada só na primeira vez que aparece um ponto fora dos setores.
+#
+# O cache em disco guarda só id + geometria (WKB) da malha em um Parquet
+# enxuto, com a assinatura (tamanho/mtime) do arquivo de origem. A árvore é
+# reconstruída a partir dele em segundos, sem ler os atributos da malha.
+
+BASE_DIR = Path(__file__).parent.parent
+MESH_FILE = BASE_DIR / "data" / "spatial" / "malha_setores_2022_final"
+CACHE_DIR = BASE_DIR / "data" / "spatial" / "sector_locator_cache"
+ID_COLUMN = 'id_setor'
+
+# Pontos de entrada: lat/lon em SIRGAS 2000 (mesmo datum do CNEFE e da malha do IBGE)
+POINTS_CRS = "EPSG:4674"
+# CRS métrico usado para medir a distância do fallback
+METRIC_CRS = "EPSG:5880"
+MAX_NEAREST_DISTANCE_M = 5000
+CHUNK_SIZE = 1_000_000
+
+MATCH_WITHIN = 'within'
+MATCH_NEAREST = 'nearest'
+
+
+def mesh_signature(path):
+    if os.path.isdir(path):
+        # Malha particionada por UF (sector_dataset.py): soma dos arquivos, mtime mais recente
+        files = [os.path.join(root, f) for root, _, names in os.walk(path) for f in names]
+        return {'path': str(path), 'size': sum(os.path.getsize(f) for f in files),
+                'mtime': int(max((os.path.getmtime(f) for f in files), default=0))}
+    return {'path': str(path), 'size': os.path.getsize(path), 'mtime': int(os.path.getmtime(path))}
+
+
+def _read_mesh(mesh_path, id_column):
+    # Só id + geometria; a geometria do GeoParquet já vem em WKB
+    table = pq.read_table(mesh_path, columns=[id_column, 'geometry'])
+    geo_meta = json.loads((table.schema.metadata or {}).get(b'geo', b'{}'))
+    crs = geo_meta.get('columns', {}).get('geometry', {}).get('crs')
+    if isinstance(crs, dict):
+        crs = CRS.from_json_dict(crs).to_string()
+    return table, crs or POINTS_CRS
+
+
+class SectorLocator:
+    """
+    Bulk point-in-polygon assignment of points to census sectors.
+    """
+
+    def __init__(self, ids, geometries, crs):
+        self.ids = np.asarray(ids)
+        self.geometries = geometries
+        self.crs = CRS.from_user_input(crs)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+        self._transformers = {}
+        self._metric_tree = None
+
+    @property
+    def n(self):
+        return len(self.ids)
+
+    # --------------------------------------------------------------------------
+    # CACHE
+    # --------------------------------------------------------------------------
+    @classmethod
+    def load_or_build(cls, mesh_path=MESH_FILE, cache_dir=CACHE_DIR, id_column=ID_COLUMN):
+        """
+        Loads id + geometry from the cache while the mesh file is unchanged,
+        otherwise rebuilds the cache from the mesh.
+        """
+        start = time.time()
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        cache_file = os.path.join(cache_dir, 'sectors.parquet')
+        signature = mesh_signature(mesh_path)
+
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        if meta is not None and meta['mesh'] == signature and meta['id_column'] == id_column:
+            table = pq.read_table(cache_file)
+            crs = meta['crs']
+            print(f"Loading cached sector geometries from {cache_dir}...")
+        else:
+            print(f"Caching sector geometries from {mesh_path}...")
+            table, crs = _read_mesh(mesh_path, id_column)
+            table = table.rename_columns(['id', 'geometry'])
+            os.makedirs(cache_dir, exist_ok=True)
+            pq.write_table(table, cache_file + '.tmp', compression='zstd')
+            os.replace(cache_file + '.tmp', cache_file)
+            with open(meta_path, 'w') as f:
+                json.dump({'mesh': signature, 'id_column': id_column, 'crs': crs, 'n': table.num_rows}, f, indent=2)
+
+        ids = table.column(0).to_numpy(zero_copy_only=False)
+        geometries = shapely.from_wkb(table.column(1).to_numpy(zero_copy_only=False))
+        locator = cls(ids, geometries, crs)
+        print(f"SectorLocator ready: {locator.n:,} sectors in {time.time() - start:.1f}s")
+        return locator
+
+    # --------------------------------------------------------------------------
+    # CONSULTA
+    # --------------------------------------------------------------------------
+    def _transformer(self, src_crs, dst_crs):
+        key = (str(src_crs), str(dst_crs))
+        transformer = self._transformers.get(key)
+        if transformer is None:
+            transformer = Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+            self._transformers[key] = transformer
+        return transformer
+
+    def _metric(self):
+        """
+        Geometries and STRtree in METRIC_CRS for the nearest-sector fallback (built on first use).
+        """
+        if self._metric_tree is None:
+            if self.crs.is_geographic:
+                transformer = self._transformer(self.crs, METRIC_CRS)
+                geometries = shapely.transform(
+                    self.geometries, lambda c: np.column_stack(transformer.transform(c[:, 0], c[:, 1])))
+                self._metric_tree = (transformer, shapely.STRtree(geometries))
+            else:
+                self._metric_tree = (None, self.tree)
+        return self._metric_tree
+
+    def locate_positions(self, lon, lat, crs=POINTS_CRS, max_distance_m=MAX_NEAREST_DISTANCE_M):
+        """
+        Tree positions (-1 = not found), match level and fallback distance in meters.
+        """
+        x = np.asarray(lon, dtype=np.float64)
+        y = np.asarray(lat, dtype=np.float64)
+        n = len(x)
+        positions = np.full(n, -1, dtype=np.int64)
+        level = np.full(n, None, dtype=object)
+        distance = np.full(n, np.nan)
+
+        valid = np.isfinite(x) & np.isfinite(y)
+        if not valid.any():
+            return positions, level, distance
+        if CRS.from_user_input(crs) != self.crs:
+            x, y = self._transformer(crs, self.crs).transform(x, y)
+        points = shapely.points(x, y)
+
+        q = np.flatnonzero(valid)
+        hits = self.tree.query(points[q], predicate='within')
+        if hits.shape[1]:
+            # Ponto exatamente na divisa entre setores não é 'within' de nenhum;
+            # sobreposição (malha inválida) fica com o primeiro setor
+            first = np.unique(hits[0], return_index=True)[1]
+            positions[q[hits[0][first]]] = hits[1][first]
+            level[q[hits[0][first]]] = MATCH_WITHIN
+            distance[q[hits[0][first]]] = 0.0
+
+        gaps = q[positions[q] < 0]
+        if len(gaps) and max_distance_m is not None:
+            transformer, metric_tree = self._metric()
+            gap_points = points[gaps]
+            if transformer is not None:
+                gap_points = shapely.points(*transformer.transform(x[gaps], y[gaps]))
+            near, dist_m = metric_tree.query_nearest(gap_points, max_distance=max_distance_m,
+                                                     return_distance=True, all_matches=False)
+            idx = gaps[near[0]]
+            positions[idx] = near[1]
+            level[idx] = MATCH_NEAREST
+            distance[idx] = dist_m
+        return positions, level, distance
+
+    def locate(self, lon, lat, crs=POINTS_CRS, max_distance_m=MAX_NEAREST_DISTANCE_M):
+        """
+        Returns a DataFrame with id_setor, match ('within', 'nearest' or None) and dist_setor_m.
+        """
+        positions, level, distance = self.locate_positions(lon, lat, crs, max_distance_m)
+        ids = pd.Series(self.ids[np.maximum(positions, 0)])
+        if pd.api.types.is_integer_dtype(ids):
+            # Chave int64: Int64 com <NA> (sem virar float com .0)
+            ids = ids.astype('Int64')
+        ids = ids.where(positions >= 0)
+        return pd.DataFrame({ID_COLUMN: ids, 'match_setor': level, 'dist_setor_m': distance})
+
+    def output_fields(self):
+        """
+        Arrow types of the columns added by locate(): fixed, so a chunk where
+        no point was located (all None) has the same schema as the others.
+        """
+        id_type = pa.int64() if np.issubdtype(self.ids.dtype, np.integer) else pa.string()
+        return [pa.field(ID_COLUMN, id_type), pa.field('match_setor', pa.string()),
+                pa.field('dist_setor_m', pa.float64())]
+
+
+def locate_parquet(input_path, output_path, lon_col='longitude', lat_col='latitude',
+                   locator=None, crs=POINTS_CRS, chunk_size=CHUNK_SIZE,
+                   max_distance_m=MAX_NEAREST_DISTANCE_M):
+    """
+    Streams a Parquet file of points in chunks and writes it back with the sector columns appended.
+    """
+    if locator is None:
+        locator = SectorLocator.load_or_build()
+    pf = pq.ParquetFile(input_path)
+    # Schema explícito: cada chunk é convertido para ele (colunas só com None viram string)
+    schema = pa.schema([f for f in pf.schema_arrow if f.name not in (ID_COLUMN, 'match_setor', 'dist_setor_m')]
+                       + locator.output_fields())
+    writer = None
+    total = 0
+    start = time.time()
+    tmp_path = str(output_path) + '.tmp'
+    try:
+        for batch in pf.iter_batches(batch_size=chunk_size):
+            chunk = batch.to_pandas()
+            located = locator.locate(chunk[lon_col].to_numpy(), chunk[lat_col].to_numpy(), crs, max_distance_m)
+            located.index = chunk.index
+            table = pa.Table.from_pandas(pd.concat([chunk.drop(columns=located.columns, errors='ignore'), located], axis=1),
+                                         preserve_index=False).cast(schema)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, schema, compression='zstd')
+            writer.write_table(table)
+            total += len(chunk)
+            elapsed = time.time() - start
+            print(f"  {total:,} points ({total / max(elapsed, 1e-9) * 60:,.0f} points/min)")
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        os.replace(tmp_path, output_path)
+    return total
+
+
+if __name__ == "__main__":
+    # Uso: python src/sector_locator.py pontos.parquet saida.parquet [coluna_lon] [coluna_lat]
+    if len(sys.argv) < 3:
+        print("Uso: python src/sector_locator.py <entrada.parquet> <saida.parquet> [coluna_lon] [coluna_lat]")
+        sys.exit(1)
+    lon_col = sys.argv[3] if len(sys.argv) > 3 else 'longitude'
+    lat_col = sys.argv[4] if len(sys.argv) > 4 else 'latitude'
+    locate_parquet(sys.argv[1], sys.argv[2], lon_col, lat_col)
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# ==============================================================================
+# SHARED COLUMN STORE (memory-mapped .npy para os workers do joblib)
+# ==============================================================================
+# Em vez de pickar a matriz de features e a matriz de vizinhos para cada tarefa,
+# o processo principal publica cada array UMA vez em disco (.npy) e os workers
+# abrem com np.load(mmap_mode='r'): zero-cópia, páginas compartilhadas pelo
+# page cache do SO. As tarefas recebem apenas caminhos e índices de colunas.
+#
+# A matriz de features é gravada em ordem Fortran (coluna contígua), então
+# ler um lote de colunas toca só as páginas daquelas colunas.
+
+
+class SharedArrayStore:
+    """
+    Directory of memory-mapped arrays shared with worker processes.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            self.directory = tempfile.mkdtemp(prefix='censo_shared_')
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self.directory = directory
+
+    def publish(self, name, array, fortran=False):
+        """
+        Writes `array` once and returns the path workers should attach to.
+        """
+        path = os.path.join(self.directory, f"{name}.npy")
+        array = np.asfortranarray(array) if fortran else np.ascontiguousarray(array)
+        np.save(path, array)
+        return path
+
+    def publish_columns(self, name, frame, columns, dtype=np.float64):
+        """
+        Publishes DataFrame columns as an (N, C) column-major matrix,
+        filling one column at a time to avoid a full intermediate copy.
+        NaN/inf are replaced by 0, as the spatial workers expect.
+        """
+        path = os.path.join(self.directory, f"{name}.npy")
+        matrix = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                           shape=(len(frame), len(columns)), fortran_order=True)
+        for j, col in enumerate(columns):
+            matrix[:, j] = np.nan_to_num(frame[col].to_numpy(dtype=dtype), nan=0.0, posinf=0.0, neginf=0.0)
+        matrix.flush()
+        del matrix
+        return path
+
+    def close(self):
+        """
+        Removes the published files.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(path):
+    """
+    Opens a published array read-only and zero-copy.
+    """
+    return np.load(path, mmap_mode='r')
@@ -0,0 +1,130 @@
+import os
+import re
+import pyarrow.parquet as pq
+from sector_key import find_sector_key, sql_sector_key
+
+# ==============================================================================
+# RESOLUÇÃO CÓDIGO -> COLUNA NO SILVER
+# ==============================================================================
+# process_raw_to_silver.py renomeia cada variável do IBGE para
+# "<descricao_normalizada>_<codigo>" (ex.: total_de_pessoas_v0001). Aqui o
+# schema de cada Parquet é lido UMA vez (só o footer, sem dados) e cada coluna
+# é indexada pelo código exato do sufixo. Assim V00017 nunca casa com V000170,
+# e os códigos que faltam são conhecidos antes de montar qualquer query.
+
+# Sufixo _v1234 / _v01234 (ou coluna que ficou só com o código, sem descrição)
+CODE_SUFFIX = re.compile(r'(?:^|_)(v\d{4,6})$', re.IGNORECASE)
+
+
+class AmbiguousColumnError(ValueError):
+    pass
+
+
+def normalize_code(code):
+    return str(code).strip().lower()
+
+
+def code_map(columns):
+    """
+    {code: [columns]} for every column ending in a variable code. A code with
+    two or more columns is kept as is: it is only an error when someone asks
+    for it (lookup_code), never a silent first match.
+    """
+    mapping = {}
+    for col in columns:
+        m = CODE_SUFFIX.search(col)
+        if m:
+            mapping.setdefault(m.group(1).lower(), []).append(col)
+    return mapping
+
+
+def lookup_code(mapping, code):
+    """
+    The single column of `code` in a code_map, or None. Raises
+    AmbiguousColumnError when the code matches more than one column.
+    """
+    columns = mapping.get(normalize_code(code))
+    if not columns:
+        return None
+    if len(columns) > 1:
+        raise AmbiguousColumnError(f"code {normalize_code(code)} matches both "
+                                   + " and ".join(f"'{c}'" for c in columns))
+    return columns[0]
+
+
+class SchemaResolver:
+    """
+    Resolves variable codes to silver column names, one footer read per file.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self._columns = {}
+        self._codes = {}
+        self._schemas = {}
+
+    def path(self, filename):
+        return os.path.join(self.data_dir, filename)
+
+    def exists(self, filename):
+        return os.path.exists(self.path(filename))
+
+    def columns(self, filename):
+        """
+        Column names of a silver file (empty list if the file does not exist).
+        """
+        if filename not in self._columns:
+            path = self.path(filename)
+            self._schemas[filename] = pq.read_schema(path) if os.path.exists(path) else None
+            self._columns[filename] = self._schemas[filename].names if self._schemas[filename] else []
+        return self._columns[filename]
+
+    def key(self, filename):
+        """
+        (column, DuckDB BIGINT expression) of the sector key of a silver file,
+        whatever its name/type there (CD_SETOR text, 'setor' float, ...).
+        """
+        column = find_sector_key(self.columns(filename))
+        if column is None:
+            raise KeyError(f"{filename}: no sector key column")
+        return column, sql_sector_key(column, self._schemas[filename].field(column).type)
+
+    def codes(self, filename):
+        if filename not in self._codes:
+            self._codes[filename] = code_map(self.columns(filename))
+        return self._codes[filename]
+
+    def resolve(self, filename, code):
+        """
+        Exact column for `code` in `filename`, or None (AmbiguousColumnError if
+        the code matches more than one column).
+        """
+        return lookup_code(self.codes(filename), code)
+
+    def resolve_all(self, requirements):
+        """
+        requirements: {filename: [codes]}. Returns ({filename: {code: column or None}}, unresolved)
+        where unresolved is {filename: [codes]} (missing files list all their codes).
+        """
+        resolved = {}
+        unresolved = {}
+        for filename, codes in requirements.items():
+            table = self.codes(filename)
+            resolved[filename] = {normalize_code(c): lookup_code(table, c) for c in codes}
+            missing = [c for c, col in resolved[filename].items() if col is None]
+            if missing:
+                unresolved[filename] = missing
+        return resolved, unresolved
+
+    def report(self, requirements):
+        """
+        Resolves everything up front and prints what is missing. Returns the resolved map.
+        """
+        resolved, unresolved = self.resolve_all(requirements)
+        total = sum(len(v) for v in resolved.values())
+        missing = sum(len(v) for v in unresolved.values())
+        print(f"Schema: {total - missing}/{total} variable codes resolved in {len(requirements)} files.")
+        for filename, codes in unresolved.items():
+            reason = "file not found" if not self.exists(filename) else "not in schema"
+            print(f"  ⚠️ {filename} ({reason}): {', '.join(c.upper() for c in codes)}")
+        return resolved
@@ -0,0 +1,157 @@
+import numpy as np
+import shapely
+
+# ==============================================================================
+# CONTIGUIDADE QUEEN / ROOK (hash de vértices, sem predicados geométricos)
+# ==============================================================================
+# KNN sobre centróides erra para setores rurais grandes e setores urbanos longos
+# e finos: o vizinho "mais próximo" pelo centróide nem sempre encosta no setor.
+# Contiguidade usa a própria malha, mas testar touches() par a par é inviável
+# para 450k polígonos. Aqui tudo é vetorizado com shapely 2:
+#
+#   1. get_parts / get_rings / get_coordinates: todos os vértices de todos os
+#      anéis de uma vez, com o setor dono de cada vértice.
+#   2. Coordenadas quantizadas (QUANTUM) viram um id inteiro por vértice
+#      (código x * span + y ordenado): o mesmo vértice nos dois setores
+#      vizinhos cai no mesmo id mesmo com ruído de ponto flutuante.
+#   3. Queen: setores que compartilham um id de vértice.
+#      Rook:  setores que compartilham uma aresta (par de ids consecutivos no
+#      anel, sem orientação).
+#   4. Pares (i, j) únicos -> grafo CSR simétrico.
+#
+# Mesma definição do libpysal (vértice/aresta compartilhado exatamente): dois
+# setores que se tocam só no meio de uma aresta (sem vértice em comum) não são
+# vizinhos em nenhum dos dois.
+
+CONTIGUITY_KINDS = ('queen', 'rook')
+# Tamanho da grade de quantização, nas unidades do CRS da malha
+QUANTUM_DEGREES = 1e-7      # ~1 cm (SIRGAS 2000 lat/lon, malha do IBGE)
+QUANTUM_METERS = 0.01
+
+
+def default_quantum(crs):
+    """
+    Quantization step for a mesh CRS (pyproj CRS or None = degrees).
+    """
+    if crs is not None and not crs.is_geographic:
+        return QUANTUM_METERS
+    return QUANTUM_DEGREES
+
+
+def polygon_vertices(geoms):
+    """
+    (coords, ring, owner): every vertex of every ring (exterior and holes) of
+    the (multi)polygons, the ring it belongs to and the position of its polygon
+    in `geoms`.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    parts, part_owner = shapely.get_parts(geoms, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, ring = shapely.get_coordinates(rings, return_index=True)
+    return coords, ring, part_owner[ring_part[ring]]
+
+
+def sorted_unique(codes):
+    """
+    Distinct values of an int64 array (sort + adjacent comparison; much
+    faster than np.unique on tens of millions of values).
+    """
+    codes = np.sort(codes)
+    keep = np.ones(len(codes), dtype=bool)
+    keep[1:] = codes[1:] != codes[:-1]
+    return codes[keep]
+
+
+def dense_ids(codes):
+    """
+    Dense id in [0, distinct) of every int64 code (equal codes, equal ids)
+    and the number of distinct codes.
+    """
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.int64), 0
+    order = np.argsort(codes)
+    ordered = codes[order]
+    new = np.ones(len(codes), dtype=bool)
+    new[1:] = ordered[1:] != ordered[:-1]
+    ids = np.empty(len(codes), dtype=np.int64)
+    ids[order] = np.cumsum(new) - 1
+    return ids, int(new.sum())
+
+
+def vertex_ids(coords, quantum):
+    """
+    Integer id of every quantized coordinate (equal points, equal ids) and
+    the number of distinct vertices.
+    """
+    if len(coords) == 0:
+        return np.zeros(0, dtype=np.int64), 0
+    q = np.round(coords / quantum).astype(np.int64)
+    q -= q.min(axis=0)
+    span = int(q[:, 1].max()) + 1
+    if (int(q[:, 0].max()) + 1) * span >= 2 ** 62:
+        # Extensão grande demais para um código único x * span + y
+        order = np.lexsort((q[:, 1], q[:, 0]))
+        q = q[order]
+        new = np.ones(len(q), dtype=bool)
+        new[1:] = (q[1:] != q[:-1]).any(axis=1)
+        ids = np.empty(len(q), dtype=np.int64)
+        ids[order] = np.cumsum(new) - 1
+        return ids, int(new.sum())
+    return dense_ids(q[:, 0] * span + q[:, 1])
+
+
+def shared_key_pairs(keys, owners, n):
+    """
+    (left, right) owner pairs, left != right, that share at least one key.
+    """
+    # (chave, dono) únicos, agrupados por chave
+    items = sorted_unique(keys * n + owners)
+    item_keys, item_owners = items // n, items % n
+    starts = np.flatnonzero(np.r_[True, item_keys[1:] != item_keys[:-1]])
+    sizes = np.diff(np.r_[starts, len(items)])
+
+    # Só chaves com 2+ donos; cada dono pareado com todos os do seu grupo
+    shared = np.repeat(sizes > 1, sizes)
+    group_size = np.repeat(sizes, sizes)[shared]
+    group_start = np.repeat(starts, sizes)[shared]
+    left = np.repeat(item_owners[shared], group_size)
+    first = np.repeat(np.cumsum(group_size) - group_size, group_size)
+    right = item_owners[np.repeat(group_start, group_size) + np.arange(len(left)) - first]
+    distinct = left != right
+    return left[distinct], right[distinct]
+
+
+def pairs_to_csr(left, right, n):
+    """
+    CSR arrays (indptr, indices) of the unique pairs, rows sorted by neighbor id.
+    """
+    codes = sorted_unique(left.astype(np.int64) * n + right)
+    rows, indices = codes // n, (codes % n).astype(np.int32)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, indices
+
+
+def contiguity_graph(geoms, kind='queen', quantum=QUANTUM_DEGREES):
+    """
+    Queen or Rook contiguity of a sequence of (multi)polygons as CSR arrays
+    (indptr, indices), row i = geoms[i].
+    """
+    if kind not in CONTIGUITY_KINDS:
+        raise ValueError(f"unknown contiguity '{kind}', expected one of {CONTIGUITY_KINDS}")
+    n = len(geoms)
+    coords, ring, owner = polygon_vertices(geoms)
+    vid, n_vertices = vertex_ids(coords, quantum)
+    del coords
+
+    if kind == 'queen':
+        keys, owners = vid, owner
+    else:
+        # Arestas: vértices consecutivos do mesmo anel, sem orientação
+        same_ring = (ring[1:] == ring[:-1]) & (vid[1:] != vid[:-1])
+        a, b = vid[:-1][same_ring], vid[1:][same_ring]
+        # id denso por aresta (o código a*V+b não cabe multiplicado por n)
+        keys, _ = dense_ids(np.minimum(a, b) * n_vertices + np.maximum(a, b))
+        owners = owner[:-1][same_ring]
+    left, right = shared_key_pairs(keys, owners, n)
+    return pairs_to_csr(left, right, n)
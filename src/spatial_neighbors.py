@@ -0,0 +1,188 @@
+import os
+import json
+import hashlib
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+# ==============================================================================
+# NEIGHBOR INDEX (KNN + Raio em uma única passada)
+# ==============================================================================
+# Consulta a árvore uma única vez em max(k) e uma única vez no maior raio.
+# Os vizinhos são guardados em arrays compactos (int32 / float32):
+#   - KNN:  matriz (N, max_k) ordenada por distância, sem o próprio ponto.
+#   - Raio: CSR (indptr, indices, dists), cada linha ordenada por distância,
+#           incluindo o próprio ponto (d=0), como o query_ball_point.
+# Qualquer k <= max_k ou raio <= max_radius é respondido por fatiamento.
+
+DEFAULT_CHUNK_SIZE = 50_000
+# Versão do formato/ordenação: índices salvos com outra versão são refeitos
+INDEX_VERSION = 2
+
+ARRAY_NAMES = ['knn_indices', 'knn_dists', 'radius_indptr', 'radius_indices', 'radius_dists']
+
+
+def coords_fingerprint(coords):
+    """
+    Hash of the coordinate array, used to validate a saved index.
+    """
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    return hashlib.sha1(coords.tobytes()).hexdigest()
+
+
+def knn_query(tree, coords, k):
+    """
+    (dists, indices) of the k nearest points of every coordinate, excluding
+    the point itself, ordered by (distance, id). A tie at the k-th distance
+    is resolved by id too (the KD-tree picks an arbitrary point of the tie).
+    """
+    n = len(coords)
+    extra = 2 if n > k + 1 else 1
+    dists, indices = tree.query(coords, k=k + extra)
+    dists = dists.reshape(n, -1)
+    indices = indices.reshape(n, -1)
+    is_self = indices == np.arange(n)[:, None]
+    order = np.lexsort((indices, dists, is_self), axis=1)[:, :k]
+    out_dists = np.take_along_axis(dists, order, axis=1)
+    out_indices = np.take_along_axis(indices, order, axis=1)
+
+    # Empate no corte (raro: centróides repetidos ou equidistantes): todos os
+    # pontos até a distância do corte, ordenados por (distância, id)
+    if extra == 2:
+        for row in np.flatnonzero(dists[:, -1] == dists[:, -2]):
+            cut = dists[row, -1]
+            ids = np.array(tree.query_ball_point(coords[row], cut * (1 + 1e-9) + 1e-9), dtype=np.int64)
+            ids = ids[ids != row]
+            d = np.sqrt(((tree.data[ids] - coords[row]) ** 2).sum(axis=1))
+            ties = np.lexsort((ids, d))[:k]
+            out_dists[row], out_indices[row] = d[ties], ids[ties]
+    return out_dists, out_indices
+
+
+class NeighborIndex:
+    """
+    Precomputed KNN and fixed-radius neighbors for a set of projected points.
+    """
+
+    def __init__(self, knn_indices, knn_dists, radius_indptr, radius_indices, radius_dists,
+                 max_k, max_radius, fingerprint=None):
+        self.knn_indices = knn_indices
+        self.knn_dists = knn_dists
+        self.radius_indptr = radius_indptr
+        self.radius_indices = radius_indices
+        self.radius_dists = radius_dists
+        self.max_k = int(max_k)
+        self.max_radius = float(max_radius)
+        self.fingerprint = fingerprint
+
+    @property
+    def n(self):
+        return len(self.radius_indptr) - 1
+
+    # --------------------------------------------------------------------------
+    # BUILD
+    # --------------------------------------------------------------------------
+    @classmethod
+    def build(cls, coords, max_k, max_radius, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Queries the KD-tree once at max_k and once at max_radius.
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        n = len(coords)
+        tree = cKDTree(coords)
+
+        # KNN: k+1 para descartar o próprio ponto. Ordem determinística
+        # (distância, id) e o próprio ponto removido explicitamente (com
+        # centróides repetidos ele nem sempre vem primeiro): assim um tile com
+        # halo (diamond_tiles.py) encontra exatamente os mesmos vizinhos.
+        knn_dists, knn_indices = knn_query(tree, coords, max_k)
+        knn_indices = knn_indices.astype(np.int32)
+        knn_dists = knn_dists.astype(np.float32)
+
+        # Raio: uma consulta por bloco de linhas, ordenada por (linha, distância)
+        counts = np.zeros(n, dtype=np.int64)
+        indices_parts = []
+        dists_parts = []
+        for start in range(0, n, chunk_size):
+            stop = min(start + chunk_size, n)
+            pairs = cKDTree(coords[start:stop]).sparse_distance_matrix(tree, max_radius, output_type='ndarray')
+            # (linha, distância, id): empates sempre na mesma ordem
+            order = np.lexsort((pairs['j'], pairs['v'], pairs['i']))
+            counts[start:stop] = np.bincount(pairs['i'], minlength=stop - start)
+            indices_parts.append(pairs['j'][order].astype(np.int32))
+            dists_parts.append(pairs['v'][order].astype(np.float32))
+            del pairs, order
+
+        radius_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=radius_indptr[1:])
+
+        return cls(knn_indices, knn_dists, radius_indptr,
+                   np.concatenate(indices_parts), np.concatenate(dists_parts),
+                   max_k, max_radius, fingerprint=coords_fingerprint(coords))
+
+    # --------------------------------------------------------------------------
+    # QUERIES (fatiamento)
+    # --------------------------------------------------------------------------
+    def knn(self, k):
+        """
+        Returns (dists, indices) of the k nearest neighbors, excluding self.
+        """
+        if k > self.max_k:
+            raise ValueError(f"k={k} is larger than the indexed max_k={self.max_k}")
+        return self.knn_dists[:, :k], self.knn_indices[:, :k]
+
+    def radius(self, r):
+        """
+        Returns the CSR arrays (indptr, indices, dists) of neighbors within r.
+        """
+        if r > self.max_radius:
+            raise ValueError(f"radius={r} is larger than the indexed max_radius={self.max_radius}")
+        if r == self.max_radius:
+            return self.radius_indptr, self.radius_indices, self.radius_dists
+
+        keep = self.radius_dists <= r
+        kept_before = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(keep, out=kept_before[1:])
+        return kept_before[self.radius_indptr], self.radius_indices[keep], self.radius_dists[keep]
+
+    def radius_block(self, start, stop):
+        """
+        CSR arrays at max_radius for rows [start, stop), with a local indptr.
+        """
+        a, b = self.radius_indptr[start], self.radius_indptr[stop]
+        indptr = self.radius_indptr[start:stop + 1] - a
+        return indptr, self.radius_indices[a:b], self.radius_dists[a:b]
+
+    def radius_graph(self, r):
+        """
+        Sparse (N, N) CSR matrix with the distances to neighbors within r.
+        """
+        indptr, indices, dists = self.radius(r)
+        return sparse.csr_matrix((dists, indices, indptr), shape=(self.n, self.n))
+
+    # --------------------------------------------------------------------------
+    # PERSISTÊNCIA
+    # --------------------------------------------------------------------------
+    def save(self, path):
+        """
+        Saves the index as a directory of .npy files plus a meta.json.
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        meta = {
+            'n': self.n,
+            'max_k': self.max_k,
+            'max_radius': self.max_radius,
+            'fingerprint': self.fingerprint,
+            'version': INDEX_VERSION,
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        return cls(max_k=meta['max_k'], max_radius=meta['max_radius'], fingerprint=meta['fingerprint'], **arrays)
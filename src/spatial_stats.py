@@ -0,0 +1,131 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# ==============================================================================
+# ESTATÍSTICAS DE VIZINHANÇA EM LOTE (lag, hetero, inequality, isolation, rank)
+# ==============================================================================
+# Em vez de uma coluna por vez (um gather N x k por coluna, em processos
+# separados), a matriz inteira (N x C, float32 ou float64) é processada em
+# blocos de colunas x blocos de linhas: para cada bloco, um gather de linhas
+# inteiras (Cb colunas contíguas) por vizinho, acumulando soma e soma dos
+# quadrados em float64; todas as estatísticas saem dessas duas somas.
+#
+# Com threads > 1 os blocos de colunas rodam em paralelo em threads (o NumPy
+# solta o GIL no gather e nas reduções): sem cópia da matriz entre processos.
+#
+#   lag        = média dos vizinhos
+#   hetero     = desvio padrão (populacional) dos vizinhos
+#   inequality = hetero / (lag + EPS)                 (coeficiente de variação)
+#   isolation  = |valor - lag|
+#   rank       = (valor - lag) / (hetero + EPS)       (z-score local)
+#
+# K ANINHADOS: com vizinhos ordenados por distância, os k=5 mais próximos são
+# um prefixo dos k=15. Com ks=[...] um único gather até max(ks) acumula as
+# somas ao longo do eixo dos vizinhos e tira um retrato a cada k pedido: as
+# estatísticas de todos os k custam o mesmo que a do maior, e saem idênticas
+# (bit a bit) às de uma execução separada para cada k.
+
+STAT_NAMES = ['lag', 'hetero', 'inequality', 'isolation', 'rank']
+EPS = 1e-6
+DEFAULT_COLUMN_BLOCK = 16
+DEFAULT_ROW_BLOCK = 32_768
+
+
+def derived_stats(own, mean, std):
+    """
+    The five statistics from the row values and the neighbors' mean/std.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inequality = np.nan_to_num(std / (mean + EPS))
+        rank = np.nan_to_num((own - mean) / (std + EPS))
+    return {'lag': mean, 'hetero': std, 'inequality': inequality,
+            'isolation': np.abs(own - mean), 'rank': rank}
+
+
+def _knn_block(values, neighbor_indices, rows, outs, cols, row_block):
+    block = np.ascontiguousarray(values[:, cols])
+    for start in range(0, len(rows), row_block):
+        stop = min(start + row_block, len(rows))
+        # Um gather (linhas, Cb) por vizinho, somando na hora: nunca existe a
+        # cópia (linhas, k, Cb). Somas deslocadas pelo valor do vizinho mais
+        # próximo: a variância E[d²] - E[d]² não perde precisão com médias grandes.
+        ids = np.ascontiguousarray(neighbor_indices[start:stop, :max(outs)].T)
+        shift = block[ids[0]].astype(np.float64)
+        total = np.zeros_like(shift)
+        squares = np.zeros_like(shift)
+        own = block[rows[start:stop]].astype(np.float64)
+        for t in range(len(ids)):
+            if t > 0:
+                d = block[ids[t]] - shift
+                total += d
+                squares += d * d
+            k = t + 1
+            if k not in outs:
+                continue
+            mean_d = total / k
+            mean = shift + mean_d
+            std = np.sqrt(np.maximum(squares / k - mean_d * mean_d, 0.0))
+            for name, array in derived_stats(own, mean, std).items():
+                outs[k][name][start:stop, cols] = array
+
+
+def _graph_block(values, graph, rows, outs, cols, row_block):
+    block = np.ascontiguousarray(values[:, cols])
+    mean, std = graph.mean_std(block)
+    own = block[rows].astype(np.float64)
+    for name, array in derived_stats(own, mean, std).items():
+        outs[None][name][:, cols] = array
+
+
+def neighbor_stats(values, neighbors, rows=None, ks=None, column_block=DEFAULT_COLUMN_BLOCK,
+                   row_block=DEFAULT_ROW_BLOCK, threads=1):
+    """
+    lag/hetero/inequality/isolation/rank of every column of `values` (N, C).
+
+    neighbors: (len(rows), k) KNN neighbor ids into `values`, sorted by
+               distance, or a contiguity graph with len(rows) rows
+               (SpatialWeights: variable number of neighbors, islands get
+               lag = hetero = 0).
+    rows:      positions of the output rows in `values` (default: all).
+    ks:        KNN only: list of k <= neighbors.shape[1]. The statistics of
+               every k come from the first k columns of `neighbors`, in one pass.
+
+    Returns {name: (len(rows), C) float64} in STAT_NAMES order, or
+    {k: {name: ...}} in `ks` order when ks is given.
+    """
+    values = np.asarray(values)
+    if values.ndim == 1:
+        values = values[:, None]
+    n_cols = values.shape[1]
+    rows = np.arange(len(values)) if rows is None else np.asarray(rows)
+
+    if hasattr(neighbors, 'indptr'):
+        if ks is not None:
+            raise ValueError("ks only applies to KNN neighbor arrays")
+        kernel, keys = _graph_block, [None]
+    else:
+        keys = [neighbors.shape[1]] if ks is None else [int(k) for k in ks]
+        if min(keys) < 1 or max(keys) > neighbors.shape[1]:
+            raise ValueError(f"ks must be in [1, {neighbors.shape[1]}], got {list(keys)}")
+        kernel = _knn_block
+    outs = {key: {name: np.empty((len(rows), n_cols)) for name in STAT_NAMES} for key in keys}
+
+    blocks = [slice(i, min(i + column_block, n_cols)) for i in range(0, n_cols, column_block)]
+    if threads > 1 and len(blocks) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for future in [executor.submit(kernel, values, neighbors, rows, outs, cols, row_block) for cols in blocks]:
+                future.result()
+    else:
+        for cols in blocks:
+            kernel(values, neighbors, rows, outs, cols, row_block)
+    return outs if ks is not None else outs[keys[0]]
+
+
+def prefix_means(matrix, ks):
+    """
+    {k: mean of the first k columns of `matrix`} for every k in ks, from one
+    cumulative sum (float64) along the columns. E.g. the mean neighbor
+    distance for every k from the (N, max k) KNN distances.
+    """
+    cumulative = np.cumsum(np.asarray(matrix)[:, :max(ks)], axis=1, dtype=np.float64)
+    return {k: cumulative[:, k - 1] / k for k in ks}
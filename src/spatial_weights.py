@@ -0,0 +1,310 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from lineage import LineageManifest, params_hash
+from sector_key import normalize_sector_key
+from spatial_neighbors import NeighborIndex, knn_query, coords_fingerprint
+from spatial_contiguity import contiguity_graph, default_quantum, CONTIGUITY_KINDS
+
+# ==============================================================================
+# CACHE DE MATRIZES DE PESOS (KNN / Raio / Contiguidade)
+# ==============================================================================
+# Iterar nas definições das features não deve refazer o grafo de vizinhança do
+# país inteiro. Cada grafo é salvo uma vez em
+#
+#   <cache>/<tipo>_<params>_<hash>/   arrays .npy + meta.json
+#
+# onde <hash> cobre o SHA-256 da malha, o CRS, o tipo (knn, index, queen,
+# rook), os parâmetros (k, raio) e o conjunto/ordem dos setores (chaves int64):
+# mudar qualquer um deles gera outra entrada, e nunca se lê um grafo velho.
+# A leitura é memory-mapped (np.load(mmap_mode='r')): abrir um grafo de 450k
+# setores não copia nada para a memória até ele ser usado.
+#
+# O SHA-256 da malha (centenas de MB) é calculado uma vez e fica no
+# _lineage.json do cache, reaproveitado enquanto tamanho e mtime não mudarem.
+
+# Aumente quando o formato ou o cálculo de alguma entrada mudar
+WEIGHTS_VERSION = 1
+ARRAY_NAMES = ['indptr', 'indices', 'dists']
+
+
+def keys_fingerprint(keys):
+    """
+    Hash of the sector keys (set and order of the rows of a graph).
+    """
+    keys = np.ascontiguousarray(normalize_sector_key(keys))
+    return hashlib.sha1(keys.tobytes()).hexdigest()
+
+
+def read_mesh_geometries(mesh_path, keys, key='code_tract', batch_size=50_000):
+    """
+    GeoSeries of the mesh polygons of `keys`, in that order (a repeated key
+    keeps its first polygon). Raises KeyError for keys missing in the mesh.
+    """
+    import pandas as pd
+    import geopandas as gpd
+    import pyarrow.parquet as pq
+    from sector_centroids import mesh_crs
+
+    wanted = pd.Index(normalize_sector_key(keys))
+    found_keys, found_wkb = [], []
+    for batch in pq.ParquetFile(mesh_path).iter_batches(columns=[key, 'geometry'], batch_size=batch_size):
+        batch_keys = normalize_sector_key(batch.column(key).to_pandas())
+        inside = wanted.get_indexer(batch_keys) >= 0
+        found_keys.append(batch_keys[inside])
+        found_wkb.append(batch.column('geometry').to_numpy(zero_copy_only=False)[inside])
+
+    found = pd.Index(np.concatenate(found_keys))
+    wkb = np.concatenate(found_wkb)
+    first = ~found.duplicated(keep='first')
+    found, wkb = found[first], wkb[first]
+    positions = found.get_indexer(wanted)
+    if (positions < 0).any():
+        missing = wanted[positions < 0]
+        raise KeyError(f"{len(missing)} sectors not in {mesh_path}, e.g. {list(missing[:3])}")
+    return gpd.GeoSeries.from_wkb(wkb[positions], crs=mesh_crs(mesh_path))
+
+
+class SpatialWeights:
+    """
+    Binary neighbor graph in CSR arrays (indptr, indices and optionally the
+    distances), row i = i-th sector of the keys it was built for.
+    """
+
+    def __init__(self, indptr, indices, dists=None, kind=None, params=None, path=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.dists = dists
+        self.kind = kind
+        self.params = params or {}
+        # Pasta no cache (workers reabrem o grafo memory-mapped por ela)
+        self.path = path
+
+    @property
+    def n(self):
+        return len(self.indptr) - 1
+
+    @property
+    def cardinalities(self):
+        return np.diff(self.indptr)
+
+    @property
+    def islands(self):
+        return np.flatnonzero(self.cardinalities == 0)
+
+    # --------------------------------------------------------------------------
+    # BUILD
+    # --------------------------------------------------------------------------
+    @classmethod
+    def from_knn(cls, dists, indices, **params):
+        """
+        From the (N, k) matrices of NeighborIndex.knn / knn_query.
+        """
+        n, k = indices.shape
+        indptr = np.arange(0, n * k + 1, k, dtype=np.int64)
+        return cls(indptr, np.ascontiguousarray(indices, dtype=np.int32).ravel(),
+                   np.ascontiguousarray(dists, dtype=np.float32).ravel(), kind='knn', params=dict(params, k=k))
+
+    @classmethod
+    def from_sparse(cls, matrix, kind=None, **params):
+        """
+        From a scipy sparse adjacency matrix (the values are ignored).
+        """
+        matrix = sparse.csr_matrix(matrix)
+        matrix.sort_indices()
+        return cls(matrix.indptr.astype(np.int64), matrix.indices.astype(np.int32), kind=kind, params=params)
+
+    # --------------------------------------------------------------------------
+    # USO
+    # --------------------------------------------------------------------------
+    def sparse(self, transform='r'):
+        """
+        (N, N) float64 CSR matrix: 'b' binary, 'r' row-standardized (islands = 0).
+        """
+        data = np.ones(len(self.indices), dtype=np.float64)
+        if transform == 'r':
+            cards = self.cardinalities
+            data /= np.repeat(np.where(cards > 0, cards, 1), cards)
+        elif transform != 'b':
+            raise ValueError(f"unknown transform '{transform}', expected 'b' or 'r'")
+        return sparse.csr_matrix((data, self.indices, self.indptr), shape=(self.n, self.n))
+
+    def mean_std(self, values):
+        """
+        Mean and population std of the neighbors' values per row, for a
+        vector or an (N, C) matrix (all columns at once); 0 for islands.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        cards = self.cardinalities
+        nnz = len(self.indices)
+        # Soma por linha do grafo como produto esparso: uma passada para todas as colunas
+        row_sum = sparse.csr_matrix((np.ones(nnz), np.arange(nnz), self.indptr), shape=(self.n, nnz))
+        neighbor_values = values[self.indices]
+        counts = np.where(cards > 0, cards, 1)
+        if values.ndim == 2:
+            counts = counts[:, None]
+        mean = (row_sum @ neighbor_values) / counts
+        deviations = neighbor_values - np.repeat(mean, cards, axis=0)
+        return mean, np.sqrt((row_sum @ deviations ** 2) / counts)
+
+    def lag(self, values, transform='r'):
+        """
+        Spatial lag (mean of the neighbors with 'r') of a vector or (N, C) matrix.
+        """
+        return self.sparse(transform) @ np.asarray(values, dtype=np.float64)
+
+    def to_W(self, transform='r'):
+        """
+        libpysal W (ids 0..N-1, islands kept), e.g. for esda.Moran_Local.
+        """
+        from libpysal.weights import W
+        rows = np.split(np.asarray(self.indices), np.asarray(self.indptr)[1:-1])
+        w = W({i: row.tolist() for i, row in enumerate(rows)}, id_order=list(range(self.n)), silence_warnings=True)
+        w.transform = transform
+        return w
+
+    # --------------------------------------------------------------------------
+    # PERSISTÊNCIA
+    # --------------------------------------------------------------------------
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAY_NAMES:
+            if getattr(self, name) is not None:
+                np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        meta = {'n': self.n, 'kind': self.kind, 'params': self.params, 'version': WEIGHTS_VERSION}
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {}
+        for name in ARRAY_NAMES:
+            file_path = os.path.join(path, f"{name}.npy")
+            arrays[name] = np.load(file_path, mmap_mode=mmap_mode) if os.path.exists(file_path) else None
+        return cls(kind=meta['kind'], params=meta['params'], path=path, **arrays)
+
+
+class WeightsCache:
+    """
+    Neighbor graphs of one mesh, saved once and memory-mapped afterwards.
+    """
+
+    def __init__(self, directory, mesh_path, mesh_hash=None):
+        self.directory = directory
+        self.mesh_path = mesh_path
+        os.makedirs(directory, exist_ok=True)
+        if mesh_hash is None:
+            lineage = LineageManifest(directory)
+            fp = lineage.fingerprint(mesh_path)
+            mesh_hash = fp.get('sha256') or fp.get('listing')
+            if mesh_hash is None:
+                raise FileNotFoundError(f"mesh not found: {mesh_path}")
+            # Registra o hash só quando a malha mudou: as próximas execuções
+            # não relêem a malha e o _lineage.json não é reescrito à toa
+            inputs, params = {'mesh': mesh_path}, {'version': WEIGHTS_VERSION}
+            if lineage.changed_inputs(directory, inputs, params):
+                lineage.record(directory, inputs, params)
+        # Workers recebem o hash pronto (não tocam no _lineage.json)
+        self.mesh_hash = mesh_hash
+
+    # --------------------------------------------------------------------------
+    # ENTRADAS
+    # --------------------------------------------------------------------------
+    def entry_path(self, kind, keys, crs=None, **params):
+        """
+        Directory of the graph of `kind` for these keys, CRS and params.
+        """
+        described = {
+            'version': WEIGHTS_VERSION,
+            'mesh': self.mesh_hash,
+            'crs': crs,
+            'kind': kind,
+            'params': params,
+            'keys': keys_fingerprint(keys),
+        }
+        label = '_'.join([kind] + [f"{name}{value:g}" for name, value in sorted(params.items())])
+        return os.path.join(self.directory, f"{label}_{params_hash(described)[:16]}")
+
+    @staticmethod
+    def is_complete(path):
+        return os.path.exists(os.path.join(path, 'meta.json'))
+
+    def _store(self, path, obj):
+        """
+        Saves into a temporary directory and renames it: an interrupted build
+        (or two workers building the same entry) never leaves a partial entry.
+        """
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        obj.save(tmp_path)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Outro processo gravou a mesma entrada primeiro
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not self.is_complete(path):
+                raise
+
+    # --------------------------------------------------------------------------
+    # GRAFOS
+    # --------------------------------------------------------------------------
+    def neighbor_index(self, keys, coords, crs, max_k, max_radius):
+        """
+        NeighborIndex (KNN up to max_k + radius up to max_radius) of the points
+        of `keys`, memory-mapped from the cache or built and saved.
+        """
+        path = self.entry_path('index', keys, crs, k=max_k, r=max_radius)
+        if not self.is_complete(path):
+            print(f"Building NeighborIndex (k={max_k}, radius={max_radius}m) -> {path}")
+            self._store(path, NeighborIndex.build(coords, max_k, max_radius))
+        index = NeighborIndex.load(path, mmap_mode='r')
+        if index.fingerprint != coords_fingerprint(coords):
+            raise ValueError(f"cached NeighborIndex at {path} does not match the coordinates; delete it")
+        return index
+
+    def knn(self, keys, coords, crs, k):
+        """
+        KNN graph (k neighbors, excluding self, ordered by (distance, id)).
+        """
+        path = self.entry_path('knn', keys, crs, k=k)
+        if not self.is_complete(path):
+            print(f"Building KNN weights (k={k}) -> {path}")
+            coords = np.asarray(coords, dtype=np.float64)
+            dists, indices = knn_query(cKDTree(coords), coords, k)
+            self._store(path, SpatialWeights.from_knn(dists, indices))
+        return SpatialWeights.load(path)
+
+    def contiguity(self, keys, kind='queen', key='code_tract', quantum=None):
+        """
+        Queen (shared vertex) or Rook (shared edge) contiguity of the mesh
+        polygons of `keys` (src/spatial_contiguity.py). quantum: vertex
+        snapping step in mesh units (default from the mesh CRS).
+        """
+        if kind not in CONTIGUITY_KINDS:
+            raise ValueError(f"unknown contiguity '{kind}', expected one of {CONTIGUITY_KINDS}")
+        if quantum is None:
+            from sector_centroids import mesh_crs
+            quantum = default_quantum(mesh_crs(self.mesh_path))
+        path = self.entry_path(kind, keys, quantum=quantum)
+        if not self.is_complete(path):
+            print(f"Building {kind} contiguity -> {path}")
+            geoms = read_mesh_geometries(self.mesh_path, keys, key)
+            self._store(path, build_contiguity(geoms, kind, quantum))
+        return SpatialWeights.load(path)
+
+
+def build_contiguity(geoms, kind='queen', quantum=None):
+    """
+    Contiguity SpatialWeights of a GeoSeries (row order kept).
+    """
+    if quantum is None:
+        quantum = default_quantum(geoms.crs)
+    indptr, indices = contiguity_graph(geoms.values, kind, quantum)
+    return SpatialWeights(indptr, indices, kind=kind, params={'quantum': quantum})
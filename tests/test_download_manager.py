@@ -0,0 +1,164 @@
+import io
+import os
+import sys
+import zipfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+import download_manager
+from download_manager import DownloadManager, DownloadError, MANIFEST_NAME
+
+
+# ==============================================================================
+# SERVIDOR LOCAL (stand-in do servidor do IBGE, com suporte a Range)
+# ==============================================================================
+class FileHandler(BaseHTTPRequestHandler):
+    server_version = 'StandIn/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status, body_length, extra=None):
+        self.send_response(status)
+        if body_length is not None:
+            self.send_header('Content-Length', str(body_length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"v1"')
+        for name, value in (extra or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.server.requests.append(('HEAD', self.path, None))
+        if self.server.head_failures:
+            self.server.head_failures -= 1
+            self._headers(503, 0)
+            return
+        data = self.server.files.get(self.path.lstrip('/'))
+        if data is None:
+            self._headers(404, 0)
+            return
+        self._headers(200, len(data) if self.server.head_length else None)
+
+    def do_GET(self):
+        requested = self.headers.get('Range')
+        self.server.requests.append(('GET', self.path, requested))
+        data = self.server.files.get(self.path.lstrip('/'))
+        if data is None:
+            self._headers(404, 0)
+            return
+        if requested and not self.server.ignore_range:
+            start = int(requested.split('=', 1)[1].rstrip('-'))
+            if start >= len(data):
+                self._headers(416, 0, {'Content-Range': f'bytes */{len(data)}'})
+                return
+            body = data[start:]
+            self._headers(206, len(body), {'Content-Range': f'bytes {start}-{len(data) - 1}/{len(data)}'})
+        else:
+            body = data
+            self._headers(200, len(body))
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+    httpd.files = {}
+    httpd.requests = []
+    httpd.ignore_range = False
+    httpd.head_length = True
+    httpd.head_failures = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}'
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(download_manager.time, 'sleep', lambda seconds: None)
+
+
+def make_zip(size=200_000):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr('dados.csv', os.urandom(size))
+    return buffer.getvalue()
+
+
+def gets(server):
+    return [r for r in server.requests if r[0] == 'GET']
+
+
+# ==============================================================================
+# TESTES
+# ==============================================================================
+def test_fresh_download(server, tmp_path):
+    server.files['a.zip'] = data = make_zip()
+    path = DownloadManager(str(tmp_path), max_workers=1).download(f'{server.url}/a.zip')
+    assert open(path, 'rb').read() == data
+    assert not os.path.exists(path + '.part')
+    assert os.path.exists(tmp_path / MANIFEST_NAME)
+    # Segunda execução: já no manifesto, nenhum GET
+    DownloadManager(str(tmp_path)).download(f'{server.url}/a.zip')
+    assert len(gets(server)) == 1
+
+
+def test_resume_from_partial_part(server, tmp_path):
+    server.files['a.zip'] = data = make_zip()
+    (tmp_path / 'a.zip.part').write_bytes(data[:70_000])
+    path = DownloadManager(str(tmp_path)).download(f'{server.url}/a.zip')
+    assert open(path, 'rb').read() == data
+    assert gets(server)[0][2] == 'bytes=70000-'
+
+
+def test_server_ignoring_range_restarts(server, tmp_path):
+    # Anuncia Accept-Ranges mas responde 200 com o arquivo inteiro
+    server.files['a.zip'] = data = make_zip()
+    server.ignore_range = True
+    (tmp_path / 'a.zip.part').write_bytes(data[:70_000])
+    path = DownloadManager(str(tmp_path)).download(f'{server.url}/a.zip')
+    assert open(path, 'rb').read() == data
+    assert gets(server)[0][2] == 'bytes=70000-'
+
+
+def test_corrupt_zip_fails_verification(server, tmp_path):
+    data = bytearray(make_zip())
+    data[1000] ^= 0xFF  # byte dentro dos dados do membro: CRC não confere
+    server.files['a.zip'] = bytes(data)
+    with pytest.raises(DownloadError, match='CRC'):
+        DownloadManager(str(tmp_path), max_retries=2).download(f'{server.url}/a.zip')
+    assert not os.path.exists(tmp_path / 'a.zip')
+    assert not os.path.exists(tmp_path / 'a.zip.part')
+    assert len(gets(server)) == 2
+
+
+def test_complete_part_is_verified_without_get(server, tmp_path):
+    server.files['a.zip'] = data = make_zip()
+    (tmp_path / 'a.zip.part').write_bytes(data)
+    path = DownloadManager(str(tmp_path)).download(f'{server.url}/a.zip')
+    assert open(path, 'rb').read() == data
+    assert gets(server) == []
+
+
+def test_complete_part_with_416(server, tmp_path):
+    # Sem Content-Length no HEAD o tamanho é desconhecido: o Range vai
+    # além do fim e o servidor responde 416
+    server.files['a.zip'] = data = make_zip()
+    server.head_length = False
+    (tmp_path / 'a.zip.part').write_bytes(data)
+    path = DownloadManager(str(tmp_path)).download(f'{server.url}/a.zip')
+    assert open(path, 'rb').read() == data
+    assert gets(server)[0][2] == f'bytes={len(data)}-'
+
+
+def test_transient_head_error_is_retried(server, tmp_path):
+    server.files['a.zip'] = data = make_zip()
+    server.head_failures = 1
+    path = DownloadManager(str(tmp_path)).download(f'{server.url}/a.zip')
+    assert open(path, 'rb').read() == data